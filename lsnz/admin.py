@@ -1,29 +1,103 @@
-from django.contrib import admin
+from datetime import timedelta
+
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db.models import Avg, Count, Max, Min, Q
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import redirect
+from django.template.defaultfilters import filesizeformat
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.utils.translation import gettext_lazy as _
+from django.views.decorators.http import require_http_methods
+
+from .archive import restore_tournament
+from .forms import CsvImportForm, MazeMapAdminForm, PlayerAdminChangeForm, SalesReportForm, UploadValidationModelForm
+from .grading import apply_grade_changes, suggest_grade_changes
+from .importers import PassImporter, PlayerImporter, RegistrationImporter
+from .mail import announce_tournaments
+from .sales import monthly_sales, pass_days, refresh_pass_sales, sales_totals, write_sales_csv
+from .schedule import tournament_clashes
+from .stats import refresh_player_stats
 
 # Register your models here.
 from .models import (
+    ChunkedUpload,
     Event,
     Format,
+    Game,
+    GameResult,
     Grade,
+    Job,
     MazeMap,
     Pass,
     Player,
     Post,
+    QueuedEmail,
     Registration,
     Settings,
     Site,
     System,
     Team,
     Tournament,
+    TournamentArchive,
     TournamentSeries,
 )
+from .uploads import image_upload_limit, sniff_image_type
 
 admin.site.site_title = 'LSNZ'
 admin.site.site_header = 'LSNZ administration'
 
-class PlayerAdmin(UserAdmin):
+class CsvImportMixin:
+    """Adds an "Import CSV" page to a model admin, backed by ``importer_class``."""
+    importer_class = None
+    change_list_template = 'admin/lsnz/change_list_import.html'
+
+    def get_urls(self):
+        info = self.opts.app_label, self.opts.model_name
+        return [
+            path('import/', self.admin_site.admin_view(self.import_csv_view), name='%s_%s_import' % info),
+        ] + super().get_urls()
+
+    def import_csv_view(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        result = None
+        form = CsvImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            importer = self.importer_class(form.cleaned_data['csv_file'])
+            try:
+                result = importer.run(dry_run=form.cleaned_data['dry_run'])
+            except ValidationError as e:
+                form.add_error('csv_file', e)
+            else:
+                if not result.dry_run and result.ok:
+                    self.message_user(
+                        request,
+                        f'Imported {result.created} {self.opts.verbose_name_plural}.',
+                        messages.SUCCESS,
+                    )
+                    info = self.opts.app_label, self.opts.model_name
+                    return redirect(reverse('admin:%s_%s_changelist' % info))
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.opts,
+            'title': f'Import {self.opts.verbose_name_plural}',
+            'form': form,
+            'result': result,
+            'columns': self.importer_class.columns,
+            'required_columns': self.importer_class.required_columns,
+        }
+        return TemplateResponse(request, 'admin/lsnz/csv_import.html', context)
+
+class PlayerAdmin(CsvImportMixin, UserAdmin):
+    form = PlayerAdminChangeForm
+
     # The fields to be used in displaying the User model in admin
     list_display = ('email', 'alias', 'first_name', 'last_name', 'grade', 'is_staff', 'playing_since')
     list_filter = ('is_staff', 'is_superuser', 'is_active', 'grade', 'home_site', 'date_joined')
@@ -54,41 +128,323 @@ class PlayerAdmin(UserAdmin):
     # Make playing_since read-only since it's auto_now_add
     readonly_fields = ('playing_since', 'date_joined', 'last_login')
 
+    importer_class = PlayerImporter
+    change_list_template = 'admin/lsnz/player/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('grading/', self.admin_site.admin_view(self.grading_view), name='lsnz_player_grading'),
+        ] + super().get_urls()
+
+    def grading_view(self, request):
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+
+        changes = suggest_grade_changes()
+        if request.method == 'POST':
+            accepted = set(request.POST.getlist('accept'))
+            updated = apply_grade_changes(
+                [change for change in changes if f'{change.player.pk}:{change.suggested.pk}' in accepted]
+            )
+            self.message_user(request, f'Updated the grade of {updated} player(s).', messages.SUCCESS)
+            return redirect(reverse('admin:lsnz_player_grading'))
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.opts,
+            'title': 'Grading review',
+            'changes': changes,
+            'grades': Grade.objects.filter(percentile__isnull=False).order_by('-points'),
+        }
+        return TemplateResponse(request, 'admin/lsnz/grading.html', context)
+
+class PostAdmin(admin.ModelAdmin):
+    form = UploadValidationModelForm
+
+class SystemAdmin(admin.ModelAdmin):
+    form = UploadValidationModelForm
+
+class GradeAdmin(admin.ModelAdmin):
+    list_display = ('letter', 'points', 'percentile', 'description')
+    ordering = ('-points',)
+
 class EventInline(admin.TabularInline):
     model = Event
     extra = 1
-    fields = ('start_time', 'end_time', 'format', 'points_cap', 'settings')
+    fields = ('start_time', 'end_time', 'format', 'points_cap', 'settings', 'registration_count', 'paid_count')
+    readonly_fields = ('registration_count', 'paid_count')
 
 class TournamentAdmin(admin.ModelAdmin):
     list_display = ('name', 'site', 'start_date', 'end_date', 'system')
     list_filter = ('site', 'system', 'start_date')
     search_fields = ('name', 'site__name')
     inlines = [EventInline]
+    actions = ['announce']
+    change_form_template = 'admin/lsnz/tournament/change_form.html'
+
+    def get_urls(self):
+        return [
+            path('<path:object_id>/clashes/', self.admin_site.admin_view(self.clashes_view), name='lsnz_tournament_clashes'),
+        ] + super().get_urls()
+
+    def clashes_view(self, request, object_id):
+        tournament = self.get_object(request, object_id)
+        if tournament is None:
+            raise Http404('No such tournament.')
+        if not self.has_view_permission(request, tournament):
+            raise PermissionDenied
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.opts,
+            'title': f'Schedule clashes: {tournament}',
+            'original': tournament,
+            'clashes': tournament_clashes(tournament),
+        }
+        return TemplateResponse(request, 'admin/lsnz/schedule_clashes.html', context)
+
+    @admin.action(description='Announce selected tournaments to all players')
+    def announce(self, request, queryset):
+        announce_tournaments.enqueue([
+            [tournament.pk, request.build_absolute_uri(reverse('lsnz:tournament_detail', kwargs={'slug': tournament.slug}))]
+            for tournament in queryset
+        ])
+        self.message_user(request, 'Announcements are being queued for delivery.', messages.SUCCESS)
+
+class TournamentArchiveAdmin(admin.ModelAdmin):
+    list_display = ('tournament', 'archived_at', 'participant_count', 'team_count', 'game_count')
+    search_fields = ('tournament__name',)
+    exclude = ('standings', 'rows')
+    actions = ['restore']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description='Restore selected tournaments to the live tables')
+    def restore(self, request, queryset):
+        archives = list(queryset.select_related('tournament'))
+        for archive in archives:
+            restore_tournament(archive.tournament)
+        self.message_user(request, f'Restored {len(archives)} tournament(s).', messages.SUCCESS)
+
+class GameResultInline(admin.TabularInline):
+    model = GameResult
+    extra = 10
+    autocomplete_fields = ('player',)
 
-class RegistrationAdmin(admin.ModelAdmin):
+class GameAdmin(admin.ModelAdmin):
+    list_display = ('event', 'number', 'played_at')
+    list_filter = ('event__tournament',)
+    inlines = [GameResultInline]
+
+class RegistrationAdmin(CsvImportMixin, admin.ModelAdmin):
     list_display = ('player', 'event', 'team')
     list_filter = ('player', 'event')
+    importer_class = RegistrationImporter
+
+class PassAdmin(CsvImportMixin, admin.ModelAdmin):
+    list_display = ('player', 'pass_type', 'home_site', 'start_date', 'end_date', 'price_paid', 'refunded_at')
+    list_filter = ('pass_type', 'home_site', ('refunded_at', admin.EmptyFieldListFilter))
+    search_fields = ('player__alias', 'player__email')
+    importer_class = PassImporter
+    change_list_template = 'admin/lsnz/pass/change_list.html'
+    actions = ['refund']
+
+    def get_urls(self):
+        return [
+            path('sales/', self.admin_site.admin_view(self.sales_view), name='lsnz_pass_sales'),
+        ] + super().get_urls()
+
+    @admin.action(description='Refund selected passes')
+    def refund(self, request, queryset):
+        passes = list(
+            queryset.filter(refunded_at__isnull=True).values('pk', 'player', 'purchase_date', 'start_date', 'end_date')
+        )
+        now = timezone.now()
+        Pass.objects.filter(pk__in=[row['pk'] for row in passes]).update(refunded_at=now, updated_at=now)
+        # update() sends no signals
+        refresh_pass_sales(set().union(*(pass_days(row) for row in passes)))
+        refresh_player_stats({row['player'] for row in passes})
+        self.message_user(request, f'Refunded {len(passes)} pass(es).', messages.SUCCESS)
+
+    def sales_view(self, request):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+
+        today = timezone.localdate()
+        form = SalesReportForm(request.GET or {'start': today.replace(month=1, day=1), 'end': today})
+        totals = months = None
+        if form.is_valid():
+            start, end = form.cleaned_data['start'], form.cleaned_data['end']
+            if request.GET.get('format') == 'csv':
+                response = HttpResponse(content_type='text/csv')
+                response['Content-Disposition'] = f'attachment; filename="pass-sales-{start}-{end}.csv"'
+                write_sales_csv(response, start, end)
+                return response
+            totals = sales_totals(start, end)
+            months = monthly_sales(start, end)
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.opts,
+            'title': 'Pass sales',
+            'form': form,
+            'totals': totals,
+            'months': months,
+        }
+        return TemplateResponse(request, 'admin/lsnz/pass_sales.html', context)
+
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('subject', 'recipients')
+    readonly_fields = ('message', 'attempts', 'last_error', 'created_at', 'sent_at')
+    actions = ['retry_now']
+
+    @admin.action(description='Retry selected emails now')
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status=QueuedEmail.SENT).update(
+            status=QueuedEmail.QUEUED, next_attempt_at=timezone.now(), claim_token=None
+        )
+        self.message_user(request, f'{updated} email(s) will be retried.', messages.SUCCESS)
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'priority', 'run_at', 'attempts', 'duration', 'worker')
+    list_filter = ('status', 'name')
+    readonly_fields = (
+        'attempts', 'locked_until', 'worker', 'last_error', 'created_at', 'started_at', 'finished_at', 'duration',
+    )
+    change_list_template = 'admin/lsnz/job/change_list.html'
+    actions = ['retry_now']
+
+    def changelist_view(self, request, extra_context=None):
+        finished = Q(status__in=[Job.DONE, Job.FAILED])
+        queue = (
+            Job.objects.values('name')
+            .annotate(
+                queued=Count('pk', filter=Q(status=Job.QUEUED)),
+                due=Count('pk', filter=Q(status=Job.QUEUED, run_at__lte=timezone.now())),
+                running=Count('pk', filter=Q(status=Job.RUNNING)),
+                failed=Count('pk', filter=Q(status=Job.FAILED)),
+                done=Count('pk', filter=Q(status=Job.DONE)),
+                oldest_due=Min('run_at', filter=Q(status=Job.QUEUED, run_at__lte=timezone.now())),
+                average_duration=Avg('duration', filter=finished),
+                max_duration=Max('duration', filter=finished),
+            )
+            .order_by('name')
+        )
+        return super().changelist_view(request, {'job_queue': queue, **(extra_context or {})})
+
+    @admin.action(description='Retry selected jobs now')
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status=Job.RUNNING).update(
+            status=Job.QUEUED, run_at=timezone.now(), attempts=0
+        )
+        self.message_user(request, f'{updated} job(s) will be retried.', messages.SUCCESS)
 
 class MazeMapInline(admin.TabularInline):
     model = MazeMap
+    form = MazeMapAdminForm
     extra = 1
-    fields = ('image', 'date')
+    fields = ('image', 'chunked_upload', 'date')
 
 class SiteAdmin(admin.ModelAdmin):
-    list_display = ('name', 'country', 'system')
+    list_display = ('name', 'country', 'system', 'latitude', 'longitude')
     search_fields = ('name', 'country')
     inlines = [MazeMapInline]
 
+    # Chunks are sent one request at a time; abandoned uploads are removed after this
+    chunked_upload_expiry = timedelta(days=1)
+
+    def get_urls(self):
+        return [
+            path(
+                'chunked-upload/',
+                self.admin_site.admin_view(self.chunked_upload_view),
+                name='lsnz_site_chunked_upload',
+            ),
+        ] + super().get_urls()
+
+    def get_formset_kwargs(self, request, obj, inline, prefix):
+        kwargs = super().get_formset_kwargs(request, obj, inline, prefix)
+        if isinstance(inline, MazeMapInline):
+            kwargs['form_kwargs'] = {'user': request.user}
+        return kwargs
+
+    @staticmethod
+    def chunked_upload_response(upload, status=200):
+        return JsonResponse({'upload_id': str(upload.pk), 'offset': upload.offset}, status=status)
+
+    @staticmethod
+    def get_chunked_upload(request):
+        try:
+            return ChunkedUpload.objects.get(pk=request.GET.get('upload_id'), user=request.user)
+        except (ChunkedUpload.DoesNotExist, ValidationError):
+            raise Http404('No such upload.')
+
+    @method_decorator(require_http_methods(['GET', 'POST']))
+    def chunked_upload_view(self, request):
+        """
+        Receive a maze map in pieces. GET ?upload_id= reports how much has
+        arrived so a dropped upload can resume; POST appends the request body
+        at ?offset= (starting a new upload when no upload_id is given).
+        """
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+
+        if request.method == 'GET':
+            return self.chunked_upload_response(self.get_chunked_upload(request))
+
+        try:
+            offset = int(request.GET['offset'])
+            size = int(request.GET['size'])
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'offset and size are required.'}, status=400)
+
+        if request.GET.get('upload_id'):
+            upload = self.get_chunked_upload(request)
+        else:
+            limit = image_upload_limit('mazemap_set-0-image')
+            if limit and size > limit:
+                return JsonResponse({'error': f'Maze maps must be smaller than {filesizeformat(limit)}.'}, status=400)
+            for expired in ChunkedUpload.objects.filter(created_at__lt=timezone.now() - self.chunked_upload_expiry):
+                expired.discard()
+            upload = ChunkedUpload.objects.create(
+                user=request.user, filename=request.GET.get('filename', 'maze-map')[:255], size=size
+            )
+
+        if offset != upload.offset:
+            # The client is out of step, e.g. a chunk was sent twice. Tell it where to carry on.
+            return self.chunked_upload_response(upload, status=409)
+
+        chunk = request.body
+        if upload.offset + len(chunk) > upload.size:
+            upload.discard()
+            return JsonResponse({'error': 'More data was sent than the declared file size.'}, status=400)
+        if upload.offset == 0 and sniff_image_type(chunk) is None:
+            upload.discard()
+            return JsonResponse({'error': 'File must be a PNG, JPEG, GIF or WebP image.'}, status=400)
+
+        upload.append(chunk)
+        return self.chunked_upload_response(upload)
+
 
-admin.site.register(Grade)
+admin.site.register(Grade, GradeAdmin)
 admin.site.register(Player, PlayerAdmin)
-admin.site.register(Post)
-admin.site.register(System)
+admin.site.register(Post, PostAdmin)
+admin.site.register(System, SystemAdmin)
 admin.site.register(Site, SiteAdmin)
 admin.site.register(Tournament, TournamentAdmin)
+admin.site.register(TournamentArchive, TournamentArchiveAdmin)
 admin.site.register(Settings)
 admin.site.register(Format)
 admin.site.register(Team)
 admin.site.register(Registration, RegistrationAdmin)
 admin.site.register(TournamentSeries)
-admin.site.register(Pass)
+admin.site.register(Pass, PassAdmin)
+admin.site.register(QueuedEmail, QueuedEmailAdmin)
+admin.site.register(Job, JobAdmin)
+admin.site.register(Game, GameAdmin)
@@ -0,0 +1,213 @@
+"""
+Head-to-head and teammate records, kept per season (calendar year).
+
+``Matchup`` holds two sparse matrices per season: each player's wins,
+losses and ties against each opponent, and games and wins with each
+teammate. A profile page reads one player's rows through the unique index.
+``rebuild_season_analytics`` builds a season from scratch. When a game's
+results change, the ``update_game_analytics`` job subtracts what the game
+contributed before (kept in ``MatchupGame``) and adds what it contributes
+now, touching only the players in that game. Both jobs lock the built
+seasons' ``MatchupSeason`` rows, so they never interleave.
+
+The cache holds only flags saying a season is built or has been queued.
+Losing them costs a query; a process that did not run the build sees the
+season once its ``requested`` flag expires.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import ExtractYear
+from django.utils import timezone
+
+from .jobs import job
+from .models import GameResult, Matchup, MatchupGame, MatchupSeason
+
+REQUEST_TIMEOUT = 300
+COUNT_FIELDS = {Matchup.OPPONENTS: ('wins', 'losses', 'ties'), Matchup.TEAMMATES: ('games', 'wins')}
+
+
+def empty_row():
+    return {Matchup.OPPONENTS: {}, Matchup.TEAMMATES: {}}
+
+
+def game_contributions(results):
+    """
+    Yield ``(player, kind, other, counts)`` for one game, where ``results``
+    is a list of ``(player id, team id, score)`` and counts line up with
+    ``[wins, losses, ties]`` for opponents or ``[games, wins]`` for teammates.
+    """
+    team_totals = defaultdict(int)
+    for _, team_id, score in results:
+        if team_id is not None:
+            team_totals[team_id] += score
+    best = max(team_totals.values(), default=None)
+    winners = {team_id for team_id, total in team_totals.items() if total == best}
+    won = len(winners) == 1
+
+    for player_id, team_id, score in results:
+        for other_id, other_team_id, other_score in results:
+            if other_id == player_id:
+                continue
+            if team_id is not None and team_id == other_team_id:
+                yield player_id, Matchup.TEAMMATES, other_id, [1, int(won and team_id in winners)]
+            else:
+                yield player_id, Matchup.OPPONENTS, other_id, [
+                    int(score > other_score), int(score < other_score), int(score == other_score)
+                ]
+
+
+def apply_contributions(rows, results, sign):
+    for player_id, kind, other_id, counts in game_contributions(results):
+        cells = rows.setdefault(player_id, empty_row())[kind]
+        current = cells.get(other_id) or [0] * len(counts)
+        cells[other_id] = [value + sign * count for value, count in zip(current, counts)]
+        if not any(cells[other_id]):
+            del cells[other_id]
+
+
+def season_results(season=None, game_ids=None):
+    """Map game id to ``[(player id, team id, score), ...]``."""
+    results = GameResult.objects.annotate(season=ExtractYear('game__played_at'))
+    if season is not None:
+        results = results.filter(season=season)
+    if game_ids is not None:
+        results = results.filter(game__in=game_ids)
+    games = defaultdict(list)
+    results = results.order_by('game_id', 'player_id')
+    for game_id, player_id, team_id, score in results.values_list('game_id', 'player_id', 'team_id', 'score'):
+        # Lists, to compare equal to the snapshots stored as JSON
+        games[game_id].append([player_id, team_id, score])
+    return games
+
+
+def load_rows(season, player_ids):
+    rows = {}
+    for matchup in Matchup.objects.filter(season=season, player__in=player_ids):
+        counts = [getattr(matchup, field) for field in COUNT_FIELDS[matchup.kind]]
+        rows.setdefault(matchup.player_id, empty_row())[matchup.kind][matchup.other_id] = counts
+    return rows
+
+
+def matchup_objects(season, rows):
+    for player_id, row in rows.items():
+        for kind, cells in row.items():
+            for other_id, counts in cells.items():
+                yield Matchup(
+                    season=season, player_id=player_id, kind=kind, other_id=other_id,
+                    **dict(zip(COUNT_FIELDS[kind], counts)),
+                )
+
+
+def replace_game(season, old_results, new_results):
+    """Swap what one game contributes to a built season for what it contributes now."""
+    player_ids = {row[0] for row in old_results} | {row[0] for row in new_results}
+    rows = load_rows(season, player_ids)
+    apply_contributions(rows, old_results, -1)
+    apply_contributions(rows, new_results, 1)
+    Matchup.objects.filter(season=season, player__in=player_ids).delete()
+    Matchup.objects.bulk_create(matchup_objects(season, rows))
+
+
+def lock_seasons():
+    """Lock every built season's row; returns the built seasons."""
+    return {row.season for row in MatchupSeason.objects.select_for_update()}
+
+
+@job(max_attempts=10, retry_delay=timedelta(seconds=5))
+def rebuild_season_analytics(season):
+    """Build every player's rows for ``season`` from scratch."""
+    with transaction.atomic():
+        built = lock_seasons()
+        games = season_results(season)
+        # Games that have moved here from another season stop counting there
+        for snapshot in MatchupGame.objects.filter(game_id__in=list(games)).exclude(season=season):
+            if snapshot.season in built:
+                replace_game(snapshot.season, snapshot.results, [])
+
+        rows = {}
+        for results in games.values():
+            apply_contributions(rows, results, 1)
+        Matchup.objects.filter(season=season).delete()
+        Matchup.objects.bulk_create(matchup_objects(season, rows), batch_size=1000)
+        MatchupGame.objects.filter(season=season).delete()
+        MatchupGame.objects.filter(game_id__in=list(games)).delete()
+        MatchupGame.objects.bulk_create(
+            (MatchupGame(game_id=game_id, season=season, results=results) for game_id, results in games.items()),
+            batch_size=1000,
+        )
+        MatchupSeason.objects.get_or_create(season=season)
+        transaction.on_commit(lambda: season_finished(season))
+
+
+def season_finished(season):
+    cache.set(f'analytics:{season}:built', True, timeout=None)
+    cache.delete(f'analytics:{season}:requested')
+
+
+@job(max_attempts=10, retry_delay=timedelta(seconds=5))
+def update_game_analytics(game_id):
+    """Bring the rows of the players in one game up to date with its current results."""
+    with transaction.atomic():
+        built = lock_seasons()
+        current = GameResult.objects.filter(game=game_id).select_related('game').first()
+        new_season = timezone.localtime(current.game.played_at).year if current else None
+        new_results = season_results(game_ids=[game_id]).get(game_id, [])
+        snapshot = MatchupGame.objects.filter(game_id=game_id).first()
+        old_season, old_results = (snapshot.season, snapshot.results) if snapshot else (None, [])
+        if (old_season, old_results) == (new_season, new_results):
+            return
+
+        if old_season in built:
+            replace_game(old_season, old_results, new_results if new_season == old_season else [])
+        if new_season in built and new_season != old_season:
+            replace_game(new_season, [], new_results)
+        if new_season in built and new_results:
+            MatchupGame.objects.update_or_create(game_id=game_id, defaults={'season': new_season, 'results': new_results})
+        elif snapshot is not None:
+            snapshot.delete()
+
+
+def season_built(season):
+    """Whether ``season`` has been built, queueing the build if not."""
+    # Seasons are never unbuilt, so only a miss reaches the database
+    built_key = f'analytics:{season}:built'
+    requested_key = f'analytics:{season}:requested'
+    if cache.get(built_key):
+        return True
+    # Asked for recently, so the build is queued or running; look again once the request expires
+    if cache.get(requested_key):
+        return False
+    if MatchupSeason.objects.filter(season=season).exists():
+        cache.set(built_key, True, timeout=None)
+        return True
+    cache.set(requested_key, True, timeout=REQUEST_TIMEOUT)
+    rebuild_season_analytics.enqueue_once(season)
+    return False
+
+
+def player_matchups(player_id, season=None, limit=5):
+    """
+    The player's most frequent opponents and teammates in ``season``, or
+    None while the season is still being built.
+    """
+    season = season or timezone.localtime().year
+    if not season_built(season):
+        return None
+    matchups = Matchup.objects.filter(season=season, player=player_id).select_related('other')
+    rivals = (
+        matchups.filter(kind=Matchup.OPPONENTS)
+        .annotate(played=F('wins') + F('losses') + F('ties')).order_by('-played', 'other_id')[:limit]
+    )
+    partners = matchups.filter(kind=Matchup.TEAMMATES).order_by('-games', 'other_id')[:limit]
+    return {
+        'season': season,
+        'rivals': [
+            {'player': rival.other, 'wins': rival.wins, 'losses': rival.losses, 'ties': rival.ties}
+            for rival in rivals
+        ],
+        'partners': [{'player': partner.other, 'games': partner.games, 'wins': partner.wins} for partner in partners],
+    }
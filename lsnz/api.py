@@ -0,0 +1,332 @@
+"""
+Read-only JSON API, version 1, under ``/api/v1/``.
+
+Every resource has a list at ``/api/v1/<resource>`` and a detail view at
+``/api/v1/<resource>/<slug or id>``. Both accept:
+
+``fields=a,b``
+    Only return these fields of the requested resource.
+    ``fields[<resource>]=a,b`` does the same for an included resource.
+``include=site,system``
+    Add the related objects to ``included``. Each include is loaded with
+    one query for the whole page, so a page costs one query plus one per
+    include however many rows it has.
+
+Lists also accept the resource's filters (e.g. ``/api/v1/events?tournament=3``),
+``limit`` (up to ``API_MAX_LIMIT``) and the opaque ``cursor`` from
+``links.next``. Rows come in id order, so a cursor stays valid while rows
+are added.
+
+``/api/v1/nearest-sites?lat=..&lng=..`` lists sites closest first with a
+``distance_km`` field, optionally limited by ``limit`` and ``radius`` (km).
+
+Responses carry an ETag and ``Cache-Control: private, max-age=API_MAX_AGE``;
+send ``If-None-Match`` to get a 304 once the cached copy expires.
+"""
+import hashlib
+import json
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+from .geo import nearest_sites, parse_location
+from .models import Event, Format, MazeMap, Player, Post, Site, System, Tournament
+
+
+class ApiError(Exception):
+    def __init__(self, detail, status=400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status = status
+
+
+def file_url(name):
+    """Serialize an ImageField, which is falsy when no file is set."""
+    return lambda obj: getattr(obj, name).url if getattr(obj, name) else None
+
+
+class Resource:
+    """
+    How one model is exposed. ``fields`` maps each field name to an
+    attribute or a callable taking the object. ``includes`` maps include
+    names to ``(resource name, foreign key attribute)``.
+    """
+    name = None
+    model = None
+    fields = {}
+    default_fields = None
+    includes = {}
+    filters = {}
+    lookup = 'slug'
+    select_related = ()
+
+    def queryset(self):
+        return self.model.objects.select_related(*self.select_related).order_by('pk')
+
+    def get(self, key):
+        if self.lookup == 'pk' and not key.isdigit():
+            return None
+        return self.queryset().filter(**{self.lookup: key}).first()
+
+    def parse_fields(self, value):
+        if value is None:
+            return list(self.default_fields or self.fields)
+        names = [name for name in value.split(',') if name]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ApiError(f"Unknown field(s) for {self.name}: {', '.join(unknown)}.")
+        return names
+
+    def serialize(self, obj, fields):
+        data = {}
+        for name in fields:
+            source = self.fields[name]
+            data[name] = source(obj) if callable(source) else getattr(obj, source)
+        return data
+
+
+class TournamentResource(Resource):
+    name = 'tournaments'
+    model = Tournament
+    fields = {
+        'id': 'pk', 'slug': 'slug', 'name': 'name', 'start_date': 'start_date', 'end_date': 'end_date',
+        'site': 'site_id', 'system': 'system_id', 'series': 'series_id',
+    }
+    includes = {'site': ('sites', 'site_id'), 'system': ('systems', 'system_id')}
+    filters = {'site': 'site', 'system': 'system', 'series': 'series'}
+
+
+class EventResource(Resource):
+    name = 'events'
+    model = Event
+    fields = {
+        'id': 'pk', 'tournament': 'tournament_id', 'format': 'format_id', 'start_time': 'start_time',
+        'end_time': 'end_time', 'points_cap': 'points_cap', 'registration_count': 'registration_count',
+        'paid_count': 'paid_count',
+    }
+    includes = {'tournament': ('tournaments', 'tournament_id'), 'format': ('formats', 'format_id')}
+    filters = {'tournament': 'tournament', 'format': 'format'}
+    lookup = 'pk'
+
+
+class SiteResource(Resource):
+    name = 'sites'
+    model = Site
+    fields = {
+        'id': 'pk', 'slug': 'slug', 'name': 'name', 'country': 'country', 'address': 'address',
+        'system': 'system_id', 'latitude': 'latitude', 'longitude': 'longitude',
+    }
+    includes = {'system': ('systems', 'system_id')}
+    filters = {'system': 'system', 'country': 'country'}
+
+
+class SystemResource(Resource):
+    name = 'systems'
+    model = System
+    fields = {
+        'id': 'pk', 'slug': 'slug', 'name': 'name', 'description': 'description', 'image': file_url('image'),
+    }
+
+
+class FormatResource(Resource):
+    name = 'formats'
+    model = Format
+    fields = {'id': 'pk', 'slug': 'slug', 'name': 'name', 'description': 'description'}
+
+
+class PlayerResource(Resource):
+    name = 'players'
+    model = Player
+    fields = {
+        'id': 'pk', 'slug': 'slug', 'alias': 'alias',
+        'grade': lambda player: player.grade.letter if player.grade else None,
+        'home_site': 'home_site_id', 'playing_since': 'playing_since', 'bio': 'bio',
+        'profile_picture': file_url('profile_picture'),
+    }
+    includes = {'home_site': ('sites', 'home_site_id')}
+    filters = {'home_site': 'home_site'}
+    select_related = ('grade',)
+
+    def queryset(self):
+        return super().queryset().filter(is_active=True)
+
+
+class PostResource(Resource):
+    name = 'posts'
+    model = Post
+    fields = {
+        'id': 'pk', 'slug': 'slug', 'title': 'title', 'summary': 'summary', 'body': 'body',
+        'image': file_url('image'), 'created_at': 'created_at', 'updated_at': 'updated_at', 'author': 'author_id',
+    }
+    # Bodies can be long, so lists leave them out unless asked for
+    default_fields = ['id', 'slug', 'title', 'summary', 'image', 'created_at', 'updated_at', 'author']
+    includes = {'author': ('players', 'author_id')}
+    filters = {'author': 'author'}
+
+
+class MazeMapResource(Resource):
+    name = 'maze-maps'
+    model = MazeMap
+    fields = {
+        'id': 'pk', 'site': 'site_id', 'date': 'date', 'image': file_url('image'), 'preview': file_url('preview'),
+        'width': 'width', 'height': 'height', 'max_zoom': 'max_zoom',
+        'tiles': lambda maze_map: maze_map.tile_url_template if maze_map.tiles_ready else None,
+    }
+    includes = {'site': ('sites', 'site_id')}
+    filters = {'site': 'site'}
+    lookup = 'pk'
+
+
+resources = {
+    resource.name: resource
+    for resource in (
+        TournamentResource(), EventResource(), SiteResource(), SystemResource(), FormatResource(),
+        PlayerResource(), PostResource(), MazeMapResource(),
+    )
+}
+
+
+def get_resource(name):
+    try:
+        return resources[name]
+    except KeyError:
+        raise ApiError(f'Unknown resource {name}.', status=404)
+
+
+def encode_cursor(pk):
+    return urlsafe_base64_encode(str(pk).encode())
+
+
+def decode_cursor(cursor):
+    try:
+        return int(urlsafe_base64_decode(cursor))
+    except ValueError:
+        raise ApiError('Invalid cursor.')
+
+
+def parse_limit(value):
+    if value is None:
+        return settings.API_DEFAULT_LIMIT
+    if not value.isdigit() or not 1 <= int(value) <= settings.API_MAX_LIMIT:
+        raise ApiError(f'limit must be between 1 and {settings.API_MAX_LIMIT}.')
+    return int(value)
+
+
+def included(resource, objects, request):
+    """``{resource name: [serialized objects]}`` for every include requested, one query each."""
+    names = [name for name in request.GET.get('include', '').split(',') if name]
+    unknown = [name for name in names if name not in resource.includes]
+    if unknown:
+        raise ApiError(f"Unknown include(s) for {resource.name}: {', '.join(unknown)}.")
+
+    result = {}
+    for name in names:
+        related_name, attribute = resource.includes[name]
+        related = resources[related_name]
+        fields = related.parse_fields(request.GET.get(f'fields[{related_name}]'))
+        ids = {getattr(obj, attribute) for obj in objects} - {None}
+        rows = related.queryset().in_bulk(ids) if ids else {}
+        serialized = result.setdefault(related_name, {})
+        for pk, obj in rows.items():
+            serialized[pk] = related.serialize(obj, fields)
+    return {name: list(rows.values()) for name, rows in result.items()}
+
+
+def json_response(request, payload, status=200):
+    body = json.dumps(payload, cls=DjangoJSONEncoder).encode()
+    if status == 200:
+        etag = '"%s"' % hashlib.md5(body, usedforsecurity=False).hexdigest()
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, max_age=settings.API_MAX_AGE)
+    else:
+        response = HttpResponse(body, content_type='application/json', status=status)
+    return response
+
+
+def api_view(view):
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return json_response(request, {'errors': [{'detail': 'This API is read-only.'}]}, status=405)
+        try:
+            return json_response(request, view(request, *args, **kwargs))
+        except ApiError as e:
+            return json_response(request, {'errors': [{'detail': e.detail}]}, status=e.status)
+    return wrapper
+
+
+@api_view
+def index(request):
+    return {'resources': {name: request.build_absolute_uri(reverse('lsnz:api_list', args=[name])) for name in resources}}
+
+
+@api_view
+def resource_list(request, resource):
+    resource = get_resource(resource)
+    fields = resource.parse_fields(request.GET.get('fields'))
+    limit = parse_limit(request.GET.get('limit'))
+
+    queryset = resource.queryset()
+    for param, lookup in resource.filters.items():
+        if param in request.GET:
+            try:
+                queryset = queryset.filter(**{lookup: request.GET[param]})
+            except (ValueError, ValidationError):
+                raise ApiError(f'Invalid value for {param}.')
+    if 'cursor' in request.GET:
+        queryset = queryset.filter(pk__gt=decode_cursor(request.GET['cursor']))
+
+    # One extra row tells whether there is a next page
+    objects = list(queryset[:limit + 1])
+    next_url = None
+    if len(objects) > limit:
+        objects = objects[:limit]
+        params = {key: value for key, value in request.GET.items() if key != 'cursor'}
+        params['cursor'] = encode_cursor(objects[-1].pk)
+        next_url = request.build_absolute_uri(f'{request.path}?{urlencode(params)}')
+
+    return {
+        'data': [resource.serialize(obj, fields) for obj in objects],
+        'included': included(resource, objects, request),
+        'links': {'next': next_url},
+    }
+
+
+@api_view
+def resource_detail(request, resource, key):
+    resource = get_resource(resource)
+    fields = resource.parse_fields(request.GET.get('fields'))
+    obj = resource.get(key)
+    if obj is None:
+        raise ApiError(f'No {resource.name} {key}.', status=404)
+    return {'data': resource.serialize(obj, fields), 'included': included(resource, [obj], request)}
+
+
+@api_view
+def nearest_site_list(request):
+    resource = resources['sites']
+    fields = resource.parse_fields(request.GET.get('fields'))
+    limit = parse_limit(request.GET.get('limit'))
+    try:
+        location = parse_location(request.GET['lat'], request.GET['lng'])
+        radius = float(request.GET['radius']) if 'radius' in request.GET else None
+        if radius is not None and radius < 0:
+            raise ValueError('radius must not be negative.')
+    except KeyError:
+        raise ApiError('lat and lng are required.')
+    except ValueError as e:
+        raise ApiError(f'Invalid location: {e}')
+
+    sites = nearest_sites(*location, count=limit, radius_km=radius, queryset=resource.queryset())
+    return {
+        'data': [{**resource.serialize(site, fields), 'distance_km': round(site.distance_km, 3)} for site in sites],
+        'included': included(resource, sites, request),
+    }
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class LsnzConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'lsnz'
+
+    def ready(self):
+        # Importing these registers their signal handlers and background jobs
+        from . import archive, mail, metrics, profiling, signals  # noqa: F401
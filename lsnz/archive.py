@@ -0,0 +1,174 @@
+"""
+Archiving finished tournaments.
+
+Teams, registrations, games and results make up most of every tournament's
+rows but are only read again to show its results. Once a tournament has
+been over for ``ARCHIVE_AFTER_DAYS`` they are condensed into a
+``TournamentArchive`` with the final standings, plus one ``ArchivedEntry``
+per player for their statistics, and removed from the live tables. The rows
+themselves are kept on the archive so ``restore_tournament`` can put the
+tournament back with the same ids.
+
+Events stay in place: there are only a few per tournament, they carry their
+own registration counts, and the format pages list them.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .jobs import job
+from .live import game_standings
+from .models import (
+    ArchivedEntry,
+    Event,
+    Game,
+    GameResult,
+    Player,
+    Registration,
+    Team,
+    Tournament,
+    TournamentArchive,
+)
+from .stats import refresh_event_counts, refresh_player_stats
+
+# Restored in this order, so every row's foreign keys exist before it does
+ARCHIVED_MODELS = [
+    (Team, ['id', 'event_id', 'name']),
+    (Registration, ['id', 'event_id', 'player_id', 'team_id', 'paid']),
+    (Game, ['id', 'event_id', 'number', 'played_at']),
+    (GameResult, ['id', 'game_id', 'player_id', 'team_id', 'score']),
+]
+
+
+def archivable_tournaments(days=None):
+    """Tournaments that ended more than ``days`` ago and are not archived yet."""
+    if days is None:
+        days = settings.ARCHIVE_AFTER_DAYS
+    cutoff = timezone.now().date() - timedelta(days=days)
+    return Tournament.objects.filter(end_date__lt=cutoff, archive__isnull=True).order_by('end_date')
+
+
+def tournament_rows(model, tournament_id):
+    lookup = 'game__event__tournament' if model is GameResult else 'event__tournament'
+    return model.objects.filter(**{lookup: tournament_id})
+
+
+def archive_entries(archive, registrations, teams, standings):
+    """One ``ArchivedEntry`` per registered player."""
+    placings = {}
+    for rows in standings.values():
+        for place, row in enumerate(rows, start=1):
+            placings[row['player']] = min(place, placings.get(row['player'], place))
+
+    events = {}
+    team_names = {}
+    for registration in registrations:
+        events.setdefault(registration['player_id'], set()).add(registration['event_id'])
+        if registration['team_id'] in teams:
+            team_names.setdefault(registration['player_id'], set()).add(teams[registration['team_id']])
+
+    return [
+        ArchivedEntry(
+            archive=archive,
+            player_id=player_id,
+            events_played=len(event_ids),
+            teams=', '.join(sorted(team_names.get(player_id, ())))[:200],
+            best_placing=placings.get(player_id),
+        )
+        for player_id, event_ids in events.items()
+    ]
+
+
+@transaction.atomic
+def archive_tournament(tournament):
+    """Condense ``tournament`` into a ``TournamentArchive`` and delete its detailed rows."""
+    rows = {
+        model._meta.model_name: {
+            'fields': fields,
+            'values': [list(values) for values in tournament_rows(model, tournament.pk).order_by('pk').values_list(*fields)],
+        }
+        for model, fields in ARCHIVED_MODELS
+    }
+    standings = {
+        str(event_id): [
+            {'player': row['player'], 'team__name': row['team__name'], 'games': row['games'], 'total': row['total']}
+            for row in event_rows
+        ]
+        for event_id, event_rows in game_standings(tournament.pk).items()
+    }
+    registrations = [dict(zip(rows['registration']['fields'], values)) for values in rows['registration']['values']]
+    teams = {team_id: name for team_id, _, name in rows['team']['values']}
+
+    archive = TournamentArchive.objects.create(
+        tournament=tournament,
+        participant_count=len({registration['player_id'] for registration in registrations}),
+        team_count=len(rows['team']['values']),
+        game_count=len(rows['game']['values']),
+        standings=standings,
+        rows=rows,
+    )
+    entries = ArchivedEntry.objects.bulk_create(archive_entries(archive, registrations, teams, standings))
+
+    # Deleted without signals: the event counters and player statistics
+    # already include these rows and must keep doing so
+    for model, _ in reversed(ARCHIVED_MODELS):
+        queryset = tournament_rows(model, tournament.pk)
+        queryset._raw_delete(queryset.db)
+
+    refresh_player_stats(entry.player_id for entry in entries)
+    return archive
+
+
+@transaction.atomic
+def restore_tournament(tournament):
+    """
+    Put an archived tournament's rows back and delete its archive.
+
+    Rows that point at players or events deleted since are left out.
+    """
+    archive = TournamentArchive.objects.select_for_update().get(pk=tournament.pk)
+    player_ids = set()
+    for data in archive.rows.values():
+        if 'player_id' in data['fields']:
+            index = data['fields'].index('player_id')
+            player_ids.update(values[index] for values in data['values'])
+
+    existing = {
+        'event_id': set(Event.objects.filter(tournament=tournament).values_list('pk', flat=True)),
+        'player_id': set(Player.objects.filter(pk__in=player_ids).values_list('pk', flat=True)),
+        'team_id': set(),
+        'game_id': set(),
+    }
+    for model, _ in ARCHIVED_MODELS:
+        data = archive.rows.get(model._meta.model_name, {'fields': [], 'values': []})
+        instances = []
+        for values in data['values']:
+            row = {
+                name: model._meta.get_field(name.removesuffix('_id')).to_python(value)
+                for name, value in zip(data['fields'], values)
+            }
+            if 'team_id' in row and row['team_id'] not in existing['team_id']:
+                row['team_id'] = None
+            if any(row[name] not in existing[name] for name in ('event_id', 'player_id', 'game_id') if name in row):
+                continue
+            instances.append(model(**row))
+        model.objects.bulk_create(instances)
+        if model in (Team, Game):
+            existing[f'{model._meta.model_name}_id'].update(instance.pk for instance in instances)
+
+    player_ids = list(archive.entries.values_list('player_id', flat=True))
+    archive.delete()
+    refresh_event_counts(existing['event_id'])
+    refresh_player_stats(player_ids)
+
+
+@job(every=timedelta(days=1))
+def archive_old_tournaments(days=None):
+    """Archive every tournament that ended more than ``days`` (default ``ARCHIVE_AFTER_DAYS``) ago."""
+    archived = 0
+    for tournament in archivable_tournaments(days):
+        archive_tournament(tournament)
+        archived += 1
+    return archived
@@ -0,0 +1,51 @@
+from allauth.account.auth_backends import AuthenticationBackend
+from django.contrib.auth import backends, get_user_model
+from django.core.cache import cache
+
+# Cached players are dropped whenever they change, so this only bounds how
+# long an idle player's entry sits in the cache.
+USER_CACHE_TIMEOUT = 60 * 60
+
+
+def user_cache_key(user_id):
+    return f'lsnz:auth-user:{user_id}'
+
+
+def invalidate_cached_users(user_ids):
+    cache.delete_many([user_cache_key(user_id) for user_id in user_ids])
+
+
+class CachedUserMixin:
+    """
+    Load the logged-in player from the cache instead of the database.
+
+    The player is stored with ``grade`` and ``home_site`` already joined, as
+    the navbar and profile templates use them on most pages. Entries are
+    invalidated by the signal handlers in ``lsnz.signals``.
+
+    ``QuerySet.update()`` and ``bulk_update()`` send no signals, so code
+    that changes players, grades or sites that way must call
+    ``invalidate_cached_users`` itself, as ``apply_grade_changes`` does.
+    Otherwise the affected players stay stale for up to
+    ``USER_CACHE_TIMEOUT``.
+    """
+
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            UserModel = get_user_model()
+            try:
+                user = UserModel._default_manager.select_related('grade', 'home_site').get(pk=user_id)
+            except UserModel.DoesNotExist:
+                return None
+            cache.set(key, user, USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
+
+
+class CachedModelBackend(CachedUserMixin, backends.ModelBackend):
+    pass
+
+
+class CachedAuthenticationBackend(CachedUserMixin, AuthenticationBackend):
+    pass
@@ -0,0 +1,284 @@
+"""
+Columnar export of the tournament history for offline analysis.
+
+Each table in ``EXPORTS`` is written to ``<directory>/<name>/`` as Parquet
+when pyarrow is installed and as JSON Lines otherwise. Rows are streamed
+from the database with ``.iterator()`` and written ``row_group_size`` at a
+time, so memory use does not grow with the table.
+
+Runs are incremental. ``export-state.json`` records, for each table, the
+``(updated_at, id)`` of the last row written (or just the id, for tables
+that are only ever added to), and the next run writes only the rows after
+it to a new file. Rows changed in the last ``EXPORT_SETTLE_SECONDS`` are
+left for the next run, so a transaction that commits late with an earlier
+timestamp is not skipped. A changed row appears in every file written since it was first
+exported; keep the copy with the latest ``updated_at``, e.g. in DuckDB::
+
+    SELECT * FROM read_parquet('registrations/*.parquet')
+    QUALIFY row_number() OVER (PARTITION BY id ORDER BY updated_at DESC) = 1
+
+Deleted rows, including those moved out of the live tables by
+``manage.py archive_tournaments``, are not tracked; export with ``full``
+to start the table again from scratch.
+"""
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ArchivedEntry, Event, Game, GameResult, Pass, Registration, Tournament, TournamentArchive
+
+STATE_FILE = 'export-state.json'
+INTEGER_TYPES = {
+    'AutoField', 'BigAutoField', 'SmallAutoField', 'IntegerField', 'BigIntegerField', 'SmallIntegerField',
+    'PositiveIntegerField', 'PositiveBigIntegerField', 'PositiveSmallIntegerField',
+}
+
+
+def settle_window():
+    """
+    How far behind now each run stops. A row is only safe to pass once the
+    transaction that wrote it has committed, so this must be longer than
+    any transaction that writes exported tables with timestamps taken at
+    its start. A row from a longer one is skipped by every later
+    incremental run, until an export with ``full``. CSV imports avoid this
+    by stamping their rows just before they commit.
+    """
+    return timedelta(seconds=getattr(settings, 'EXPORT_SETTLE_SECONDS', 60))
+
+
+@dataclass
+class Export:
+    name: str
+    model: type
+    # None for tables whose rows never change once written, which are exported by id alone
+    changed_field: str = 'updated_at'
+
+    @property
+    def fields(self):
+        return self.model._meta.concrete_fields
+
+
+EXPORTS = [
+    Export('tournaments', Tournament),
+    Export('events', Event),
+    Export('registrations', Registration),
+    Export('passes', Pass),
+    Export('games', Game),
+    Export('results', GameResult),
+    Export('tournament_archives', TournamentArchive, 'archived_at'),
+    Export('archived_entries', ArchivedEntry, None),
+]
+
+
+def field_type(field):
+    """The internal type of ``field``, or of the column it points to for a relation."""
+    # A key can point at another key, e.g. TournamentArchive's primary key is a one-to-one
+    while field.is_relation:
+        field = field.target_field
+    return field.get_internal_type()
+
+
+def plain_value(field):
+    """A function turning the database value of ``field`` into one both writers accept."""
+    if field_type(field) == 'JSONField':
+        return lambda value: json.dumps(value, cls=DjangoJSONEncoder)
+    if field_type(field) in ('UUIDField', 'FileField', 'ImageField'):
+        return lambda value: None if value is None else str(value)
+    return None
+
+
+def arrow_type(field):
+    import pyarrow as pa
+
+    internal = field_type(field)
+    if internal in INTEGER_TYPES:
+        return pa.int64()
+    if internal == 'BooleanField':
+        return pa.bool_()
+    if internal == 'FloatField':
+        return pa.float64()
+    if internal == 'DecimalField':
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    if internal == 'DateField':
+        return pa.date32()
+    if internal == 'DateTimeField':
+        return pa.timestamp('us', tz='UTC')
+    if internal == 'DurationField':
+        return pa.duration('us')
+    return pa.string()
+
+
+class JsonLinesWriter:
+    extension = 'jsonl'
+
+    def __init__(self, path, fields):
+        self.names = [field.attname for field in fields]
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, rows):
+        for row in rows:
+            self.file.write(json.dumps(dict(zip(self.names, row)), cls=DjangoJSONEncoder) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """Writes each batch of rows as one row group."""
+    extension = 'parquet'
+
+    def __init__(self, path, fields):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([pa.field(field.attname, arrow_type(field), nullable=field.null) for field in fields])
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, rows):
+        columns = zip(*rows)
+        arrays = [self.pa.array(column, type=field.type) for column, field in zip(columns, self.schema)]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def get_writer_class(format='auto'):
+    """``ParquetWriter`` if pyarrow is installed (or ``format`` asks for it), otherwise ``JsonLinesWriter``."""
+    if format == 'jsonl':
+        return JsonLinesWriter
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        if format == 'parquet':
+            raise
+        return JsonLinesWriter
+    return ParquetWriter
+
+
+def changed_rows(export, mark, until):
+    """Rows of ``export`` after ``mark``, in the order marks advance."""
+    queryset = export.model._base_manager.all()
+    changed = export.changed_field
+    if changed is None:
+        if mark:
+            queryset = queryset.filter(pk__gt=mark['pk'])
+        return queryset.order_by('pk')
+    if mark:
+        last_changed = datetime.fromisoformat(mark['changed'])
+        queryset = queryset.filter(Q(**{f'{changed}__gt': last_changed}) | Q(**{changed: last_changed, 'pk__gt': mark['pk']}))
+    return queryset.filter(**{f'{changed}__lt': until}).order_by(changed, 'pk')
+
+
+def export_table(export, directory, writer_class, mark=None, row_group_size=50_000, now=None):
+    """
+    Write the rows of ``export`` after ``mark`` to a new file in
+    ``directory``. Returns ``(rows written, new mark)``.
+    """
+    until = (now or timezone.now()) - settle_window()
+    fields = export.fields
+    names = [field.attname for field in fields]
+    converters = [(index, convert) for index, field in enumerate(fields) if (convert := plain_value(field))]
+    pk_index = names.index(export.model._meta.pk.attname)
+    changed_index = names.index(export.changed_field) if export.changed_field else None
+
+    path = os.path.join(directory, f'{until:%Y%m%dT%H%M%S%fZ}.{writer_class.extension}')
+    partial = f'{path}.partial'
+    writer = None
+    written = 0
+    batch = []
+    last = None
+
+    def flush():
+        nonlocal writer, written
+        if writer is None:
+            os.makedirs(directory, exist_ok=True)
+            writer = writer_class(partial, fields)
+        writer.write(batch)
+        written += len(batch)
+        batch.clear()
+
+    try:
+        for row in changed_rows(export, mark, until).values_list(*names).iterator(chunk_size=min(row_group_size, 2000)):
+            last = row
+            if converters:
+                row = list(row)
+                for index, convert in converters:
+                    row[index] = convert(row[index])
+            batch.append(row)
+            if len(batch) >= row_group_size:
+                flush()
+        if batch:
+            flush()
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(partial)
+        raise
+
+    if writer is None:
+        return 0, mark
+    writer.close()
+    # Readers globbing the directory never see a half-written file
+    os.replace(partial, path)
+    new_mark = {'pk': last[pk_index]}
+    if changed_index is not None:
+        new_mark['changed'] = last[changed_index].isoformat()
+    return written, new_mark
+
+
+def load_state(directory):
+    try:
+        with open(os.path.join(directory, STATE_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(directory, state):
+    path = os.path.join(directory, STATE_FILE)
+    with open(f'{path}.partial', 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(f'{path}.partial', path)
+
+
+def clear_table(directory):
+    """Remove the files written for one table by earlier runs."""
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.endswith(('.parquet', '.jsonl', '.partial')):
+            os.remove(os.path.join(directory, name))
+
+
+def export_all(directory, names=None, format='auto', full=False, row_group_size=50_000):
+    """
+    Export the tables in ``names`` (all of ``EXPORTS`` by default) under
+    ``directory``. Yields ``(table name, rows written)`` as each finishes,
+    after saving its new mark, so an interrupted run keeps what it wrote.
+    """
+    writer_class = get_writer_class(format)
+    state = load_state(directory)
+    now = timezone.now()
+    for export in EXPORTS:
+        if names is not None and export.name not in names:
+            continue
+        table_directory = os.path.join(directory, export.name)
+        if full:
+            clear_table(table_directory)
+            state.pop(export.name, None)
+        written, mark = export_table(
+            export, table_directory, writer_class, state.get(export.name), row_group_size=row_group_size, now=now,
+        )
+        if mark is not None:
+            state[export.name] = mark
+            os.makedirs(directory, exist_ok=True)
+            save_state(directory, state)
+        yield export.name, written
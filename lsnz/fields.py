@@ -0,0 +1,23 @@
+from autoslug import fields as autoslug_fields
+
+from .slugs import allocate_slugs
+
+
+class AutoSlugField(autoslug_fields.AutoSlugField):
+    """
+    ``AutoSlugField`` that finds a free slug with a single query.
+
+    Slugs handed out by ``allocate_slugs`` (as bulk creation paths do) and
+    slugs of rows that are already saved are kept without another round of
+    uniqueness checks.
+    """
+
+    def pre_save(self, instance, add):
+        value = self.value_from_object(instance)
+        allocated = getattr(instance, '_allocated_slugs', {})
+        if value and (allocated.get(self.name) == value or (not add and not self.always_update)):
+            return value
+        if self.unique and not self.unique_with and not self.always_update:
+            allocate_slugs([instance], self.name)
+            return self.value_from_object(instance)
+        return super().pre_save(instance, add)
@@ -1,12 +1,37 @@
 from django import forms
+from django.contrib.auth.forms import UserChangeForm
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import UploadedFile
+from django.db.models.functions import Lower
+from django.urls import reverse_lazy
 from django.utils import timezone
 
-from .models import Event, Player, Post, Registration, Site
+from .models import ChunkedUpload, Event, MazeMap, Player, Post, Registration, Site
+from .schedule import event_clashes
+from .uploads import RejectedUpload
 
 
-class PostForm(forms.ModelForm):
+class UploadValidationMixin:
+    """Report uploads refused by ImageUploadHandler as errors on their fields"""
+
+    def full_clean(self):
+        super().full_clean()
+        for name, upload in self.files.items():
+            field_name = name.removeprefix(f'{self.prefix}-') if self.prefix else name
+            if isinstance(upload, RejectedUpload) and field_name in self.fields:
+                self._errors[field_name] = self.error_class([upload.error])
+                self.cleaned_data.pop(field_name, None)
+
+
+class UploadValidationModelForm(UploadValidationMixin, forms.ModelForm):
+    """Default admin form for models with image fields"""
+
+
+class PlayerAdminChangeForm(UploadValidationMixin, UserChangeForm):
+    """Admin change form for players that reports refused profile pictures"""
+
+
+class PostForm(UploadValidationMixin, forms.ModelForm):
     """Form for creating and editing blog posts"""
 
     class Meta:
@@ -42,7 +67,8 @@ class PostForm(forms.ModelForm):
         title = self.cleaned_data.get('title')
         if title:
             # Check for duplicate titles (excluding current instance if editing)
-            qs = Post.objects.filter(title__iexact=title)
+            # Compared with Lower() rather than iexact so the lsnz_post_title_lower index is used
+            qs = Post.objects.annotate(title_lower=Lower('title')).filter(title_lower=title.lower())
             if self.instance.pk:
                 qs = qs.exclude(pk=self.instance.pk)
             if qs.exists():
@@ -58,6 +84,16 @@ class PostForm(forms.ModelForm):
         return image
 
 
+def clash_errors(clashes):
+    return [
+        ValidationError(
+            f"{event.format.name} overlaps {other.format.name} at {other.tournament.name} "
+            f"({other.start_time.strftime('%B %d, %I:%M %p')})."
+        )
+        for event, other in clashes
+    ]
+
+
 class EventRegistrationForm(forms.ModelForm):
     """Form for registering players to tournament events"""
 
@@ -83,7 +119,7 @@ class EventRegistrationForm(forms.ModelForm):
         if self.tournament:
             self.fields['event'].queryset = Event.objects.filter(
                 tournament=self.tournament
-            ).select_related('format')
+            ).select_related('format', 'tournament')
             self.fields['event'].empty_label = "Select an event"
 
             # Customize event display
@@ -104,6 +140,10 @@ class EventRegistrationForm(forms.ModelForm):
             if event.start_time < timezone.now():
                 raise ValidationError('Cannot register for events that have already started.')
 
+            clashes = event_clashes(self.user, [event])
+            if clashes:
+                raise ValidationError(clash_errors(clashes))
+
         return event
 
     def save(self, commit=True):
@@ -125,7 +165,8 @@ class TournamentRegistrationForm(forms.Form):
 
         if self.tournament:
             # Get all events for this tournament
-            events = Event.objects.filter(tournament=self.tournament).select_related('format')
+            events = Event.objects.filter(tournament=self.tournament).select_related('format', 'tournament')
+            self.events = {event.id: event for event in events}
 
             # Get already registered events for this user
             registered_events = set()
@@ -137,8 +178,10 @@ class TournamentRegistrationForm(forms.Form):
                     ).values_list('event_id', flat=True)
                 )
 
+            self.registered_events = registered_events
+
             # Create a checkbox for each event
-            for event in events:
+            for event in self.events.values():
                 field_name = f'event_{event.id}'
                 initial = event.id in registered_events
                 disabled = event.start_time < timezone.now() or initial
@@ -162,6 +205,15 @@ class TournamentRegistrationForm(forms.Form):
         if not selected_events:
             raise ValidationError('Please select at least one event to register for.')
 
+        if self.user and self.user.is_authenticated:
+            new_events = [
+                self.events[int(k.split('_')[1])] for k in selected_events
+                if int(k.split('_')[1]) not in self.registered_events
+            ]
+            clashes = event_clashes(self.user, new_events)
+            if clashes:
+                raise ValidationError(clash_errors(clashes))
+
         return cleaned_data
 
     def save(self):
@@ -188,7 +240,7 @@ class TournamentRegistrationForm(forms.Form):
         return registrations
 
 
-class PlayerProfileForm(forms.ModelForm):
+class PlayerProfileForm(UploadValidationMixin, forms.ModelForm):
     """Form for editing player profiles"""
 
     class Meta:
@@ -231,7 +283,8 @@ class PlayerProfileForm(forms.ModelForm):
         alias = self.cleaned_data.get('alias')
         if alias:
             # Check for duplicate aliases (excluding current instance)
-            qs = Player.objects.filter(alias__iexact=alias)
+            # Compared with Lower() rather than iexact so the lsnz_player_alias_lower index is used
+            qs = Player.objects.annotate(alias_lower=Lower('alias')).filter(alias_lower=alias.lower())
             if self.instance.pk:
                 qs = qs.exclude(pk=self.instance.pk)
             if qs.exists():
@@ -260,3 +313,72 @@ class PlayerProfileForm(forms.ModelForm):
         # Set up the home_site field with all sites ordered by name
         self.fields['home_site'].queryset = Site.objects.all().order_by('name')
         self.fields['home_site'].empty_label = "Select your home site"
+
+
+class CsvImportForm(forms.Form):
+    """Admin form for uploading a CSV file of rows to bulk import"""
+
+    csv_file = forms.FileField(
+        label='CSV file',
+        help_text='The first row must name the columns.'
+    )
+    dry_run = forms.BooleanField(
+        required=False,
+        initial=True,
+        help_text='Validate the file and show what would be imported without saving anything.'
+    )
+
+
+class SalesReportForm(forms.Form):
+    """Admin form choosing the dates covered by the pass sales report"""
+
+    start = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('start') and cleaned_data.get('end') and cleaned_data['end'] < cleaned_data['start']:
+            raise ValidationError('The end date is before the start date.')
+        return cleaned_data
+
+
+class MazeMapAdminForm(UploadValidationMixin, forms.ModelForm):
+    """Maze map form that also accepts a file sent earlier through the chunked upload endpoint"""
+
+    chunked_upload = forms.CharField(required=False, widget=forms.HiddenInput)
+
+    class Meta:
+        model = MazeMap
+        fields = ['image', 'date']
+
+    class Media:
+        js = ['lsnz/chunked_upload.js']
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+        self.upload = None
+        self.fields['image'].required = False
+        self.fields['chunked_upload'].widget.attrs['data-upload-url'] = reverse_lazy('admin:lsnz_site_chunked_upload')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        upload_id = cleaned_data.get('chunked_upload')
+        if upload_id:
+            try:
+                self.upload = ChunkedUpload.objects.get(pk=upload_id, user=self.user)
+            except (ChunkedUpload.DoesNotExist, ValidationError):
+                raise ValidationError('The uploaded file has expired. Please upload it again.')
+            if not self.upload.complete:
+                raise ValidationError('The file upload did not finish. Please upload it again.')
+            cleaned_data['image'] = self.upload.open()
+        elif not cleaned_data.get('image') and 'image' not in self.errors:
+            self.add_error('image', 'This field is required.')
+        return cleaned_data
+
+    def save(self, commit=True):
+        instance = super().save(commit=commit)
+        if commit and self.upload:
+            self.cleaned_data['image'].close()
+            self.upload.discard()
+        return instance
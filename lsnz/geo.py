@@ -0,0 +1,149 @@
+"""
+Finding the sites nearest to a location.
+
+Each process keeps a ``SiteIndex``: a k-d tree over the sites' positions as
+points on the unit sphere, where straight-line (chord) distance grows with
+great-circle distance. Nearest-N and within-radius searches visit a few
+nodes instead of computing the distance to every site, and need no
+database query beyond loading the matching sites.
+
+Saving or deleting a site changes a version number in the cache, and every
+process rebuilds its index the next time it is used.
+"""
+import heapq
+import math
+import uuid
+
+from django.core.cache import cache
+
+from .models import Site
+
+EARTH_RADIUS_KM = 6371.0088
+VERSION_KEY = 'geo:sites:version'
+
+_index = None
+_index_version = None
+
+
+def to_vector(latitude, longitude):
+    latitude, longitude = math.radians(latitude), math.radians(longitude)
+    return (
+        math.cos(latitude) * math.cos(longitude),
+        math.cos(latitude) * math.sin(longitude),
+        math.sin(latitude),
+    )
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1))
+
+
+def km_to_chord(km):
+    return 2 * math.sin(min(km / (2 * EARTH_RADIUS_KM), math.pi / 2))
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    """Great-circle distance between two points, for checking the index."""
+    latitude1, longitude1, latitude2, longitude2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = (
+        math.sin((latitude2 - latitude1) / 2) ** 2
+        + math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class SiteIndex:
+    """A 3-d tree of ``(site id, latitude, longitude)`` points."""
+
+    def __init__(self, points):
+        self.size = len(points)
+        self.root = self.build([(to_vector(latitude, longitude), site_id) for site_id, latitude, longitude in points], 0)
+
+    @classmethod
+    def build(cls, points, depth):
+        """Nodes are ``(vector, site id, axis, left, right)`` tuples."""
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda point: point[0][axis])
+        middle = len(points) // 2
+        return (
+            points[middle][0],
+            points[middle][1],
+            axis,
+            cls.build(points[:middle], depth + 1),
+            cls.build(points[middle + 1:], depth + 1),
+        )
+
+    def nearest(self, latitude, longitude, count=None, radius_km=None):
+        """
+        ``[(distance km, site id), ...]``, closest first: at most ``count``
+        sites, and only those within ``radius_km`` if it is given.
+        """
+        target = to_vector(latitude, longitude)
+        limit = km_to_chord(radius_km) ** 2 if radius_km is not None else math.inf
+        # Max-heap of the best matches so far, as (-squared chord, site id)
+        best = []
+
+        def bound():
+            if count is not None and len(best) == count:
+                return min(-best[0][0], limit)
+            return limit
+
+        def visit(node):
+            if node is None:
+                return
+            vector, site_id, axis, left, right = node
+            distance = sum((a - b) ** 2 for a, b in zip(vector, target))
+            if distance <= bound():
+                heapq.heappush(best, (-distance, site_id))
+                if count is not None and len(best) > count:
+                    heapq.heappop(best)
+            offset = target[axis] - vector[axis]
+            near, far = (left, right) if offset < 0 else (right, left)
+            visit(near)
+            # The far side can only hold closer points if the splitting plane is within reach
+            if offset * offset <= bound():
+                visit(far)
+
+        if count != 0:
+            visit(self.root)
+        return [(chord_to_km(math.sqrt(-distance)), site_id) for distance, site_id in sorted(best, reverse=True)]
+
+
+def site_index():
+    """This process's ``SiteIndex``, rebuilt if any site changed since it was built."""
+    global _index, _index_version
+    version = cache.get(VERSION_KEY)
+    if _index is None or version != _index_version:
+        _index = SiteIndex(list(
+            Site.objects.filter(latitude__isnull=False, longitude__isnull=False)
+            .values_list('pk', 'latitude', 'longitude')
+        ))
+        _index_version = version
+    return _index
+
+
+def invalidate_site_index():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def nearest_sites(latitude, longitude, count=None, radius_km=None, queryset=None):
+    """Sites closest first, each with a ``distance_km`` attribute."""
+    matches = site_index().nearest(latitude, longitude, count, radius_km)
+    sites = (queryset if queryset is not None else Site.objects.all()).in_bulk([site_id for _, site_id in matches])
+    result = []
+    for distance, site_id in matches:
+        # A site deleted since the index was built is simply skipped
+        if site_id in sites:
+            sites[site_id].distance_km = distance
+            result.append(sites[site_id])
+    return result
+
+
+def parse_location(latitude, longitude):
+    """``(latitude, longitude)`` from request parameters; ValueError if they are not a valid position."""
+    latitude, longitude = float(latitude), float(longitude)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('Latitude must be within ±90 and longitude within ±180.')
+    return latitude, longitude
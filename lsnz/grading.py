@@ -0,0 +1,156 @@
+"""
+Suggest grades from recent competitive performance.
+
+A player's performance is the average share of opponents they outscored in
+each game over the last ``GRADING_WINDOW_DAYS``. Active players with at
+least ``GRADING_MIN_GAMES`` games are ranked against each other, and each
+is suggested the best grade whose ``Grade.percentile`` they reach.
+Inactive players still count as opponents. Nothing changes until the
+suggestions are reviewed and applied.
+"""
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .backends import invalidate_cached_users
+from .models import GameResult, Grade, Player
+
+
+@dataclass
+class GradeChange:
+    player: Player
+    current: Grade | None
+    suggested: Grade
+    percentile: float
+    games: int
+
+    @property
+    def direction(self):
+        if self.current is None:
+            return 'assign'
+        return 'promote' if self.suggested.points > self.current.points else 'demote'
+
+    @property
+    def reason(self):
+        if self.direction == 'demote':
+            return (
+                f'{self.percentile:.0f}th percentile over {self.games} games, '
+                f'below the {self.current} threshold of {self.current.percentile:.0f}'
+            )
+        return (
+            f'{self.percentile:.0f}th percentile over {self.games} games, '
+            f'{self.suggested} starts at {self.suggested.percentile:.0f}'
+        )
+
+
+def game_performance(since):
+    """
+    Map player id to ``(average share of opponents outscored, games)`` for
+    every game played since ``since``, in one pass over the results.
+    Inactive players are scored too, as they were still opponents.
+    """
+    rows = (
+        GameResult.objects.filter(game__played_at__gte=since)
+        .order_by('game_id')
+        .values_list('game_id', 'player_id', 'score')
+    )
+    totals = {}
+    for _, results in groupby(rows.iterator(chunk_size=5000), key=lambda row: row[0]):
+        results = list(results)
+        opponents = len(results) - 1
+        if not opponents:
+            continue
+        scores = sorted(score for _, _, score in results)
+        for _, player_id, score in results:
+            # Ties count as half a win
+            below = bisect_left(scores, score)
+            tied = bisect_right(scores, score) - below - 1
+            share = (below + tied / 2) / opponents
+            total, games = totals.get(player_id, (0.0, 0))
+            totals[player_id] = (total + share, games + 1)
+    return {player_id: (total / games, games) for player_id, (total, games) in totals.items()}
+
+
+def population_percentiles(performance):
+    """Rank each player's performance against everyone else's, from 0 to 100."""
+    ordered = sorted(performance.items(), key=lambda item: item[1])
+    count = len(ordered)
+    percentiles = {}
+    for position, (player_id, _) in enumerate(ordered):
+        percentiles[player_id] = 100 * position / (count - 1) if count > 1 else 100
+    # Equal performance should get an equal percentile
+    for _, group in groupby(ordered, key=lambda item: item[1]):
+        group = [player_id for player_id, _ in group]
+        shared = sum(percentiles[player_id] for player_id in group) / len(group)
+        for player_id in group:
+            percentiles[player_id] = shared
+    return percentiles
+
+
+def suggest_grade_changes(now=None):
+    """Return the reviewable list of GradeChange suggestions."""
+    now = now or timezone.now()
+    window = timedelta(days=getattr(settings, 'GRADING_WINDOW_DAYS', 365))
+    min_games = getattr(settings, 'GRADING_MIN_GAMES', 10)
+    margin = getattr(settings, 'GRADING_DEMOTION_MARGIN', 5)
+
+    grades = list(Grade.objects.filter(percentile__isnull=False).order_by('-points'))
+    if not grades:
+        return []
+    performance = {
+        player_id: (share, games)
+        for player_id, (share, games) in game_performance(now - window).items()
+        if games >= min_games
+    }
+    # Thresholds are percentiles of the active players only
+    players = list(
+        Player.objects.filter(pk__in=performance, is_active=True).select_related('grade').order_by('alias')
+    )
+    percentiles = population_percentiles({player.pk: performance[player.pk][0] for player in players})
+
+    changes = []
+    for player in players:
+        percentile = percentiles[player.pk]
+        suggested = next((grade for grade in grades if percentile >= grade.percentile), grades[-1])
+        current = player.grade
+        if current is not None and current.pk == suggested.pk:
+            continue
+        if current is not None and current.percentile is None:
+            # Grades without a threshold are only ever changed by hand
+            continue
+        if (
+            current is not None and suggested.points < current.points
+            and percentile >= current.percentile - margin
+        ):
+            # Only demote players clearly below their grade, so borderline players don't flap
+            continue
+        changes.append(GradeChange(player, current, suggested, percentile, performance[player.pk][1]))
+    return changes
+
+
+def apply_grade_changes(changes):
+    """
+    Save accepted suggestions in one bulk update. A suggestion is skipped if
+    the player's grade was changed by someone else since it was made.
+    Returns the number of players updated.
+    """
+    expected = {change.player.pk: change for change in changes}
+    with transaction.atomic():
+        players = list(
+            Player.objects.select_for_update().filter(pk__in=expected).only('pk', 'grade')
+        )
+        updated = []
+        for player in players:
+            change = expected[player.pk]
+            if player.grade_id == (change.current.pk if change.current else None):
+                player.grade = change.suggested
+                updated.append(player)
+        Player.objects.bulk_update(updated, ['grade'])
+    # bulk_update sends no signals, so the cached users are cleared here
+    invalidate_cached_users([player.pk for player in updated])
+    return len(updated)
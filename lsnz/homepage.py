@@ -0,0 +1,100 @@
+"""
+The homepage, stitched together from separately cached blocks.
+
+Each ``Block`` renders one panel to HTML and is cached under its own key.
+A request reads every block with a single ``get_many``; blocks that are
+missing are rendered concurrently, each in its own thread with its own
+database connection, and written back to the cache.
+
+Blocks are dropped from the cache when the models they show change (see
+``lsnz.signals``) and otherwise expire after ``timeout`` seconds, which
+also covers content that changes with time, such as which tournaments are
+still upcoming.
+"""
+import asyncio
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import connection
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from .models import MazeMap, Player, PlayerStats, Post, Site, Tournament
+
+
+@dataclass
+class Block:
+    name: str
+    template: str
+    query: object
+    models: tuple
+    timeout: int
+
+    @property
+    def key(self):
+        return f'homepage:{self.name}'
+
+    def render(self):
+        try:
+            return render_to_string(self.template, {'objects': self.query()})
+        finally:
+            # Runs in a worker thread, whose connection would otherwise stay open
+            connection.close()
+
+
+def upcoming_tournaments():
+    return list(
+        Tournament.objects.filter(end_date__gte=timezone.now().date())
+        .select_related('site').order_by('start_date')[:5]
+    )
+
+
+def latest_posts():
+    return list(Post.objects.select_related('author').order_by('-created_at')[:3])
+
+
+def active_players():
+    return list(
+        PlayerStats.objects.filter(last_played__isnull=False, player__is_active=True)
+        .select_related('player', 'player__grade').order_by('-last_played', '-events_played')[:8]
+    )
+
+
+def featured_maze_maps():
+    return list(
+        MazeMap.objects.filter(max_zoom__isnull=False).exclude(preview='')
+        .select_related('site').order_by('-date')[:3]
+    )
+
+
+BLOCKS = [
+    Block('upcoming_tournaments', 'lsnz/home/upcoming_tournaments.html', upcoming_tournaments, (Tournament, Site), 3600),
+    Block('latest_posts', 'lsnz/home/latest_posts.html', latest_posts, (Post, Player), 3600),
+    # Player statistics are written in bulk without signals, so this one relies on its timeout
+    Block('active_players', 'lsnz/home/active_players.html', active_players, (Player,), 900),
+    Block('featured_maze_maps', 'lsnz/home/featured_maze_maps.html', featured_maze_maps, (MazeMap, Site), 3600),
+]
+
+
+def store_blocks(blocks, rendered):
+    for block in blocks:
+        cache.set(block.key, rendered[block.key], block.timeout)
+
+
+async def homepage_blocks():
+    """``{block name: HTML}`` for every block, rendering and caching the missing ones."""
+    cached = await sync_to_async(cache.get_many)([block.key for block in BLOCKS])
+    missing = [block for block in BLOCKS if block.key not in cached]
+    if missing:
+        rendered = await asyncio.gather(*(sync_to_async(block.render, thread_sensitive=False)() for block in missing))
+        fresh = {block.key: html for block, html in zip(missing, rendered)}
+        await sync_to_async(store_blocks)(missing, fresh)
+        cached.update(fresh)
+    return {block.name: mark_safe(cached[block.key]) for block in BLOCKS}
+
+
+def invalidate_homepage(model):
+    """Drop every block that shows ``model``."""
+    cache.delete_many([block.key for block in BLOCKS if model in block.models])
@@ -0,0 +1,355 @@
+import codecs
+import csv
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from .models import Event, Grade, Pass, Player, Registration, Site, Team
+from .sales import pass_days, refresh_pass_sales
+from .slugs import allocate_slugs
+from .stats import refresh_event_counts, refresh_player_stats
+
+
+class ImportResult:
+    """Outcome of a CSV import run, used for the admin dry-run report."""
+
+    preview_limit = 20
+    error_limit = 200
+
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.rows = 0
+        self.created = 0
+        self.errors = []
+        self.error_count = 0
+        self.preview = []
+
+    @property
+    def ok(self):
+        return self.error_count == 0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < self.error_limit:
+            self.errors.append((line, message))
+
+    def add_preview(self, values):
+        if len(self.preview) < self.preview_limit:
+            self.preview.append(values)
+
+
+class CsvImporter:
+    """
+    Stream rows out of an uploaded CSV file and bulk create model instances.
+
+    Rows are read and validated in batches of ``batch_size`` so memory use
+    stays flat however large the file is. Lookups against existing rows are
+    made once per batch rather than once per row. Nothing is written unless
+    every row in the file is valid.
+    """
+    model = None
+    columns = ()
+    required_columns = ()
+    clean_exclude = ()
+    batch_size = 500
+
+    def __init__(self, csv_file):
+        self.csv_file = csv_file
+
+    def read_rows(self):
+        """
+        Yield ``(line, row)`` for each row. A file that isn't UTF-8 or isn't
+        valid CSV raises ValidationError naming the line, like a missing column.
+        """
+        reader = csv.DictReader(codecs.iterdecode(self.csv_file, 'utf-8-sig'))
+        # DictReader.line_num only moves on once a row is returned
+        lines = reader.reader
+        try:
+            missing = set(self.required_columns) - set(reader.fieldnames or [])
+            if missing:
+                raise ValidationError(
+                    'Missing required column(s): %s' % ', '.join(sorted(missing))
+                )
+            # Line 1 is the header row
+            for line, row in enumerate(reader, start=2):
+                yield line, {key: (value or '').strip() for key, value in row.items() if key}
+        except UnicodeDecodeError:
+            # The line that failed to decode was never handed to the reader
+            raise ValidationError('Line %d is not valid UTF-8 text.' % (lines.line_num + 1))
+        except csv.Error as e:
+            raise ValidationError('Line %d is not valid CSV: %s' % (lines.line_num, e))
+
+    def batches(self):
+        rows = self.read_rows()
+        while batch := list(islice(rows, self.batch_size)):
+            yield batch
+
+    def run(self, dry_run=True):
+        """Validate the whole file and, unless ``dry_run``, create the rows."""
+        result = ImportResult(dry_run)
+        self.prepare()
+        saved = []
+        with transaction.atomic():
+            for batch in self.batches():
+                result.rows += len(batch)
+                valid = self.build_batch(batch, result)
+                instances = []
+                for row, instance in valid:
+                    result.add_preview([row.get(column, '') for column in self.columns])
+                    instances.append(instance)
+                if not dry_run and result.ok:
+                    self.model.objects.bulk_create(instances, batch_size=self.batch_size)
+                    self.created(instances)
+                    saved.extend(instance.pk for instance in instances)
+                result.created += len(instances)
+            if dry_run or not result.ok:
+                transaction.set_rollback(True)
+            else:
+                self.stamp(saved)
+        if not dry_run and not result.ok:
+            result.created = 0
+        return result
+
+    def stamp(self, pks):
+        """
+        Set ``updated_at`` on the saved rows just before the import commits.
+        Otherwise a long import would carry timestamps older than the
+        history export's settle window by the time its rows could be read.
+        """
+        if not any(field.name == 'updated_at' for field in self.model._meta.concrete_fields):
+            return
+        now = timezone.now()
+        for start in range(0, len(pks), self.batch_size):
+            self.model.objects.filter(pk__in=pks[start:start + self.batch_size]).update(updated_at=now)
+
+    def prepare(self):
+        """Load small reference tables that every batch needs."""
+
+    def created(self, instances):
+        """Called after each batch is saved, as bulk_create sends no signals."""
+
+    def build_batch(self, rows, result):
+        """
+        Return ``(row, instance)`` pairs for the valid rows in ``rows``,
+        recording every invalid row on ``result``.
+        """
+        raise NotImplementedError
+
+    def build_instance(self, line, result, **values):
+        instance = self.model(**values)
+        try:
+            instance.clean_fields(exclude=self.clean_exclude)
+        except ValidationError as e:
+            for field, messages in e.message_dict.items():
+                for message in messages:
+                    result.add_error(line, f'{field}: {message}')
+            return None
+        return instance
+
+    @staticmethod
+    def players_by_email(emails):
+        """Map lowercased email to player id for every player in ``emails``."""
+        return dict(
+            Player.objects.annotate(email_lower=Lower('email'))
+            .filter(email_lower__in={email.lower() for email in emails})
+            .values_list('email_lower', 'pk')
+        )
+
+
+class PlayerImporter(CsvImporter):
+    """
+    Create players from ``email,alias,first_name,last_name,grade,home_site,bio``.
+
+    Imported players get an unusable password and set their own through the
+    password reset flow, so no hashing is done during the import.
+    """
+    model = Player
+    columns = ('email', 'alias', 'first_name', 'last_name', 'grade', 'home_site', 'bio')
+    required_columns = ('email', 'alias')
+    clean_exclude = ('password', 'slug', 'grade', 'home_site', 'username')
+
+    def stamp(self, pks):
+        """
+        Set ``updated_at`` on the saved rows just before the import commits.
+        Otherwise a long import would carry timestamps older than the
+        history export's settle window by the time its rows could be read.
+        """
+        if not any(field.name == 'updated_at' for field in self.model._meta.concrete_fields):
+            return
+        now = timezone.now()
+        for start in range(0, len(pks), self.batch_size):
+            self.model.objects.filter(pk__in=pks[start:start + self.batch_size]).update(updated_at=now)
+
+    def prepare(self):
+        self.grades = {grade.letter.lower(): grade for grade in Grade.objects.all()}
+        self.sites = {site.slug: site for site in Site.objects.all()}
+        self.seen_emails = set()
+        self.seen_aliases = set()
+
+    def build_batch(self, rows, result):
+        existing_emails = self.players_by_email(row['email'] for _, row in rows)
+        existing_aliases = set(
+            Player.objects.annotate(alias_lower=Lower('alias'))
+            .filter(alias_lower__in={row['alias'].lower() for _, row in rows})
+            .values_list('alias_lower', flat=True)
+        )
+
+        instances = []
+        for line, row in rows:
+            email = Player.objects.normalize_email(row['email'])
+            alias = row['alias']
+            if not email or not alias:
+                result.add_error(line, 'Email and alias are required.')
+                continue
+            if email.lower() in existing_emails or email.lower() in self.seen_emails:
+                result.add_error(line, f'A player with email {email} already exists.')
+                continue
+            if alias.lower() in existing_aliases or alias.lower() in self.seen_aliases:
+                result.add_error(line, f'The alias {alias} is already taken.')
+                continue
+
+            grade = None
+            if row.get('grade'):
+                grade = self.grades.get(row['grade'].lower())
+                if grade is None:
+                    result.add_error(line, f"Unknown grade {row['grade']}.")
+                    continue
+            home_site = None
+            if row.get('home_site'):
+                home_site = self.sites.get(row['home_site'])
+                if home_site is None:
+                    result.add_error(line, f"Unknown site {row['home_site']}.")
+                    continue
+
+            player = self.build_instance(
+                line, result,
+                email=email,
+                alias=alias,
+                first_name=row.get('first_name', ''),
+                last_name=row.get('last_name', ''),
+                bio=row.get('bio') or None,
+                grade=grade,
+                home_site=home_site,
+            )
+            if player is None:
+                continue
+            player.set_unusable_password()
+            self.seen_emails.add(email.lower())
+            self.seen_aliases.add(alias.lower())
+            instances.append((row, player))
+
+        allocate_slugs(player for _, player in instances)
+        return instances
+
+
+class PassImporter(CsvImporter):
+    """Create passes from ``email,pass_type,start_date,end_date,price_paid``."""
+    model = Pass
+    columns = ('email', 'pass_type', 'start_date', 'end_date', 'price_paid')
+    required_columns = columns
+    clean_exclude = ('player',)
+
+    def created(self, instances):
+        refresh_player_stats({instance.player_id for instance in instances})
+        refresh_pass_sales(set().union(*(pass_days(vars(instance)) for instance in instances)))
+
+    def build_batch(self, rows, result):
+        players = self.players_by_email(row['email'] for _, row in rows)
+        home_sites = dict(Player.objects.filter(pk__in=players.values()).values_list('pk', 'home_site'))
+
+        instances = []
+        for line, row in rows:
+            player_id = players.get(row['email'].lower())
+            if player_id is None:
+                result.add_error(line, f"No player with email {row['email']}.")
+                continue
+            pass_obj = self.build_instance(
+                line, result,
+                player_id=player_id,
+                home_site_id=home_sites[player_id],
+                pass_type=row['pass_type'],
+                start_date=row['start_date'],
+                end_date=row['end_date'],
+                price_paid=row['price_paid'],
+            )
+            if pass_obj is None:
+                continue
+            if pass_obj.end_date < pass_obj.start_date:
+                result.add_error(line, 'end_date is before start_date.')
+                continue
+            instances.append((row, pass_obj))
+        return instances
+
+
+class RegistrationImporter(CsvImporter):
+    """Create registrations from ``email,event,team,paid`` where event is an event id."""
+    model = Registration
+    columns = ('email', 'event', 'team', 'paid')
+    required_columns = ('email', 'event')
+    clean_exclude = ('player', 'event', 'team')
+    truthy = {'1', 'true', 'yes', 'y', 'paid'}
+
+    def stamp(self, pks):
+        """
+        Set ``updated_at`` on the saved rows just before the import commits.
+        Otherwise a long import would carry timestamps older than the
+        history export's settle window by the time its rows could be read.
+        """
+        if not any(field.name == 'updated_at' for field in self.model._meta.concrete_fields):
+            return
+        now = timezone.now()
+        for start in range(0, len(pks), self.batch_size):
+            self.model.objects.filter(pk__in=pks[start:start + self.batch_size]).update(updated_at=now)
+
+    def prepare(self):
+        self.seen = set()
+
+    def created(self, instances):
+        refresh_event_counts({instance.event_id for instance in instances})
+        refresh_player_stats({instance.player_id for instance in instances})
+
+    def build_batch(self, rows, result):
+        players = self.players_by_email(row['email'] for _, row in rows)
+        event_ids = {row['event'] for _, row in rows if row['event'].isdigit()}
+        events = Event.objects.select_related('format', 'tournament').in_bulk(event_ids)
+        teams = {
+            (team.event_id, team.name.lower()): team
+            for team in Team.objects.filter(event__in=event_ids)
+        }
+        existing = set(
+            Registration.objects.filter(event__in=event_ids, player__in=players.values())
+            .values_list('event_id', 'player_id')
+        )
+
+        instances = []
+        for line, row in rows:
+            player_id = players.get(row['email'].lower())
+            if player_id is None:
+                result.add_error(line, f"No player with email {row['email']}.")
+                continue
+            event = events.get(int(row['event'])) if row['event'].isdigit() else None
+            if event is None:
+                result.add_error(line, f"No event with id {row['event']}.")
+                continue
+            team = None
+            if row.get('team'):
+                team = teams.get((event.pk, row['team'].lower()))
+                if team is None:
+                    result.add_error(line, f"No team {row['team']} in event {event.pk}.")
+                    continue
+            key = (event.pk, player_id)
+            if key in existing or key in self.seen:
+                result.add_error(line, f"{row['email']} is already registered for event {event.pk}.")
+                continue
+            self.seen.add(key)
+            instances.append((row, Registration(
+                event=event,
+                player_id=player_id,
+                team=team,
+                paid=row.get('paid', '').lower() in self.truthy,
+            )))
+        return instances
+
@@ -0,0 +1,26 @@
+from django.template.defaultfilters import date
+from django.templatetags.static import static
+from django.urls import reverse
+from jinja2 import Environment
+
+
+def url(viewname, *args, **kwargs):
+    """Jinja2 equivalent of the ``{% url %}`` tag"""
+    return reverse(viewname, args=args or None, kwargs=kwargs or None)
+
+
+def environment(**options):
+    """
+    Build the Jinja2 environment for templates under ``lsnz/jinja2/``.
+
+    Bootstrap helpers (``bootstrap_css()``, ``bootstrap_messages()``,
+    ``bootstrap_pagination(page)``...) come from the django_bootstrap5
+    extension enabled in settings.
+    """
+    env = Environment(**options)
+    env.globals.update({
+        'static': static,
+        'url': url,
+    })
+    env.filters['date'] = date
+    return env
@@ -0,0 +1,18 @@
+"""
+Entry points for ``run_jobs`` pool processes.
+
+Pool processes are spawned rather than forked, so they never share the
+parent's database connections. They unpickle these functions before Django
+is set up, so nothing here may import models at module level.
+"""
+import django
+
+
+def init_process():
+    django.setup()
+
+
+def run(job_id):
+    from .jobs import run_job
+
+    return run_job(job_id)
@@ -0,0 +1,191 @@
+"""
+Background jobs stored in the database and run by ``manage.py run_jobs``.
+
+Decorate a module-level function with ``@job`` and call ``.enqueue()`` with
+JSON-serialisable arguments to run it later::
+
+    @job(priority=5)
+    def build_maze_tiles(maze_map_id):
+        ...
+
+    build_maze_tiles.enqueue(maze_map.pk)
+
+Enqueuing inside a transaction means the job only becomes visible to
+workers once the transaction commits, and is dropped if it rolls back.
+"""
+import os
+import socket
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+# How long a worker may hold a job before it is assumed lost
+LEASE = timedelta(minutes=30)
+KEEP_FINISHED_JOBS = timedelta(days=7)
+
+registry = {}
+
+
+class JobFunction:
+    """A function that can be called directly or enqueued as a Job."""
+
+    def __init__(self, func, priority=0, max_attempts=3, retry_delay=timedelta(seconds=30), every=None):
+        self.func = func
+        self.name = f'{func.__module__}.{func.__qualname__}'
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.every = every
+        self.__doc__ = func.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def __repr__(self):
+        return f'<job {self.name}>'
+
+    def enqueue(self, *args, run_at=None, priority=None, **kwargs):
+        return Job.objects.create(
+            name=self.name,
+            args=list(args),
+            kwargs=kwargs,
+            priority=self.priority if priority is None else priority,
+            max_attempts=self.max_attempts,
+            run_at=run_at or timezone.now(),
+        )
+
+    def enqueue_once(self, *args, **kwargs):
+        """Enqueue unless the same call is already waiting to run."""
+        waiting = Job.objects.filter(name=self.name, status=Job.QUEUED, args=list(args), kwargs=kwargs)
+        return waiting.first() or self.enqueue(*args, **kwargs)
+
+    def schedule_next(self, after):
+        """Queue the next run of a periodic job unless one is already waiting."""
+        if self.every and not Job.objects.filter(name=self.name, status=Job.QUEUED).exists():
+            self.enqueue(run_at=after + self.every)
+
+
+def job(func=None, **options):
+    """
+    Register ``func`` as a job. Options are those of ``JobFunction``; pass
+    ``every=timedelta(...)`` for a job that reschedules itself after each run.
+    """
+    def decorator(func):
+        job_function = JobFunction(func, **options)
+        registry[job_function.name] = job_function
+        return job_function
+
+    return decorator(func) if func is not None else decorator
+
+
+def get_job_function(name):
+    if name not in registry:
+        # Importing the module registers its jobs
+        import_string(name)
+    return registry[name]
+
+
+def schedule_periodic_jobs():
+    """Make sure every periodic job has a run queued. Called when workers start."""
+    now = timezone.now()
+    for job_function in registry.values():
+        if job_function.every and not Job.objects.filter(
+            name=job_function.name, status__in=[Job.QUEUED, Job.RUNNING]
+        ).exists():
+            job_function.enqueue(run_at=now)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim_jobs(limit, worker=None):
+    """
+    Claim up to ``limit`` due jobs, highest priority first.
+
+    Databases that support it use SELECT ... FOR UPDATE SKIP LOCKED so
+    concurrent workers pass over each other's rows instead of waiting. On
+    SQLite, which locks the whole database for writes anyway, the claim is a
+    single UPDATE that re-checks the job is still due; a job another worker
+    got to first simply isn't updated.
+    """
+    now = timezone.now()
+    due = Q(status=Job.QUEUED, run_at__lte=now) | Q(status=Job.RUNNING, locked_until__lt=now)
+    candidates = Job.objects.filter(due).order_by('-priority', 'run_at', 'pk').values_list('pk', flat=True)
+    token = uuid.uuid4()
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        Job.objects.filter(due, pk__in=list(candidates[:limit])).update(
+            status=Job.RUNNING,
+            claim_token=token,
+            locked_until=now + LEASE,
+            worker=worker or worker_name(),
+            attempts=F('attempts') + 1,
+            started_at=now,
+        )
+    return list(Job.objects.filter(claim_token=token).order_by('-priority', 'run_at', 'pk'))
+
+
+def run_job(job_id):
+    """Run a claimed job and record the outcome. Never raises."""
+    job = Job.objects.get(pk=job_id)
+    started = time.monotonic()
+    try:
+        job_function = get_job_function(job.name)
+    except (ImportError, KeyError):
+        job_function = None
+        job.last_error = f'No job named {job.name}.'
+    else:
+        try:
+            job_function(*job.args, **job.kwargs)
+        except Exception:
+            job.last_error = traceback.format_exc()
+        else:
+            job.last_error = ''
+
+    if not job.last_error:
+        job.status = Job.DONE
+    elif job_function is not None and job.attempts < job.max_attempts:
+        job.status = Job.QUEUED
+        job.run_at = timezone.now() + job_function.retry_delay * 2 ** (job.attempts - 1)
+    else:
+        job.status = Job.FAILED
+    job.duration = time.monotonic() - started
+    job.finished_at = timezone.now()
+    job.locked_until = None
+    job.claim_token = None
+    job.save(update_fields=[
+        'status', 'run_at', 'last_error', 'duration', 'finished_at', 'locked_until', 'claim_token',
+    ])
+    if job.status != Job.QUEUED and job_function is not None:
+        job_function.schedule_next(job.started_at)
+    return job.status
+
+
+def run_pending_jobs(limit=None):
+    """Run due jobs in this process until there are none left, or ``limit`` have run."""
+    ran = 0
+    while limit is None or ran < limit:
+        jobs = claim_jobs(1)
+        if not jobs:
+            break
+        run_job(jobs[0].pk)
+        ran += 1
+    return ran
+
+
+@job(every=timedelta(days=1))
+def prune_jobs():
+    """Delete finished jobs once they are no longer interesting."""
+    Job.objects.filter(
+        status__in=[Job.DONE, Job.FAILED], finished_at__lt=timezone.now() - KEEP_FINISHED_JOBS
+    ).delete()
@@ -0,0 +1,276 @@
+"""
+Live tournament scoreboards pushed to spectators over Server-Sent Events.
+
+Each process runs at most one ``ScoreboardFeed`` per tournament, however many
+spectators are connected. When results change the feed rebuilds the
+scoreboard once and hands the same rendered snapshot to every client.
+
+Feeds find out about changes through a broker chosen with
+``settings.LIVE_BROKER``. ``LocalBroker`` only sees changes saved in the same
+process, which suits ``runserver`` and single-process deployments.
+``CacheBroker`` shares a change counter through the cache, so every process
+and node using the same cache server sees every change.
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.template.loader import render_to_string
+from django.utils.module_loading import import_string
+
+from .models import Event, GameResult, Player, TournamentArchive
+
+logger = logging.getLogger(__name__)
+
+# Comment lines sent to idle connections so proxies don't time them out
+KEEPALIVE_INTERVAL = 15
+
+def channel_name(tournament_id):
+    return f'tournament-{tournament_id}'
+
+
+class LocalBroker:
+    """Pass change notifications between threads and event loops in this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listeners = defaultdict(set)
+
+    def publish(self, channel):
+        # Usually called from a sync view running in a worker thread
+        with self.lock:
+            listeners = list(self.listeners[channel])
+        for listener in listeners:
+            listener.loop.call_soon_threadsafe(listener.changed.set)
+
+    def listen(self, channel):
+        """Start collecting changes to ``channel``. Call from the event loop."""
+        listener = LocalListener(self, channel)
+        with self.lock:
+            self.listeners[channel].add(listener)
+        return listener
+
+    def stop_listening(self, listener):
+        with self.lock:
+            self.listeners[listener.channel].discard(listener)
+            if not self.listeners[listener.channel]:
+                del self.listeners[listener.channel]
+
+
+class LocalListener:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.changed = asyncio.Event()
+
+    async def wait(self):
+        """Return once there has been at least one change since the last call."""
+        await self.changed.wait()
+        self.changed.clear()
+
+    def close(self):
+        self.broker.stop_listening(self)
+
+
+class CacheBroker:
+    """
+    Share changes between processes and nodes through a version number in
+    the cache. Feeds poll it every ``LIVE_POLL_INTERVAL`` seconds, which is
+    one cache read per tournament per process rather than per spectator.
+    """
+
+    def __init__(self):
+        self.poll_interval = getattr(settings, 'LIVE_POLL_INTERVAL', 2)
+
+    def key(self, channel):
+        return f'live:{channel}'
+
+    def publish(self, channel):
+        key = self.key(channel)
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+    def listen(self, channel):
+        return CacheListener(self.key(channel), self.poll_interval)
+
+
+class CacheListener:
+    def __init__(self, key, poll_interval):
+        self.key = key
+        self.poll_interval = poll_interval
+        self.version = None
+
+    async def wait(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            latest = await cache.aget(self.key)
+            if latest != self.version:
+                self.version = latest
+                return
+
+    def close(self):
+        pass
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'LIVE_BROKER', 'lsnz.live.LocalBroker'))()
+    return _broker
+
+
+def publish_tournament_change(tournament_id):
+    get_broker().publish(channel_name(tournament_id))
+
+
+def game_standings(tournament_id):
+    """
+    Each event's players ranked by total score, keyed by event id. A player
+    who changed teams during the event is shown with their latest team.
+    """
+    standings = defaultdict(list)
+    latest_team = (
+        GameResult.objects.filter(game__event=OuterRef('game__event'), player=OuterRef('player'))
+        .order_by('-game__played_at', '-game__number')
+        .values('team__name')[:1]
+    )
+    rows = (
+        GameResult.objects.filter(game__event__tournament_id=tournament_id)
+        .values('game__event', 'player', 'player__alias', 'player__slug')
+        .annotate(total=Sum('score'), games=Count('game'), team=Subquery(latest_team))
+        .order_by('game__event', '-total', 'player__alias')
+    )
+    for row in rows:
+        row['team__name'] = row.pop('team')
+        standings[row['game__event']].append(row)
+    return standings
+
+
+def archived_standings(archive):
+    """``game_standings`` for an archived tournament, with the players' current names."""
+    players = Player.objects.only('alias', 'slug').in_bulk(
+        {row['player'] for rows in archive.standings.values() for row in rows}
+    )
+    standings = defaultdict(list)
+    for event_id, rows in archive.standings.items():
+        for row in rows:
+            player = players.get(row['player'])
+            if player is not None:
+                standings[int(event_id)].append({**row, 'player__alias': player.alias, 'player__slug': player.slug})
+    return standings
+
+
+def scoreboard_events(tournament_id):
+    """Every event in the tournament with its players ranked by total score."""
+    events = list(
+        Event.objects.filter(tournament_id=tournament_id).select_related('format').order_by('start_time')
+    )
+    archive = TournamentArchive.objects.filter(pk=tournament_id).first()
+    standings = archived_standings(archive) if archive else game_standings(tournament_id)
+    for event in events:
+        event.standings = standings[event.pk]
+    return events
+
+
+def render_scoreboard(tournament_id):
+    return render_to_string('lsnz/_scoreboard.html', {'events': scoreboard_events(tournament_id)})
+
+
+class ScoreboardFeed:
+    """The single producer of scoreboard snapshots for one tournament in this process."""
+
+    feeds = {}
+
+    def __init__(self, tournament_id):
+        self.tournament_id = tournament_id
+        self.clients = set()
+        self.snapshot = None
+        self.task = None
+
+    @classmethod
+    def get(cls, tournament_id):
+        if tournament_id not in cls.feeds:
+            cls.feeds[tournament_id] = cls(tournament_id)
+        return cls.feeds[tournament_id]
+
+    def subscribe(self):
+        # Only the latest snapshot matters, so a slow client just skips ahead
+        queue = asyncio.Queue(maxsize=1)
+        self.clients.add(queue)
+        if self.snapshot is not None:
+            queue.put_nowait(self.snapshot)
+        if self.task is None:
+            self.task = asyncio.create_task(self.produce())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.clients.discard(queue)
+        if not self.clients:
+            if self.task is not None:
+                self.task.cancel()
+            self.feeds.pop(self.tournament_id, None)
+
+    async def produce(self):
+        # Listen before the first build so no change can slip in between
+        listener = get_broker().listen(channel_name(self.tournament_id))
+        try:
+            await self.refresh()
+            while True:
+                await listener.wait()
+                await self.refresh()
+        finally:
+            listener.close()
+
+    async def refresh(self):
+        try:
+            html = await sync_to_async(render_scoreboard)(self.tournament_id)
+        except Exception:
+            # Clients keep the last snapshot; the next change tries again
+            logger.exception('Could not build the scoreboard for tournament %s', self.tournament_id)
+            return
+        snapshot = json.dumps({'html': html})
+        if snapshot == self.snapshot:
+            return
+        self.snapshot = snapshot
+        for queue in self.clients:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+
+
+def sse_message(data, event=None, retry=None):
+    lines = []
+    if retry is not None:
+        lines.append(f'retry: {retry}')
+    if event is not None:
+        lines.append(f'event: {event}')
+    lines.extend(f'data: {line}' for line in data.splitlines())
+    return '\n'.join(lines) + '\n\n'
+
+
+async def scoreboard_stream(tournament_id):
+    """Server-Sent Events for one spectator, fed by the tournament's shared feed."""
+    feed = ScoreboardFeed.get(tournament_id)
+    queue = feed.subscribe()
+    try:
+        yield sse_message('connected', retry=5000)
+        while True:
+            try:
+                snapshot = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+            except TimeoutError:
+                yield ': keepalive\n\n'
+            else:
+                yield sse_message(snapshot, event='scoreboard')
+    finally:
+        # Runs when the spectator disconnects and the response is cancelled
+        feed.unsubscribe(queue)
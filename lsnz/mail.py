@@ -0,0 +1,224 @@
+import base64
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .jobs import job
+from .models import Job, Player, QueuedEmail, Tournament
+
+# Delivery is retried with exponential backoff: 1, 2, 4, 8... minutes
+RETRY_BASE_DELAY = timedelta(minutes=1)
+RETRY_MAX_DELAY = timedelta(hours=6)
+MAX_ATTEMPTS = 8
+
+# How long a worker has to deliver a batch before others may retry it
+CLAIM_LEASE = timedelta(minutes=10)
+
+
+def serialize_message(message):
+    """Everything needed to rebuild ``message`` later, as JSON-friendly data"""
+    attachments = []
+    for attachment in message.attachments:
+        filename, content, mimetype = attachment[:3]
+        if isinstance(content, str):
+            content = content.encode()
+        attachments.append([filename, base64.b64encode(content).decode('ascii'), mimetype])
+    return {
+        'subject': message.subject,
+        'body': message.body,
+        'from_email': message.from_email,
+        'to': list(message.to),
+        'cc': list(message.cc),
+        'bcc': list(message.bcc),
+        'reply_to': list(message.reply_to),
+        'headers': dict(message.extra_headers),
+        'alternatives': [list(alternative[:2]) for alternative in getattr(message, 'alternatives', [])],
+        'attachments': attachments,
+    }
+
+
+def deserialize_message(data, connection=None):
+    message = EmailMultiAlternatives(
+        subject=data['subject'],
+        body=data['body'],
+        from_email=data['from_email'],
+        to=data['to'],
+        cc=data['cc'],
+        bcc=data['bcc'],
+        reply_to=data['reply_to'],
+        headers=data['headers'],
+        alternatives=[tuple(alternative) for alternative in data['alternatives']],
+        connection=connection,
+    )
+    for filename, content, mimetype in data['attachments']:
+        message.attach(filename, base64.b64decode(content), mimetype)
+    return message
+
+
+def queued_email(message):
+    return QueuedEmail(
+        subject=message.subject[:255],
+        recipients=', '.join(message.recipients()),
+        message=serialize_message(message),
+    )
+
+
+def deliver_soon():
+    """Bring the waiting ``send_queued_email`` run forward to now, queueing one only if none is waiting."""
+    waiting = send_queued_email.enqueue_once()
+    if waiting.run_at > timezone.now():
+        Job.objects.filter(pk=waiting.pk, status=Job.QUEUED).update(run_at=timezone.now())
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    """
+    Email backend that saves messages to the database instead of sending them.
+
+    Requests return as soon as the rows are written. The ``send_queued_email``
+    job sends them later through ``settings.QUEUED_EMAIL_DELIVERY_BACKEND``.
+    """
+
+    def send_messages(self, email_messages):
+        emails = [queued_email(message) for message in email_messages if message.recipients()]
+        if emails:
+            QueuedEmail.objects.bulk_create(emails)
+            deliver_soon()
+        return len(emails)
+
+
+def queue_mass_email(subject, body, recipients, html=None, from_email=None, batch_size=1000):
+    """
+    Queue one copy of a message per address in ``recipients``, which may be
+    any iterable (such as a values_list iterator), in bulk inserts of
+    ``batch_size`` rows.
+    """
+    queued = 0
+    batch = []
+    for address in recipients:
+        message = EmailMultiAlternatives(subject, body, from_email, [address])
+        if html:
+            message.attach_alternative(html, 'text/html')
+        batch.append(queued_email(message))
+        if len(batch) == batch_size:
+            QueuedEmail.objects.bulk_create(batch)
+            queued += len(batch)
+            batch = []
+    QueuedEmail.objects.bulk_create(batch)
+    deliver_soon()
+    return queued + len(batch)
+
+
+def announce_tournament(tournament, url):
+    """Queue an announcement of ``tournament`` to every active player."""
+    context = {'tournament': tournament, 'url': url}
+    subject = render_to_string('lsnz/email/tournament_announcement_subject.txt', context)
+    body = render_to_string('lsnz/email/tournament_announcement_message.txt', context)
+    recipients = (
+        Player.objects.filter(is_active=True).exclude(email='')
+        .order_by('pk').values_list('email', flat=True)
+    )
+    # All or nothing, so a retried job never queues the same announcement twice
+    with transaction.atomic():
+        return queue_mass_email(' '.join(subject.split()), body, recipients.iterator())
+
+
+@job
+def announce_tournaments(tournament_urls):
+    """
+    Queue announcements for several tournaments. ``tournament_urls`` is a
+    list of ``[tournament id, absolute URL]`` pairs.
+    """
+    urls = dict(tournament_urls)
+    # A failure part way through rolls back the earlier tournaments too, as the retry announces them again
+    with transaction.atomic():
+        for tournament in Tournament.objects.filter(pk__in=urls).select_related('site'):
+            announce_tournament(tournament, urls[tournament.pk])
+
+
+def claim_batch(batch_size):
+    """
+    Take up to ``batch_size`` due emails for this worker.
+
+    The claim is a single conditional UPDATE, so concurrent workers never
+    get the same email. A worker that dies mid-batch only holds its emails
+    until the lease runs out.
+    """
+    now = timezone.now()
+    due = (
+        QueuedEmail.objects.filter(status=QueuedEmail.QUEUED, next_attempt_at__lte=now)
+        .order_by('next_attempt_at')
+        .values_list('pk', flat=True)[:batch_size]
+    )
+    token = uuid.uuid4()
+    QueuedEmail.objects.filter(
+        pk__in=list(due), status=QueuedEmail.QUEUED, next_attempt_at__lte=now
+    ).update(claim_token=token, next_attempt_at=now + CLAIM_LEASE)
+    return list(QueuedEmail.objects.filter(claim_token=token).order_by('pk'))
+
+
+def retry_delay(attempts):
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+def deliver_queued_email(batch_size=100):
+    """
+    Send one batch of due emails over a single connection.
+
+    Returns the number of emails sent. Failed emails are retried with
+    exponential backoff until ``MAX_ATTEMPTS`` is reached.
+    """
+    emails = claim_batch(batch_size)
+    if not emails:
+        return 0
+
+    sent = 0
+    connection = get_connection(settings.QUEUED_EMAIL_DELIVERY_BACKEND)
+    try:
+        connection.open()
+        for email in emails:
+            email.attempts += 1
+            try:
+                deserialize_message(email.message, connection=connection).send()
+            except Exception as e:
+                email.last_error = f'{type(e).__name__}: {e}'
+                if email.attempts >= MAX_ATTEMPTS:
+                    email.status = QueuedEmail.FAILED
+                else:
+                    email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+                # The connection may have been dropped; reconnect once for the rest,
+                # as send() on a closed connection opens and closes one per email
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    # Each remaining send tries to connect again and records its own error
+                    pass
+            else:
+                email.status = QueuedEmail.SENT
+                email.sent_at = timezone.now()
+                email.last_error = ''
+                sent += 1
+            email.claim_token = None
+    finally:
+        connection.close()
+        with transaction.atomic():
+            QueuedEmail.objects.bulk_update(
+                emails,
+                ['status', 'attempts', 'next_attempt_at', 'claim_token', 'last_error', 'sent_at'],
+            )
+    return sent
+
+
+@job(priority=10, every=timedelta(minutes=1))
+def send_queued_email(batch_size=100):
+    """Deliver batches of due emails until fewer than a full batch is sent."""
+    total = 0
+    while (sent := deliver_queued_email(batch_size)) == batch_size:
+        total += sent
+    return total + sent
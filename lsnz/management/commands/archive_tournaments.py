@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from lsnz.archive import archivable_tournaments, archive_tournament
+
+
+class Command(BaseCommand):
+    help = "Move the teams, registrations and games of long-finished tournaments into summary records."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, help='Archive tournaments that ended more than this many days ago. '
+            'Defaults to settings.ARCHIVE_AFTER_DAYS.',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='List the tournaments without archiving them.')
+
+    def handle(self, *args, days, dry_run, **options):
+        tournaments = list(archivable_tournaments(days))
+        for tournament in tournaments:
+            if dry_run:
+                self.stdout.write(f'{tournament.slug} (ended {tournament.end_date})')
+                continue
+            archive = archive_tournament(tournament)
+            self.stdout.write(
+                f'{tournament.slug}: {archive.participant_count} players, {archive.team_count} teams, '
+                f'{archive.game_count} games'
+            )
+        if dry_run:
+            self.stdout.write(f'{len(tournaments)} tournaments would be archived.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Archived {len(tournaments)} tournaments.'))
@@ -0,0 +1,47 @@
+import json
+import platform
+import statistics
+from datetime import datetime, timezone
+from importlib.metadata import PackageNotFoundError, version
+
+from django.core.management.base import BaseCommand
+
+from lsnz.startup import BOOT_TARGETS, run_boot
+
+
+class Command(BaseCommand):
+    help = "Time how long the project takes to boot, to track start-up cost across releases."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Boots per target; the median is reported.')
+        parser.add_argument('--target', action='append', choices=sorted(BOOT_TARGETS), help='Defaults to all.')
+        parser.add_argument('--preload', action='store_true', help='Boot the WSGI app with WSGI_PRELOAD=1.')
+        parser.add_argument('--record', metavar='FILE', help='Append the results as a JSON line to FILE.')
+
+    def handle(self, *args, runs, target, preload, record, **options):
+        env = {'WSGI_PRELOAD': '1'} if preload else {}
+        results = {}
+        self.stdout.write(f"{'target':<16} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+        for name in target or BOOT_TARGETS:
+            timings = [run_boot(name, env=env)[0] * 1000 for _ in range(runs)]
+            results[name] = round(statistics.median(timings), 1)
+            self.stdout.write(f'{name:<16} {results[name]:>10.1f} {min(timings):>8.1f} {max(timings):>8.1f}')
+
+        if record:
+            with open(record, 'a') as f:
+                f.write(json.dumps({
+                    'recorded_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                    'version': self.project_version(),
+                    'python': platform.python_version(),
+                    'preload': preload,
+                    'runs': runs,
+                    'median_ms': results,
+                }) + '\n')
+            self.stdout.write(f'Recorded in {record}.')
+
+    @staticmethod
+    def project_version():
+        try:
+            return version('lsnz-django')
+        except PackageNotFoundError:
+            return None
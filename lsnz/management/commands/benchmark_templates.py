@@ -0,0 +1,78 @@
+import time
+from datetime import date, timedelta
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.template import engines
+from django.test import RequestFactory
+from django.utils import timezone
+
+from lsnz.models import Grade, Player, Post, Site, System, Tournament
+
+
+class Command(BaseCommand):
+    help = "Compare Django and Jinja2 render times for the templates with Jinja2 ports."
+
+    templates = [
+        'lsnz/players.html',
+        'lsnz/posts.html',
+        'lsnz/tournaments.html',
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Number of rows in each list.')
+        parser.add_argument('--repeat', type=int, default=5, help='Renders per engine; the best time is kept.')
+
+    def handle(self, *args, rows, repeat, **options):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        contexts = self.build_contexts(rows)
+
+        self.stdout.write(f"{'template':<24} {'django ms':>10} {'jinja2 ms':>10} {'speedup':>8}")
+        for name in self.templates:
+            timings = {}
+            for engine in ('django', 'jinja2'):
+                template = engines[engine].get_template(name)
+                best = None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    template.render(contexts[name], request)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                timings[engine] = best * 1000
+            self.stdout.write(
+                f"{name:<24} {timings['django']:>10.1f} {timings['jinja2']:>10.1f} "
+                f"{timings['django'] / timings['jinja2']:>7.1f}x"
+            )
+
+    def build_contexts(self, rows):
+        """Unsaved model instances, so the benchmark never touches the database."""
+        grades = [Grade(letter=letter, points=points) for points, letter in enumerate('ABCD', start=1)]
+        system = System(name='Zone', slug='zone')
+        site = Site(name='Arena', slug='arena', system=system)
+        players = [
+            Player(alias=f'player{i}', slug=f'player{i}', grade=grades[i % len(grades)])
+            for i in range(rows)
+        ]
+        posts = [
+            Post(
+                title=f'Post {i}', slug=f'post-{i}', summary='Summary ' * 10,
+                author=players[i % rows], created_at=timezone.now(),
+            )
+            for i in range(rows)
+        ]
+        today = date.today()
+        tournaments = [
+            Tournament(
+                name=f'Tournament {i}', slug=f'tournament-{i}', site=site, system=system,
+                start_date=today - timedelta(days=i), end_date=today - timedelta(days=i),
+            )
+            for i in range(rows)
+        ]
+        page = Paginator(posts, rows).page(1)
+        return {
+            'lsnz/players.html': {'players': players},
+            'lsnz/posts.html': {'object_list': posts, 'page_obj': page},
+            'lsnz/tournaments.html': {'tournaments': tournaments},
+        }
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from lsnz.models import MazeMap
+from lsnz.tiles import build_tiles
+
+
+class Command(BaseCommand):
+    help = "Build zoom tiles and previews for maze maps that don't have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='Only these maze maps.')
+        parser.add_argument('--all', action='store_true', help='Rebuild maps that already have tiles.')
+
+    def handle(self, *args, ids, all, **options):
+        maze_maps = MazeMap.objects.order_by('pk')
+        if ids:
+            maze_maps = maze_maps.filter(pk__in=ids)
+        elif not all:
+            maze_maps = maze_maps.filter(max_zoom__isnull=True)
+
+        for maze_map in maze_maps.iterator():
+            build_tiles(maze_map)
+            self.stdout.write(f'Maze map {maze_map.pk}: {maze_map.width}x{maze_map.height}, zoom 0-{maze_map.max_zoom}')
@@ -0,0 +1,64 @@
+import os
+import time
+from collections import Counter
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import FileField
+
+from lsnz.storage import BLOB_DIR, ContentAddressedStorage
+
+
+class Command(BaseCommand):
+    help = "Delete uploaded blobs that no row refers to any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted.')
+        parser.add_argument(
+            '--grace-hours', type=float, default=24,
+            help="Keep unreferenced blobs younger than this, as their rows may not be saved yet.",
+        )
+
+    def handle(self, *args, dry_run, grace_hours, **options):
+        if not isinstance(default_storage, ContentAddressedStorage):
+            raise CommandError('The default storage is not ContentAddressedStorage.')
+
+        references = self.count_references()
+        cutoff = time.time() - grace_hours * 3600
+        root = default_storage.path(BLOB_DIR)
+
+        blobs = deleted = freed = 0
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, default_storage.location).replace(os.sep, '/')
+                stat = os.stat(path)
+                blobs += 1
+                if references[name] or stat.st_mtime > cutoff:
+                    continue
+                deleted += 1
+                freed += stat.st_size
+                if not dry_run:
+                    default_storage.purge(name)
+
+        shared = sum(1 for count in references.values() if count > 1)
+        self.stdout.write(
+            f'{blobs} blobs, {len(references)} referenced ({shared} shared by more than one row).'
+        )
+        verb = 'Would delete' if dry_run else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {deleted} blobs, {freed / 1024 / 1024:.1f} MB.'))
+
+    def count_references(self):
+        """Count how many rows point at each blob, across every file field in the project."""
+        references = Counter()
+        for model in apps.get_models():
+            for field in model._meta.concrete_fields:
+                if not isinstance(field, FileField) or field.storage is not default_storage:
+                    continue
+                names = (
+                    model._default_manager.filter(**{f'{field.name}__startswith': f'{BLOB_DIR}/'})
+                    .values_list(field.name, flat=True)
+                )
+                references.update(names.iterator())
+        return references
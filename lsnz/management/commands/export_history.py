@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from lsnz.export import EXPORTS, export_all, get_writer_class
+
+
+class Command(BaseCommand):
+    help = "Export tournaments, events, registrations, passes and results as Parquet (or JSON Lines) files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Where to write the files. Later runs add only new and changed rows.')
+        parser.add_argument(
+            '--format', choices=['auto', 'parquet', 'jsonl'], default='auto',
+            help='Defaults to Parquet when pyarrow is installed and JSON Lines otherwise.',
+        )
+        parser.add_argument(
+            '--table', action='append', dest='tables', choices=[export.name for export in EXPORTS],
+            help='Only export this table. Can be repeated.',
+        )
+        parser.add_argument('--full', action='store_true', help='Remove earlier files and export every row again.')
+        parser.add_argument('--row-group-size', type=int, default=50_000)
+
+    def handle(self, *args, directory, format, tables, full, row_group_size, **options):
+        try:
+            get_writer_class(format)
+        except ImportError:
+            raise CommandError('Parquet export needs pyarrow; install it or use --format jsonl.')
+        for name, written in export_all(directory, tables, format, full, row_group_size):
+            self.stdout.write(f'{name}: {written} rows')
+        self.stdout.write(self.style.SUCCESS(f'Exported to {directory}.'))
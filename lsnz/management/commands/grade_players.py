@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from lsnz.grading import apply_grade_changes, suggest_grade_changes
+
+
+class Command(BaseCommand):
+    help = "List suggested grade changes from recent results, and optionally apply them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apply', action='store_true', help='Save every suggested change.')
+
+    def handle(self, *args, apply, **options):
+        changes = suggest_grade_changes()
+        for change in changes:
+            self.stdout.write(
+                f'{change.direction:8} {change.player.alias}: {change.current or "-"} -> {change.suggested} ({change.reason})'
+            )
+        if apply:
+            updated = apply_grade_changes(changes)
+            self.stdout.write(self.style.SUCCESS(f'Updated the grade of {updated} players.'))
+        else:
+            self.stdout.write(f'{len(changes)} suggested changes. Use --apply to save them.')
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from lsnz.startup import BOOT_TARGETS, package_totals, parse_importtime, run_boot
+
+
+class Command(BaseCommand):
+    help = "Boot the project with python -X importtime and report the most expensive imports."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=sorted(BOOT_TARGETS), default='wsgi')
+        parser.add_argument('--limit', type=int, default=20, help='Number of modules and packages to list.')
+
+    def handle(self, *args, target, limit, **options):
+        elapsed, output = run_boot(target, importtime=True)
+        imports = parse_importtime(output)
+        total = sum(own for _, own, _, _ in imports)
+        self.stdout.write(
+            f'Booting {target}: {elapsed * 1000:.0f} ms, {len(imports)} modules, {total / 1000:.0f} ms importing.\n'
+        )
+
+        self.stdout.write(f"{'package':<40} {'ms':>8} {'share':>6}")
+        for package, own in package_totals(imports)[:limit]:
+            self.stdout.write(f'{package:<40} {own / 1000:>8.1f} {own * 100 / total:>5.1f}%')
+
+        # Modules imported directly by something outside their own package
+        # are the ones a deferred import can actually remove
+        self.stdout.write(f"\n{'module (cumulative)':<60} {'ms':>8}")
+        roots = sorted(imports, key=lambda row: -row[2])
+        shown = []
+        for module, _, cumulative, _ in roots:
+            if any(module.startswith(f'{parent}.') for parent in shown):
+                continue
+            shown.append(module)
+            self.stdout.write(f'{module:<60} {cumulative / 1000:>8.1f}')
+            if len(shown) == limit:
+                break
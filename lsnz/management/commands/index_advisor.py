@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from lsnz.query_plans import query_plans, replay, replay_requests, seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay every page against seeded data in a throwaway test database and "
+        "report the queries whose plans scan whole tables or sort in a temporary B-tree."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=2000, help='Players to seed; other rows scale with it.')
+        parser.add_argument('--repeat', type=int, default=3, help='Requests per page; the best time is reported.')
+        parser.add_argument('--all', action='store_true', help='List every query, not only the flagged ones.')
+
+    def handle(self, *args, players, repeat, all, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f'Query plans are not supported on {connection.vendor}.')
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        setup_test_environment()
+        try:
+            # Every request should reach the database, so nothing is cached
+            with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+                seed(players)
+                results = replay(replay_requests(), repeat)
+                plans = query_plans(results)
+        finally:
+            teardown_test_environment()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        flagged = {plan.sql for plan in plans if plan.problems}
+        self.stdout.write(f"{'view':<30} {'ms':>8} {'queries':>8} {'flagged':>8}")
+        for label, (elapsed, queries) in results.items():
+            problems = sum(sql in flagged for sql, _ in queries)
+            self.stdout.write(f'{label:<30} {elapsed * 1000:>8.1f} {len(queries):>8} {problems:>8}')
+        total = sum(elapsed for elapsed, _ in results.values())
+        self.stdout.write(f"{'total':<30} {total * 1000:>8.1f}\n")
+
+        for plan in plans:
+            if not plan.problems and not all:
+                continue
+            style = self.style.WARNING if plan.problems else str
+            self.stdout.write(style(', '.join(plan.problems) or 'ok'))
+            self.stdout.write(f"  views: {', '.join(sorted(plan.views))} ({plan.count} runs)")
+            self.stdout.write(f'  {plan.sql}')
+            for step in plan.plan:
+                self.stdout.write(f'    {step}')
+        self.stdout.write(f'{len(flagged)} of {len(plans)} distinct queries flagged.')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from lsnz.profiling import make_token
+
+
+class Command(BaseCommand):
+    help = "Print a token that makes requests carrying it in an X-Profile-Token header get profiled."
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_token())
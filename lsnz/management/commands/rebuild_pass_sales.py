@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from lsnz.sales import rebuild_pass_sales
+
+
+class Command(BaseCommand):
+    help = "Recalculate the daily pass sales rollups from every pass."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--background', action='store_true', help='Queue a job for the worker instead.')
+
+    def handle(self, *args, background, **options):
+        if background:
+            rebuild_pass_sales.enqueue()
+            self.stdout.write(self.style.SUCCESS('Queued a pass sales rebuild.'))
+            return
+        total = rebuild_pass_sales()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} pass sales rollup rows.'))
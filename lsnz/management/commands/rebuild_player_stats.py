@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from lsnz.stats import rebuild_all_player_stats
+
+
+class Command(BaseCommand):
+    help = "Recalculate the statistics shown on every player's profile."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--background', action='store_true', help='Queue a job for the worker instead.')
+
+    def handle(self, *args, batch_size, background, **options):
+        if background:
+            rebuild_all_player_stats.enqueue(batch_size=batch_size)
+            self.stdout.write(self.style.SUCCESS('Queued a stats rebuild.'))
+            return
+        total = rebuild_all_player_stats(batch_size)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt stats for {total} players.'))
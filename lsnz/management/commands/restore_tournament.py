@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from lsnz.archive import restore_tournament
+from lsnz.models import Tournament
+
+
+class Command(BaseCommand):
+    help = "Move an archived tournament's teams, registrations and games back into the live tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('slugs', nargs='+', metavar='slug')
+
+    def handle(self, *args, slugs, **options):
+        for slug in slugs:
+            tournament = Tournament.objects.filter(slug=slug, archive__isnull=False).first()
+            if tournament is None:
+                raise CommandError(f'No archived tournament {slug}.')
+            restore_tournament(tournament)
+            self.stdout.write(self.style.SUCCESS(f'Restored {slug}.'))
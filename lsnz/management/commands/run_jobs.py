@@ -0,0 +1,65 @@
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from lsnz import job_worker
+from lsnz.jobs import claim_jobs, run_pending_jobs, schedule_periodic_jobs, worker_name
+
+
+class Command(BaseCommand):
+    help = "Run background jobs, several at a time in a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=2,
+            help='Size of the process pool. 0 runs jobs one at a time in this process.',
+        )
+        parser.add_argument('--interval', type=float, default=1, help='Seconds between polls when idle.')
+        parser.add_argument('--once', action='store_true', help='Exit once no jobs are due.')
+
+    def handle(self, *args, processes, interval, once, **options):
+        schedule_periodic_jobs()
+        if processes == 0:
+            self.run_inline(interval, once)
+            return
+
+        name = worker_name()
+        running = {}
+        pool = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=job_worker.init_process,
+        )
+        try:
+            while True:
+                if len(running) < processes:
+                    for job in claim_jobs(processes - len(running), name):
+                        running[pool.submit(job_worker.run, job.pk)] = job
+                if not running:
+                    if once:
+                        break
+                    close_old_connections()
+                    time.sleep(interval)
+                    continue
+                done, _ = wait(running, timeout=interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    self.report(job, future.result())
+        except KeyboardInterrupt:
+            self.stdout.write('Waiting for running jobs to finish...')
+        finally:
+            pool.shutdown(wait=True)
+
+    def run_inline(self, interval, once):
+        while True:
+            if not run_pending_jobs():
+                if once:
+                    break
+                close_old_connections()
+                time.sleep(interval)
+
+    def report(self, job, status):
+        self.stdout.write(f'{job} {status}')
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from lsnz.mail import deliver_queued_email
+
+
+class Command(BaseCommand):
+    help = "Deliver queued emails in batches, reusing one connection per batch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new email.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls.')
+
+    def handle(self, *args, batch_size, loop, interval, **options):
+        total = 0
+        while True:
+            sent = deliver_queued_email(batch_size)
+            total += sent
+            if sent < batch_size:
+                if not loop:
+                    break
+                time.sleep(interval)
+        self.stdout.write(self.style.SUCCESS(f'Sent {total} emails.'))
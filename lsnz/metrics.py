@@ -0,0 +1,363 @@
+"""
+Request, database, template, cache and job queue metrics in the Prometheus
+text format, served at ``/metrics``.
+
+Each process aggregates in memory under one lock. With several worker
+processes on a host, set ``METRICS_DIR`` to a directory they can all write:
+every process saves its totals there at most every ``METRICS_FLUSH_INTERVAL``
+seconds, and a scrape adds up the files of every process. Clear the
+directory when deploying, as the files of old processes are kept so that
+counters never go backwards.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.db.backends.signals import connection_created
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.last_flush = 0
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        with self.lock:
+            return {name: metric.dump() for name, metric in self.metrics.items()}
+
+    def flush(self, force=False):
+        """Save this process's totals to METRICS_DIR if it is time to."""
+        directory = getattr(settings, 'METRICS_DIR', None)
+        now = time.monotonic()
+        if not directory or (not force and now - self.last_flush < getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)):
+            return
+        self.last_flush = now
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f'{path}.tmp', path)
+
+    def collect(self):
+        """Totals for every process on the host, or just this one without METRICS_DIR."""
+        snapshots = [self.snapshot()]
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if directory and os.path.isdir(directory):
+            own = f'{os.getpid()}.json'
+            for filename in os.listdir(directory):
+                if filename.endswith('.json') and filename != own:
+                    try:
+                        with open(os.path.join(directory, filename)) as f:
+                            snapshots.append(json.load(f))
+                    except (OSError, ValueError):
+                        continue
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.extend(metric.render([snapshot.get(name, {}) for snapshot in snapshots]))
+        return lines
+
+
+registry = Registry()
+atexit.register(registry.flush, force=True)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        registry.register(self)
+
+    def inc(self, labels=(), amount=1):
+        with registry.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dump(self):
+        return {json.dumps(labels): value for labels, value in self.values.items()}
+
+    def render(self, dumps):
+        totals = {}
+        for dump in dumps:
+            for labels, value in dump.items():
+                totals[labels] = totals.get(labels, 0) + value
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.kind}'
+        for labels, value in sorted(totals.items()):
+            yield f'{self.name}{format_labels(self.labelnames, json.loads(labels))} {value}'
+
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with registry.lock:
+            # Bucket counts (not cumulative), then sum
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def dump(self):
+        return {json.dumps(labels): list(counts) for labels, counts in self.values.items()}
+
+    def render(self, dumps):
+        totals = {}
+        for dump in dumps:
+            for labels, counts in dump.items():
+                total = totals.setdefault(labels, [0] * len(counts))
+                for i, count in enumerate(counts):
+                    total[i] += count
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.kind}'
+        for labels, counts in sorted(totals.items()):
+            values = json.loads(labels)
+            cumulative = 0
+            for bound, count in zip([*self.buckets, '+Inf'], counts):
+                cumulative += count
+                yield f'{self.name}_bucket{format_labels(self.labelnames, values, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labelnames, values)} {counts[-1]}'
+            yield f'{self.name}_count{format_labels(self.labelnames, values)} {cumulative}'
+
+
+requests_total = Counter(
+    'lsnz_http_requests_total', 'Requests by view, method and response status.', ('view', 'method', 'status')
+)
+request_duration = Histogram(
+    'lsnz_http_request_duration_seconds', 'Time to produce a response, by view.', ('view',)
+)
+db_queries_total = Counter('lsnz_db_queries_total', 'SQL queries run while handling requests.', ('view',))
+db_query_seconds = Counter(
+    'lsnz_db_query_duration_seconds_total', 'Time spent in SQL queries while handling requests.', ('view',)
+)
+template_duration = Histogram(
+    'lsnz_template_render_duration_seconds', 'Time to render template responses, by view.', ('view',)
+)
+cache_requests_total = Counter(
+    'lsnz_cache_requests_total', 'Cache reads by cache alias and hit or miss.', ('cache', 'result')
+)
+
+# Queries, seconds for the request being handled in this thread or task
+request_sql = ContextVar('request_sql', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = request_sql.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_wrapper)
+
+
+class MetricsMiddleware:
+    """Time every request and count its SQL queries. Put it first in MIDDLEWARE."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started, token = self.start()
+        response = self.get_response(request)
+        self.finish(request, response, started, token)
+        return response
+
+    async def __acall__(self, request):
+        started, token = self.start()
+        response = await self.get_response(request)
+        self.finish(request, response, started, token)
+        return response
+
+    def start(self):
+        return time.perf_counter(), request_sql.set([0, 0.0])
+
+    def finish(self, request, response, started, token):
+        view = view_label(request)
+        queries, seconds = request_sql.get()
+        request_sql.reset(token)
+        request_duration.observe((view,), time.perf_counter() - started)
+        requests_total.inc((view, request.method, str(response.status_code)))
+        if queries:
+            db_queries_total.inc((view,), queries)
+            db_query_seconds.inc((view,), seconds)
+        registry.flush()
+
+    def process_template_response(self, request, response):
+        started = time.perf_counter()
+        response.add_post_render_callback(
+            lambda response: template_duration.observe((view_label(request),), time.perf_counter() - started)
+        )
+        return response
+
+
+def view_label(request):
+    # URL names rather than paths, so there is one series per view
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match and match.view_name else '<unresolved>'
+
+
+_MISSING = object()
+
+
+class InstrumentedCache(BaseCache):
+    """
+    Cache backend that counts hits and misses for the backend named in the
+    cache's ``INSTRUMENTED_BACKEND`` setting and otherwise hands every call
+    straight to it.
+    """
+
+    def __init__(self, location, params):
+        params = dict(params)
+        backend = params.pop('INSTRUMENTED_BACKEND')
+        super().__init__(params)
+        self._cache = import_string(backend)(location, params)
+        self._alias = params.get('KEY_PREFIX') or backend.rsplit('.', 1)[-1]
+
+    def _count(self, hits, misses):
+        if hits:
+            cache_requests_total.inc((self._alias, 'hit'), hits)
+        if misses:
+            cache_requests_total.inc((self._alias, 'miss'), misses)
+
+    def get(self, key, default=None, version=None):
+        value = self._cache.get(key, _MISSING, version=version)
+        self._count(value is not _MISSING, value is _MISSING)
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = self._cache.get_many(keys, version=version)
+        self._count(len(found), len(keys) - len(found))
+        return found
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.add(key, value, timeout, version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.set(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.set_many(data, timeout, version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        return self._cache.delete(key, version)
+
+    def delete_many(self, keys, version=None):
+        return self._cache.delete_many(keys, version)
+
+    def has_key(self, key, version=None):
+        return self._cache.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        return self._cache.incr(key, delta, version)
+
+    def decr(self, key, delta=1, version=None):
+        return self._cache.decr(key, delta, version)
+
+    def clear(self):
+        return self._cache.clear()
+
+    def close(self, **kwargs):
+        return self._cache.close(**kwargs)
+
+
+def queue_lines():
+    """Job and email queue depth, read from the database at scrape time."""
+    # Imported here because this module is loaded by the cache and
+    # middleware settings, before the app registry is ready
+    from .models import Job, QueuedEmail
+
+    now = timezone.now()
+    lines = [
+        '# HELP lsnz_jobs Jobs waiting or running, by job name and status.',
+        '# TYPE lsnz_jobs gauge',
+    ]
+    rows = (
+        Job.objects.filter(status__in=[Job.QUEUED, Job.RUNNING])
+        .values('name')
+        .annotate(
+            due=Count('pk', filter=Q(status=Job.QUEUED, run_at__lte=now)),
+            scheduled=Count('pk', filter=Q(status=Job.QUEUED, run_at__gt=now)),
+            running=Count('pk', filter=Q(status=Job.RUNNING)),
+            oldest_due=Min('run_at', filter=Q(status=Job.QUEUED, run_at__lte=now)),
+        )
+        .order_by('name')
+    )
+    waits = []
+    for row in rows:
+        for status in ('due', 'scheduled', 'running'):
+            lines.append(f'lsnz_jobs{format_labels(("name", "status"), (row["name"], status))} {row[status]}')
+        if row['oldest_due']:
+            waits.append((row['name'], (now - row['oldest_due']).total_seconds()))
+    lines += [
+        '# HELP lsnz_job_oldest_due_seconds How long the oldest due job has been waiting.',
+        '# TYPE lsnz_job_oldest_due_seconds gauge',
+    ]
+    lines += [f'lsnz_job_oldest_due_seconds{format_labels(("name",), (name,))} {wait}' for name, wait in waits]
+    lines += [
+        '# HELP lsnz_queued_emails Emails waiting to be sent.',
+        '# TYPE lsnz_queued_emails gauge',
+        f'lsnz_queued_emails {QueuedEmail.objects.filter(status=QueuedEmail.QUEUED).count()}',
+    ]
+    return lines
+
+
+def render_metrics():
+    return '\n'.join(registry.collect() + queue_lines()) + '\n'
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:09
+
+import lsnz.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lsnz', '0004_tournamentseries_mazemap_tournament_series'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='format',
+            name='slug',
+            field=lsnz.fields.AutoSlugField(editable=False, populate_from='name', unique=True),
+        ),
+        migrations.AlterField(
+            model_name='player',
+            name='slug',
+            field=lsnz.fields.AutoSlugField(editable=False, populate_from='alias', unique=True),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='slug',
+            field=lsnz.fields.AutoSlugField(editable=False, populate_from='title', unique=True),
+        ),
+        migrations.AlterField(
+            model_name='site',
+            name='slug',
+            field=lsnz.fields.AutoSlugField(editable=False, populate_from='name', unique=True),
+        ),
+        migrations.AlterField(
+            model_name='system',
+            name='slug',
+            field=lsnz.fields.AutoSlugField(editable=False, populate_from='name', unique=True),
+        ),
+        migrations.AlterField(
+            model_name='tournament',
+            name='slug',
+            field=lsnz.fields.AutoSlugField(editable=False, populate_from='name', unique=True),
+        ),
+        migrations.AlterField(
+            model_name='tournamentseries',
+            name='slug',
+            field=lsnz.fields.AutoSlugField(editable=False, populate_from='name', unique=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lsnz', '0005_alter_format_slug_alter_player_slug_alter_post_slug_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerStats',
+            fields=[
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('tournaments_entered', models.PositiveIntegerField(default=0)),
+                ('events_played', models.PositiveIntegerField(default=0)),
+                ('sites_visited', models.PositiveIntegerField(default=0)),
+                ('series_played', models.PositiveIntegerField(default=0)),
+                ('passes_bought', models.PositiveIntegerField(default=0)),
+                ('last_pass_end', models.DateField(blank=True, null=True)),
+                ('post_count', models.PositiveIntegerField(default=0)),
+                ('first_played', models.DateField(blank=True, null=True)),
+                ('last_played', models.DateField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Player stats',
+                'verbose_name_plural': 'Player stats',
+            },
+        ),
+    ]
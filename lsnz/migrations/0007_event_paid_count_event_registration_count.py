@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:14
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_registrations(apps, schema_editor):
+    Event = apps.get_model('lsnz', 'Event')
+    Registration = apps.get_model('lsnz', 'Registration')
+    counts = Registration.objects.filter(event=OuterRef('pk')).order_by().values('event')
+    Event.objects.update(
+        registration_count=Coalesce(
+            Subquery(counts.annotate(n=Count('pk')).values('n'), output_field=IntegerField()), 0
+        ),
+        paid_count=Coalesce(
+            Subquery(counts.annotate(n=Count('pk', filter=Q(paid=True))).values('n'), output_field=IntegerField()), 0
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lsnz', '0006_playerstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='paid_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='registration_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_registrations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lsnz', '0007_event_paid_count_event_registration_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mazemap',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='mazemap',
+            name='max_zoom',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='mazemap',
+            name='preview',
+            field=models.ImageField(blank=True, editable=False, upload_to='maze_maps/previews/'),
+        ),
+        migrations.AddField(
+            model_name='mazemap',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lsnz', '0012_game_gameresult_game_unique_game_number_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='grade',
+            name='percentile',
+            field=models.FloatField(blank=True, help_text='Players at or above this percentile of recent performance are suggested this grade. Leave blank to only assign it by hand.', null=True),
+        ),
+    ]
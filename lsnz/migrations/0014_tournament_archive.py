@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:44
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lsnz', '0013_grade_percentile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TournamentArchive',
+            fields=[
+                ('tournament', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='lsnz.tournament')),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('participant_count', models.PositiveIntegerField(default=0)),
+                ('team_count', models.PositiveIntegerField(default=0)),
+                ('game_count', models.PositiveIntegerField(default=0)),
+                ('standings', models.JSONField(default=dict)),
+                ('rows', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('events_played', models.PositiveSmallIntegerField(default=0)),
+                ('teams', models.CharField(blank=True, max_length=200)),
+                ('best_placing', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_entries', to=settings.AUTH_USER_MODEL)),
+                ('archive', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='lsnz.tournamentarchive')),
+            ],
+            options={
+                'verbose_name_plural': 'Archived entries',
+                'constraints': [models.UniqueConstraint(fields=('archive', 'player'), name='unique_archived_entry')],
+            },
+        ),
+    ]
@@ -0,0 +1,114 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:50
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Min, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_registrations(apps, schema_editor):
+    """Keep the first registration of each player for each event, so the unique constraint can be added."""
+    Event = apps.get_model('lsnz', 'Event')
+    Registration = apps.get_model('lsnz', 'Registration')
+    duplicates = (
+        Registration.objects.values('event', 'player')
+        .annotate(first=Min('pk'), count=Count('pk'), paid=Count('pk', filter=Q(paid=True)))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    events = set()
+    for duplicate in duplicates:
+        kept = Registration.objects.filter(pk=duplicate['first'])
+        if duplicate['paid']:
+            # A payment against any of the copies still counts
+            kept.update(paid=True)
+        Registration.objects.filter(event=duplicate['event'], player=duplicate['player']).exclude(
+            pk=duplicate['first']
+        ).delete()
+        events.add(duplicate['event'])
+
+    counts = Registration.objects.filter(event=OuterRef('pk')).order_by().values('event')
+    Event.objects.filter(pk__in=events).update(
+        registration_count=Coalesce(
+            Subquery(counts.annotate(n=Count('pk')).values('n'), output_field=IntegerField()), 0
+        ),
+        paid_count=Coalesce(
+            Subquery(counts.annotate(n=Count('pk', filter=Q(paid=True))).values('n'), output_field=IntegerField()), 0
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('lsnz', '0014_tournament_archive'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='event',
+            name='format',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='lsnz.format'),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='tournament',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='events', to='lsnz.tournament'),
+        ),
+        migrations.AlterField(
+            model_name='mazemap',
+            name='site',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='lsnz.site'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='author',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='registration',
+            name='event',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='lsnz.event'),
+        ),
+        migrations.AlterField(
+            model_name='registration',
+            name='player',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['tournament', 'start_time'], name='lsnz_event_tournament_start'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['format', 'tournament'], name='lsnz_event_format_tournament'),
+        ),
+        migrations.AddIndex(
+            model_name='mazemap',
+            index=models.Index(fields=['site', '-date'], name='lsnz_mazemap_site_date'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(django.db.models.functions.text.Lower('alias'), name='lsnz_player_alias_lower'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-created_at'], name='lsnz_post_author_created'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(django.db.models.functions.text.Lower('title'), name='lsnz_post_title_lower'),
+        ),
+        migrations.AddIndex(
+            model_name='registration',
+            index=models.Index(fields=['player', 'event'], name='lsnz_registration_player_event'),
+        ),
+        migrations.RunPython(remove_duplicate_registrations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='registration',
+            constraint=models.UniqueConstraint(fields=('event', 'player'), name='unique_registration'),
+        ),
+    ]
@@ -0,0 +1,119 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import TruncDate
+
+
+def copy_home_sites(apps, schema_editor):
+    Pass = apps.get_model('lsnz', 'Pass')
+    Player = apps.get_model('lsnz', 'Player')
+    Pass.objects.update(home_site=Subquery(Player.objects.filter(pk=OuterRef('player')).values('home_site')[:1]))
+
+
+def build_sales_rollups(apps, schema_editor):
+    """Fill PassSalesDay from the existing passes, as lsnz.sales.rebuild_pass_sales does."""
+    Pass = apps.get_model('lsnz', 'Pass')
+    PassSalesDay = apps.get_model('lsnz', 'PassSalesDay')
+    rows = {}
+
+    def row(day, pass_type, site_id):
+        key = (day, pass_type, site_id)
+        if key not in rows:
+            rows[key] = PassSalesDay(date=day, pass_type=pass_type, site_id=site_id)
+        return rows[key]
+
+    refunded = Q(refunded_at__isnull=False)
+    sales = (
+        Pass.objects.annotate(day=TruncDate('purchase_date'))
+        .values('day', 'pass_type', 'home_site')
+        .annotate(
+            sold=Count('pk'),
+            revenue=Sum('price_paid'),
+            refunded=Count('pk', filter=refunded),
+            refunded_amount=Sum('price_paid', filter=refunded, default=0),
+        )
+        .order_by()
+    )
+    for sale in sales:
+        day_row = row(sale['day'], sale['pass_type'], sale['home_site'])
+        day_row.sold = sale['sold']
+        day_row.revenue = sale['revenue']
+        day_row.refunded = sale['refunded']
+        day_row.refunded_amount = sale['refunded_amount']
+
+    for field, date_field in (('started', 'start_date'), ('ended', 'end_date')):
+        counts = (
+            Pass.objects.filter(refunded_at__isnull=True)
+            .values(date_field, 'pass_type', 'home_site')
+            .annotate(count=Count('pk'))
+            .order_by()
+        )
+        for count in counts:
+            setattr(row(count[date_field], count['pass_type'], count['home_site']), field, count['count'])
+    PassSalesDay.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lsnz', '0016_site_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PassSalesDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('pass_type', models.CharField(choices=[('monthly', 'Monthly Pass'), ('season', 'Season Pass')], max_length=20)),
+                ('sold', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('refunded', models.PositiveIntegerField(default=0)),
+                ('refunded_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('started', models.PositiveIntegerField(default=0)),
+                ('ended', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Pass sales day',
+            },
+        ),
+        migrations.AddField(
+            model_name='pass',
+            name='home_site',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='lsnz.site'),
+        ),
+        migrations.AddField(
+            model_name='pass',
+            name='refunded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(copy_home_sites, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='pass',
+            index=models.Index(fields=['purchase_date'], name='lsnz_pass_purchase_date'),
+        ),
+        migrations.AddIndex(
+            model_name='pass',
+            index=models.Index(fields=['start_date'], name='lsnz_pass_start_date'),
+        ),
+        migrations.AddIndex(
+            model_name='pass',
+            index=models.Index(fields=['end_date'], name='lsnz_pass_end_date'),
+        ),
+        migrations.AddField(
+            model_name='passsalesday',
+            name='site',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='lsnz.site'),
+        ),
+        migrations.AddConstraint(
+            model_name='passsalesday',
+            constraint=models.UniqueConstraint(fields=('date', 'pass_type', 'site'), name='unique_pass_sales_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='passsalesday',
+            constraint=models.UniqueConstraint(condition=models.Q(('site__isnull', True)), fields=('date', 'pass_type'), name='unique_pass_sales_day_no_site'),
+        ),
+        migrations.RunPython(build_sales_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lsnz', '0018_updated_at_for_export'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchupGame',
+            fields=[
+                ('game_id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('season', models.PositiveSmallIntegerField()),
+                ('results', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MatchupSeason',
+            fields=[
+                ('season', models.PositiveSmallIntegerField(primary_key=True, serialize=False)),
+                ('built_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Matchup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('season', models.PositiveSmallIntegerField()),
+                ('kind', models.CharField(choices=[('opponents', 'Opponent'), ('teammates', 'Teammate')], max_length=10)),
+                ('games', models.PositiveIntegerField(default=0)),
+                ('wins', models.PositiveIntegerField(default=0)),
+                ('losses', models.PositiveIntegerField(default=0)),
+                ('ties', models.PositiveIntegerField(default=0)),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('player', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('season', 'player', 'kind', 'other'), name='unique_matchup')],
+            },
+        ),
+    ]
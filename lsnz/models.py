@@ -1,12 +1,20 @@
+import os
+import uuid
 from datetime import timedelta
 
-from autoslug import AutoSlugField
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import models, transaction
+from django.db.models.functions import Lower
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .fields import AutoSlugField
 from .managers import CustomUserManager
+from .storage import tile_storage
 
 AUTH_USER_MODEL = "lsnz.Player"
 
@@ -25,6 +33,11 @@ class Grade(models.Model):
     letter = models.CharField(max_length=4)
     points = models.IntegerField(default=0)
     description = models.CharField(max_length=200)
+    percentile = models.FloatField(
+        null=True, blank=True,
+        help_text="Players at or above this percentile of recent performance are suggested "
+                  "this grade. Leave blank to only assign it by hand.",
+    )
 
     def __str__(self):
         return self.letter
@@ -49,6 +62,17 @@ class Player(AbstractUser):
     class Meta(AbstractUser.Meta):
         verbose_name = "Player"
         verbose_name_plural = "Players"
+        indexes = [
+            # Case-insensitive alias checks in PlayerProfileForm and the importers
+            models.Index(Lower('alias'), name='lsnz_player_alias_lower'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so saves that change nothing shown on the homepage leave it cached
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
 
     def __str__(self):
         return self.alias
@@ -61,10 +85,15 @@ class Post(models.Model):
     image = models.ImageField(upload_to='post_images/')
     created_at = models.DateTimeField(db_index=True, auto_now_add=True)
     updated_at = models.DateTimeField(db_index=True, auto_now=True)
-    author = models.ForeignKey(Player, on_delete=models.PROTECT)
+    # Indexed by lsnz_post_author_created
+    author = models.ForeignKey(Player, on_delete=models.PROTECT, db_index=False)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['author', '-created_at'], name='lsnz_post_author_created'),
+            models.Index(Lower('title'), name='lsnz_post_title_lower'),
+        ]
 
     def __str__(self):
         return self.title
@@ -95,14 +124,49 @@ class Settings(models.Model):
 class MazeMap(models.Model):
     image = models.ImageField(upload_to='maze_maps/')
     date = models.DateField(default=timezone.now)
-    site = models.ForeignKey('Site', on_delete=models.PROTECT)
-    
+    # Indexed by lsnz_mazemap_site_date
+    site = models.ForeignKey('Site', on_delete=models.PROTECT, db_index=False)
+    # Filled in by lsnz.tiles once the zoom pyramid has been built
+    preview = models.ImageField(upload_to='maze_maps/previews/', blank=True, editable=False)
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    max_zoom = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['site', '-date'], name='lsnz_mazemap_site_date'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored image so a replacement can be detected on save
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    @property
+    def tiles_ready(self):
+        return self.max_zoom is not None
+
+    @property
+    def tile_url_template(self):
+        """Leaflet URL template for the tiles, e.g. ``/media/maze_tiles/3/{z}/{x}/{y}.jpg``"""
+        return tile_storage.url(f'maze_tiles/{self.pk}/') + '{z}/{x}/{y}.jpg'
+
+
 class Site(models.Model):
     name = models.CharField(max_length=100)
     slug = AutoSlugField(unique=True, populate_from='name')
     country = models.CharField(max_length=100, choices=COUNTRIES)
     address = models.CharField(max_length=200)
     system = models.ForeignKey(System, on_delete=models.PROTECT)
+    # Used by the "sites near me" lookups in lsnz.geo
+    latitude = models.FloatField(
+        null=True, blank=True, validators=[MinValueValidator(-90), MaxValueValidator(90)]
+    )
+    longitude = models.FloatField(
+        null=True, blank=True, validators=[MinValueValidator(-180), MaxValueValidator(180)]
+    )
 
     def __str__(self):
         return self.name
@@ -119,6 +183,8 @@ class Tournament(models.Model):
     start_date = models.DateField("Event date", db_index=True)
     end_date = models.DateField("Event date", db_index=True)
     system = models.ForeignKey(System, on_delete=models.PROTECT)
+    # Here and on the other models in lsnz.export, so exports can pick up only changed rows
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -135,9 +201,20 @@ class Event(models.Model):
     start_time = models.DateTimeField("Event start")
     end_time = models.DateTimeField("Event end", null=True, blank=True)
     points_cap = models.IntegerField(default=30, null=True, blank=True)
-    format = models.ForeignKey(Format, on_delete=models.PROTECT)
-    tournament = models.ForeignKey(Tournament, on_delete=models.PROTECT, related_name="events")
+    # Both indexed by the composite indexes in Meta
+    format = models.ForeignKey(Format, on_delete=models.PROTECT, db_index=False)
+    tournament = models.ForeignKey(Tournament, on_delete=models.PROTECT, related_name="events", db_index=False)
     settings = models.ForeignKey(Settings, on_delete=models.PROTECT)
+    # Maintained by the Registration signal handlers in lsnz.signals
+    registration_count = models.PositiveIntegerField(default=0, editable=False)
+    paid_count = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tournament', 'start_time'], name='lsnz_event_tournament_start'),
+            models.Index(fields=['format', 'tournament'], name='lsnz_event_format_tournament'),
+        ]
 
     def __str__(self):
         return self.format.name
@@ -150,14 +227,104 @@ class Team(models.Model):
         return self.name
 
 class Registration(models.Model):
-    event = models.ForeignKey(Event, on_delete=models.PROTECT)
-    player = models.ForeignKey(Player, on_delete=models.CASCADE)
+    # Indexed by unique_registration and lsnz_registration_player_event
+    event = models.ForeignKey(Event, on_delete=models.PROTECT, db_index=False)
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, db_index=False)
     team = models.ForeignKey(Team, on_delete=models.PROTECT, db_index=True, null=True, blank=True)
     paid = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'player'], name='unique_registration'),
+        ]
+        indexes = [
+            models.Index(fields=['player', 'event'], name='lsnz_registration_player_event'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so event counters can be adjusted on save
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Keep the event counter updates in the same transaction as the save
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.event} : {self.player}"
 
+class Game(models.Model):
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name="games")
+    number = models.PositiveSmallIntegerField()
+    played_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        ordering = ['event', 'number']
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'number'], name='unique_game_number'),
+        ]
+
+    def __str__(self):
+        return f"{self.event} : game {self.number}"
+
+class GameResult(models.Model):
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name="results")
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name="game_results")
+    team = models.ForeignKey(Team, on_delete=models.SET_NULL, null=True, blank=True)
+    score = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['game', 'player'], name='unique_game_player'),
+        ]
+
+    def __str__(self):
+        return f"{self.game} : {self.player} {self.score}"
+
+class TournamentArchive(models.Model):
+    """
+    What remains of a finished tournament once ``manage.py archive_tournaments``
+    has moved its teams, registrations and games out of the live tables.
+
+    ``standings`` holds each event's final table for the results pages and
+    ``rows`` holds the archived rows themselves, so ``manage.py
+    restore_tournament`` can put them back with their original ids. See
+    ``lsnz.archive``.
+    """
+    tournament = models.OneToOneField(Tournament, on_delete=models.CASCADE, primary_key=True, related_name='archive')
+    archived_at = models.DateTimeField(auto_now_add=True)
+    participant_count = models.PositiveIntegerField(default=0)
+    team_count = models.PositiveIntegerField(default=0)
+    game_count = models.PositiveIntegerField(default=0)
+    standings = models.JSONField(default=dict)
+    rows = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+
+    def __str__(self):
+        return f"{self.tournament} archive"
+
+class ArchivedEntry(models.Model):
+    """One player's part in an archived tournament, counted in their ``PlayerStats``."""
+    archive = models.ForeignKey(TournamentArchive, on_delete=models.CASCADE, related_name='entries')
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='archived_entries')
+    events_played = models.PositiveSmallIntegerField(default=0)
+    teams = models.CharField(max_length=200, blank=True)
+    best_placing = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "Archived entries"
+        constraints = [
+            models.UniqueConstraint(fields=['archive', 'player'], name='unique_archived_entry'),
+        ]
+
+    def __str__(self):
+        return f"{self.archive.tournament} : {self.player}"
+
 class Pass(models.Model):
     PASS_TYPE_CHOICES = [
         ('monthly', 'Monthly Pass'),
@@ -169,14 +336,277 @@ class Pass(models.Model):
     start_date = models.DateField()
     end_date = models.DateField()
     price_paid = models.DecimalField(max_digits=8, decimal_places=2)
+    # The buyer's home site when the pass was sold, so sales reports stay put when players move
+    home_site = models.ForeignKey(Site, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    refunded_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     @property
     def is_active(self):
-        return self.start_date <= timezone.now().date() <= self.end_date
+        return not self.refunded and self.start_date <= timezone.now().date() <= self.end_date
+
+    @property
+    def refunded(self):
+        return self.refunded_at is not None
 
     class Meta():
         verbose_name = "Pass"
         verbose_name_plural = "Passes"
+        # The days a pass touches are looked up by these when the sales rollups are refreshed
+        indexes = [
+            models.Index(fields=['purchase_date'], name='lsnz_pass_purchase_date'),
+            models.Index(fields=['start_date'], name='lsnz_pass_start_date'),
+            models.Index(fields=['end_date'], name='lsnz_pass_end_date'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so the sales rollups for the old days are refreshed too
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.home_site_id is None and self.player_id is not None:
+            self.home_site_id = Player.objects.filter(pk=self.player_id).values_list('home_site', flat=True).first()
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.player} : {self.pass_type}"
+
+
+class PassSalesDay(models.Model):
+    """
+    One day's pass sales for one pass type and home site.
+
+    Reports read these instead of the ``Pass`` table. Sales and refunds
+    count on the day the pass was bought; ``started`` and ``ended`` count
+    the unrefunded passes whose first or last day it is, so the passes
+    active on any day are the ``started`` up to it less the ``ended``
+    before it. Kept up to date by ``lsnz.signals`` and rebuilt from scratch
+    with ``manage.py rebuild_pass_sales``.
+    """
+    date = models.DateField()
+    pass_type = models.CharField(max_length=20, choices=Pass.PASS_TYPE_CHOICES)
+    site = models.ForeignKey(Site, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    sold = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    refunded = models.PositiveIntegerField(default=0)
+    refunded_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    started = models.PositiveIntegerField(default=0)
+    ended = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Pass sales day"
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'pass_type', 'site'], name='unique_pass_sales_day'),
+            # NULLs never clash in a unique constraint, so passes without a site need their own
+            models.UniqueConstraint(
+                fields=['date', 'pass_type'], condition=models.Q(site__isnull=True), name='unique_pass_sales_day_no_site',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.pass_type} {self.site_id or '-'}"
+
+
+class PlayerStats(models.Model):
+    """
+    Per-player totals shown on profile pages.
+
+    Kept up to date by the signal handlers in ``lsnz.signals`` and rebuilt
+    from scratch with ``manage.py rebuild_player_stats``.
+    """
+    player = models.OneToOneField(Player, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    tournaments_entered = models.PositiveIntegerField(default=0)
+    events_played = models.PositiveIntegerField(default=0)
+    sites_visited = models.PositiveIntegerField(default=0)
+    series_played = models.PositiveIntegerField(default=0)
+    passes_bought = models.PositiveIntegerField(default=0)
+    last_pass_end = models.DateField(null=True, blank=True)
+    post_count = models.PositiveIntegerField(default=0)
+    first_played = models.DateField(null=True, blank=True)
+    last_played = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Player stats"
+        verbose_name_plural = "Player stats"
+
+    def __str__(self):
+        return f"{self.player} stats"
+
+
+class MatchupSeason(models.Model):
+    """
+    A season whose ``Matchup`` rows have been built; see ``lsnz.analytics``.
+    Analytics jobs lock these rows while they change the season's matchups.
+    """
+    season = models.PositiveSmallIntegerField(primary_key=True)
+    built_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return str(self.season)
+
+
+class MatchupGame(models.Model):
+    """
+    The results a game last contributed to its season's matchups, so they
+    can be taken away again when the game changes or is deleted.
+    """
+    # Not a foreign key, as the snapshot has to outlive a deleted game
+    game_id = models.PositiveIntegerField(primary_key=True)
+    season = models.PositiveSmallIntegerField()
+    results = models.JSONField(default=list)
+
+    def __str__(self):
+        return f"Game {self.game_id} ({self.season})"
+
+
+class Matchup(models.Model):
+    """
+    One player's record against an opponent (wins, losses and ties) or
+    with a teammate (games and wins) in one season.
+    """
+    OPPONENTS = 'opponents'
+    TEAMMATES = 'teammates'
+    KIND_CHOICES = [(OPPONENTS, 'Opponent'), (TEAMMATES, 'Teammate')]
+
+    season = models.PositiveSmallIntegerField()
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='+', db_index=False)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    other = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='+')
+    games = models.PositiveIntegerField(default=0)
+    wins = models.PositiveIntegerField(default=0)
+    losses = models.PositiveIntegerField(default=0)
+    ties = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Also the index profile pages read a player's rows through
+            models.UniqueConstraint(fields=['season', 'player', 'kind', 'other'], name='unique_matchup'),
+        ]
+
+    def __str__(self):
+        return f"{self.season} {self.player_id} {self.kind} {self.other_id}"
+
+
+class ChunkedUpload(models.Model):
+    """
+    A large file being uploaded in pieces by the admin, so an interrupted
+    upload can carry on from ``offset`` instead of starting again.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(Player, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    @property
+    def path(self):
+        return os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{self.pk}.part')
+
+    @property
+    def complete(self):
+        return self.offset == self.size
+
+    def append(self, data):
+        os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+        with open(self.path, 'ab') as f:
+            # Drop anything past the confirmed offset left by a failed request
+            f.truncate(self.offset)
+            f.write(data)
+        self.offset += len(data)
+        self.save(update_fields=['offset'])
+
+    def open(self):
+        return File(open(self.path, 'rb'), name=self.filename)
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.delete()
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+
+class QueuedEmail(models.Model):
+    """
+    An outgoing email waiting to be delivered by ``manage.py send_queued_email``.
+
+    ``message`` holds everything needed to rebuild the EmailMessage, see
+    ``lsnz.mail``.
+    """
+    QUEUED = 'queued'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+    subject = models.CharField(max_length=255)
+    recipients = models.TextField()
+    message = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Also works as a lease: a worker that claims an email pushes this forward
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.UUIDField(null=True, blank=True, editable=False)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Queued email"
+        verbose_name_plural = "Queued emails"
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} : {self.recipients}"
+
+
+class Job(models.Model):
+    """
+    A call to a function decorated with ``lsnz.jobs.job``, waiting for or
+    run by ``manage.py run_jobs``.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    name = models.CharField(max_length=200, db_index=True)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0, help_text="Higher runs first.")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    # A running job whose lease has expired is assumed lost and claimed again
+    locked_until = models.DateTimeField(null=True, blank=True)
+    claim_token = models.UUIDField(null=True, blank=True, editable=False)
+    worker = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True, help_text="Seconds")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk}"
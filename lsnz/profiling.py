@@ -0,0 +1,306 @@
+"""
+Sampling profiler for production requests.
+
+``ProfilingMiddleware`` profiles a random ``PROFILE_SAMPLE_RATE`` share of
+requests, any request with a valid ``X-Profile-Token`` header (see
+``manage.py profile_token``) and any staff request with ``?_profile=1``.
+Requests that aren't picked cost one random number and two lookups.
+
+A profiled request is watched by a thread that records the request
+thread's stack every ``PROFILE_INTERVAL`` seconds, so time spent waiting on
+the database or the network shows up as well as CPU time. SQL queries are
+recorded with their start offsets. Each profile is saved as a JSON file in
+``PROFILE_DIR``, keeping the newest ``PROFILE_MAX_FILES``.
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.db.backends.signals import connection_created
+
+TOKEN_SALT = 'lsnz.profiling'
+MAX_STACK_DEPTH = 100
+MAX_SQL_LENGTH = 1000
+
+
+def make_token():
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign('profile')
+
+
+def valid_token(token):
+    try:
+        signing.TimestampSigner(salt=TOKEN_SALT).unsign(
+            token, max_age=getattr(settings, 'PROFILE_TOKEN_MAX_AGE', 86400)
+        )
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def frame_label(frame):
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(str(settings.BASE_DIR)):
+        filename = os.path.relpath(filename, settings.BASE_DIR)
+    else:
+        # Keep library paths short: site-packages/django/db/... becomes django/db/...
+        filename = filename.split('site-packages' + os.sep)[-1]
+    return f'{code.co_qualname} ({filename}:{code.co_firstlineno})'
+
+
+class Sampler:
+    """Record the stack of one thread at a fixed interval, from another thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+
+# The profile of the request being handled in this thread or task, if it is profiled
+request_profile = ContextVar('request_profile', default=None)
+
+
+def record_sql(execute, query, params, many, context):
+    profile = request_profile.get()
+    if profile is None:
+        return execute(query, params, many, context)
+    query_started = time.perf_counter()
+    try:
+        return execute(query, params, many, context)
+    finally:
+        profile.sql.append([
+            round(query_started - profile.started, 6),
+            round(time.perf_counter() - query_started, 6),
+            query[:MAX_SQL_LENGTH],
+        ])
+
+
+def install_sql_recorder(sender, connection, **kwargs):
+    # Every connection, as under ASGI each thread a request runs code in has its own
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_sql)
+
+
+connection_created.connect(install_sql_recorder)
+
+
+class ProfilingMiddleware:
+    """
+    Put this after AuthenticationMiddleware so staff can ask for a profile.
+
+    Under ASGI the sampler watches the event loop thread, so async views are
+    sampled in full, but a sync view shows up only as the await on the
+    thread it was handed to. Its SQL timeline is recorded either way.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def picked(self, request):
+        """Whether ``request`` is sampled or carries a valid token, without looking at the user."""
+        if random.random() < getattr(settings, 'PROFILE_SAMPLE_RATE', 0):
+            return True
+        token = request.headers.get('X-Profile-Token')
+        return bool(token and valid_token(token))
+
+    def should_profile(self, request):
+        if self.picked(request):
+            return True
+        return request.GET.get('_profile') == '1' and request.user.is_staff
+
+    async def ashould_profile(self, request):
+        if self.picked(request):
+            return True
+        return request.GET.get('_profile') == '1' and (await request.auser()).is_staff
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.should_profile(request):
+            return self.get_response(request)
+        profile = RequestProfile()
+        try:
+            # Template responses are already rendered when this returns
+            response = self.get_response(request)
+        finally:
+            profile.stop()
+        profile.save(request, response)
+        return response
+
+    async def __acall__(self, request):
+        if not await self.ashould_profile(request):
+            return await self.get_response(request)
+        profile = RequestProfile()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profile.stop()
+        # Writing and pruning the files would otherwise block the event loop
+        await sync_to_async(profile.save, thread_sensitive=False)(request, response)
+        return response
+
+
+class RequestProfile:
+    """The samples and SQL queries of one request, from creation until ``stop()``."""
+
+    def __init__(self):
+        self.sql = []
+        self.started = time.perf_counter()
+        self.duration = None
+        self.token = request_profile.set(self)
+        self.sampler = Sampler(threading.get_ident(), getattr(settings, 'PROFILE_INTERVAL', 0.005))
+        self.sampler.start()
+
+    def stop(self):
+        self.sampler.stop()
+        request_profile.reset(self.token)
+        self.duration = time.perf_counter() - self.started
+
+    def save(self, request, response):
+        match = getattr(request, 'resolver_match', None)
+        save_profile({
+            'path': request.get_full_path(),
+            'method': request.method,
+            'view': match.view_name if match else '',
+            'status': response.status_code,
+            'duration': round(self.duration, 6),
+            'started_at': time.time() - self.duration,
+            'interval': self.sampler.interval,
+            'samples': [[list(stack), count] for stack, count in self.sampler.samples.most_common()],
+            'sql': self.sql,
+        })
+
+
+def profile_dir():
+    return getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+def save_profile(profile):
+    """Write ``profile`` and delete the oldest files beyond PROFILE_MAX_FILES."""
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    # Named so listing and pruning don't need to open the files
+    name = f'{int(profile["started_at"] * 1000)}-{int(profile["duration"] * 1000)}-{uuid.uuid4().hex[:8]}.json'
+    with open(os.path.join(directory, f'{name}.tmp'), 'w') as f:
+        json.dump(profile, f)
+    os.replace(os.path.join(directory, f'{name}.tmp'), os.path.join(directory, name))
+
+    names = sorted(profile_names(), key=lambda item: item[1])
+    for old, _, _ in names[:max(0, len(names) - getattr(settings, 'PROFILE_MAX_FILES', 200))]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except FileNotFoundError:
+            pass
+    return name
+
+
+def profile_names():
+    """``(filename, started ms, duration ms)`` for every saved profile."""
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    names = []
+    for name in os.listdir(directory):
+        parts = name.removesuffix('.json').split('-')
+        if name.endswith('.json') and len(parts) == 3 and parts[0].isdigit() and parts[1].isdigit():
+            names.append((name, int(parts[0]), int(parts[1])))
+    return names
+
+
+def slowest_profiles(limit=50):
+    profiles = []
+    for name, _, _ in sorted(profile_names(), key=lambda item: -item[2])[:limit]:
+        profile = load_profile(name)
+        if profile is not None:
+            profiles.append({'name': name, **profile})
+    return profiles
+
+
+def load_profile(name):
+    if os.path.basename(name) != name or not name.endswith('.json'):
+        return None
+    try:
+        with open(os.path.join(profile_dir(), name)) as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    profile['started'] = datetime.fromtimestamp(profile['started_at'], tz=timezone.utc)
+    profile['duration_ms'] = profile['duration'] * 1000
+    return profile
+
+
+def flame_rows(samples, min_share=0.01):
+    """
+    Flatten the sampled stacks into rows of an icicle chart: each row is a
+    call-tree depth and each cell ``(label, offset, width)`` gives its
+    position as a share of all samples. Cells under ``min_share`` are left out.
+    """
+    root = {'count': 0, 'children': {}}
+    for stack, count in samples:
+        root['count'] += count
+        node = root
+        for label in stack:
+            node = node['children'].setdefault(label, {'count': 0, 'children': {}})
+            node['count'] += count
+    total = root['count'] or 1
+
+    rows = []
+    level = [(root, 0.0)]
+    while level:
+        cells = []
+        next_level = []
+        for node, offset in level:
+            for label, child in sorted(node['children'].items(), key=lambda item: -item[1]['count']):
+                width = child['count'] / total
+                if width >= min_share:
+                    cells.append({'label': label, 'offset': offset * 100, 'width': width * 100, 'samples': child['count']})
+                    next_level.append((child, offset))
+                offset += width
+        if cells:
+            rows.append(cells)
+        level = next_level
+    return rows
+
+
+def self_time(samples, limit=20):
+    """The functions most often at the top of the stack."""
+    counts = Counter()
+    for stack, count in samples:
+        counts[stack[-1]] += count
+    total = sum(counts.values()) or 1
+    return [(label, count, count * 100 / total) for label, count in counts.most_common(limit)]
@@ -0,0 +1,240 @@
+"""
+Replay the site's pages and look at how the database runs their queries.
+
+``replay`` requests each page with the test client and records every query
+it sends. ``explain`` asks the database for the plan of each distinct query,
+and ``plan_problems`` picks out full table scans and sorts that need a
+temporary B-tree, which usually mean an index is missing. ``seed`` fills an
+empty database with enough rows for the plans to be realistic; see
+``manage.py index_advisor``.
+"""
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    Event,
+    Format,
+    Game,
+    GameResult,
+    Grade,
+    MazeMap,
+    Player,
+    Post,
+    Registration,
+    Settings,
+    Site,
+    System,
+    Team,
+    Tournament,
+)
+from .slugs import allocate_slugs
+from .stats import rebuild_all_player_stats, refresh_event_counts
+
+SQLITE_SCAN = re.compile(r'^SCAN (\S+)( USING (COVERING )?INDEX)?')
+
+
+@dataclass
+class QueryPlan:
+    sql: str
+    params: tuple
+    plan: list
+    problems: list
+    views: set = field(default_factory=set)
+    count: int = 0
+
+
+def seed(players=2000, seed=0):
+    """Create ``players`` players and tournaments, registrations, results and posts in proportion."""
+    rng = random.Random(seed)
+    now = timezone.now()
+    system = System.objects.create(name='Seed system', image='', description='')
+    settings = Settings.objects.create(name='Seed settings')
+    grades = Grade.objects.bulk_create(
+        Grade(letter=letter, points=points, description=letter) for points, letter in enumerate('DCBA')
+    )
+    formats = Format.objects.bulk_create(allocate_slugs(Format(name=f'Seed format {i}') for i in range(5)))
+    sites = Site.objects.bulk_create(allocate_slugs(
+        Site(name=f'Seed site {i}', country='NZ', address=f'{i} Seed St', system=system) for i in range(20)
+    ))
+    MazeMap.objects.bulk_create(
+        MazeMap(site=site, image='maze_maps/seed.png', date=(now - timedelta(days=90 * i)).date())
+        for site in sites for i in range(5)
+    )
+
+    player_objects = []
+    for i in range(players):
+        player = Player(
+            email=f'seed{i}@example.com', alias=f'Seed{i}',
+            grade=rng.choice(grades), home_site=rng.choice(sites),
+        )
+        player.set_unusable_password()
+        player_objects.append(player)
+    player_objects = Player.objects.bulk_create(allocate_slugs(player_objects))
+
+    tournaments = Tournament.objects.bulk_create(allocate_slugs(
+        Tournament(
+            name=f'Seed tournament {i}', site=rng.choice(sites), system=system,
+            start_date=(now - timedelta(days=7 * i - 28)).date(), end_date=(now - timedelta(days=7 * i - 29)).date(),
+        )
+        for i in range(max(players // 20, 1))
+    ))
+    events = Event.objects.bulk_create(
+        Event(
+            tournament=tournament, format=fmt, settings=settings,
+            start_time=now - timedelta(days=7 * i - 28, hours=-hour), end_time=now - timedelta(days=7 * i - 28, hours=-hour - 1),
+        )
+        for i, tournament in enumerate(tournaments)
+        for hour, fmt in enumerate(rng.sample(formats, 3))
+    )
+    teams = {
+        event.pk: Team.objects.bulk_create(Team(name=f'Team {i}', event=event) for i in range(4))
+        for event in events
+    }
+
+    registrations = []
+    for player in player_objects:
+        for event in rng.sample(events, min(10, len(events))):
+            registrations.append(Registration(
+                event=event, player=player, team=rng.choice(teams[event.pk]), paid=rng.random() < 0.7,
+            ))
+    Registration.objects.bulk_create(registrations, batch_size=1000)
+
+    by_event = {}
+    for registration in registrations:
+        by_event.setdefault(registration.event_id, []).append(registration)
+    games = Game.objects.bulk_create(
+        Game(event=event, number=number, played_at=event.start_time) for event in events for number in (1, 2)
+    )
+    GameResult.objects.bulk_create(
+        (
+            GameResult(game=game, player_id=registration.player_id, team_id=registration.team_id, score=rng.randint(0, 5000))
+            for game in games
+            for registration in by_event.get(game.event_id, [])[:10]
+        ),
+        batch_size=1000,
+    )
+
+    Post.objects.bulk_create(allocate_slugs(
+        Post(title=f'Seed post {i}', summary='Summary', body='Body', image='post_images/seed.png', author=rng.choice(player_objects))
+        for i in range(max(players // 4, 1))
+    ))
+    refresh_event_counts(event.pk for event in events)
+    rebuild_all_player_stats()
+
+
+def replay_requests():
+    """``(label, method, url, data, logged_in)`` for every page, using rows already in the database."""
+    tournament = Tournament.objects.order_by('-start_date').first()
+    player = Player.objects.order_by('pk').first()
+    post = Post.objects.order_by('pk').first()
+    fmt = Format.objects.order_by('pk').first()
+    site = Site.objects.order_by('pk').first()
+    system = System.objects.order_by('pk').first()
+    taken_alias = Player.objects.exclude(pk=player.pk).values_list('alias', flat=True).first() or ''
+    return [
+        ('tournaments', 'get', reverse('lsnz:tournaments'), None, False),
+        ('tournament_detail', 'get', reverse('lsnz:tournament_detail', args=[tournament.slug]), None, True),
+        ('tournament_scoreboard_stream', 'get', reverse('lsnz:tournament_scoreboard_stream', args=[tournament.slug]), None, False),
+        ('tournament_register', 'get', reverse('lsnz:tournament_register', args=[tournament.slug]), None, True),
+        ('systems', 'get', reverse('lsnz:systems'), None, False),
+        ('system_detail', 'get', reverse('lsnz:system_detail', args=[system.slug]), None, False),
+        ('formats', 'get', reverse('lsnz:formats'), None, False),
+        ('format_detail', 'get', reverse('lsnz:format_detail', args=[fmt.slug]), None, False),
+        ('sites', 'get', reverse('lsnz:sites'), None, False),
+        ('site_detail', 'get', reverse('lsnz:site_detail', args=[site.slug]), None, False),
+        ('players', 'get', reverse('lsnz:players'), None, False),
+        ('player_detail', 'get', reverse('lsnz:player_detail', args=[player.slug]), None, False),
+        ('edit_profile', 'post', reverse('lsnz:edit_profile', args=[player.slug]), {'alias': taken_alias.upper()}, True),
+        ('blog', 'get', reverse('lsnz:blog'), None, False),
+        ('post_detail', 'get', reverse('lsnz:post_detail', args=[post.slug]), None, False),
+        ('write_post', 'post', reverse('lsnz:write_post'), {'title': post.title.upper()}, True),
+    ]
+
+
+def capture(func):
+    """Call ``func`` and return ``(seconds, [(sql, params), ...])`` for the queries it ran."""
+    queries = []
+
+    def record(execute, sql, params, many, context):
+        queries.append((sql, tuple(params or ())))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(record):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+    return elapsed, queries
+
+
+def replay(requests, repeat=3):
+    """
+    Request each page ``repeat`` times; return ``{label: (best seconds, queries)}``
+    with the queries from the first request.
+    """
+    player = Player.objects.order_by('pk').first()
+    anonymous = Client()
+    logged_in = Client()
+    logged_in.force_login(player)
+
+    results = {}
+    for label, method, url, data, login in requests:
+        client = logged_in if login else anonymous
+        request = getattr(client, method)
+        timings = []
+        for _ in range(repeat):
+            elapsed, queries = capture(lambda: request(url, data) if data else request(url))
+            timings.append(elapsed)
+            results.setdefault(label, (None, queries))
+        results[label] = (min(timings), results[label][1])
+    return results
+
+
+def explain(sql, params):
+    """The database's plan for ``sql``, one string per step."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN {sql}', params)
+            return [row[0] for row in cursor.fetchall()]
+    raise NotImplementedError(f'Query plans are not supported on {connection.vendor}.')
+
+
+def plan_problems(plan):
+    """Full table scans and temporary sorts in a plan from ``explain``."""
+    problems = []
+    for step in plan:
+        step = step.strip()
+        if match := SQLITE_SCAN.match(step):
+            problems.append(f"full {'index ' if match[2] else ''}scan of {match[1]}")
+        elif step.startswith('USE TEMP B-TREE'):
+            problems.append(f'temp b-tree {step.removeprefix("USE TEMP B-TREE ").lower()}')
+        elif match := re.search(r'Seq Scan on (\S+)', step):
+            problems.append(f'full scan of {match[1]}')
+        elif re.match(r'(->\s+)?Sort\b', step):
+            problems.append('sort')
+    return problems
+
+
+def query_plans(results):
+    """Explain each distinct query from ``replay`` once, in the order first seen."""
+    plans = {}
+    for label, (_, queries) in results.items():
+        for sql, params in queries:
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            if sql not in plans:
+                plan = explain(sql, params)
+                plans[sql] = QueryPlan(sql, params, plan, plan_problems(plan))
+            plans[sql].views.add(label)
+            plans[sql].count += 1
+    return list(plans.values())
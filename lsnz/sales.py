@@ -0,0 +1,169 @@
+"""
+Daily pass sales rollups and the reports read from them.
+
+``PassSalesDay`` holds one row per day, pass type and home site. Changing a
+pass refreshes only the days it touches, both before and after the change,
+from the ``Pass`` rows for those days; ``rebuild_pass_sales`` recalculates
+every day at once. Reports sum the rollups and never read ``Pass``, so a
+year costs the same however many passes were sold in it.
+"""
+import csv
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .jobs import job
+from .models import Pass, PassSalesDay
+
+SALES_COLUMNS = ['date', 'pass_type', 'site', 'sold', 'revenue', 'refunded', 'refunded_amount', 'net_revenue']
+
+
+def pass_days(values):
+    """The days a pass with these field values counts on: bought, first and last day."""
+    purchase_date = values.get('purchase_date')
+    return {
+        timezone.localdate(purchase_date) if purchase_date else None,
+        values.get('start_date'),
+        values.get('end_date'),
+    } - {None}
+
+
+def sales_rows(purchased, starting, ending):
+    """``PassSalesDay`` rows from the passes bought, starting and ending on the days wanted."""
+    rows = {}
+
+    def row(day, pass_type, site_id):
+        key = (day, pass_type, site_id)
+        if key not in rows:
+            rows[key] = PassSalesDay(date=day, pass_type=pass_type, site_id=site_id)
+        return rows[key]
+
+    refunded = Q(refunded_at__isnull=False)
+    sales = (
+        purchased.annotate(day=TruncDate('purchase_date'))
+        .values('day', 'pass_type', 'home_site')
+        .annotate(
+            sold=Count('pk'),
+            revenue=Sum('price_paid'),
+            refunded=Count('pk', filter=refunded),
+            refunded_amount=Sum('price_paid', filter=refunded),
+        )
+        .order_by()
+    )
+    for sale in sales:
+        day_row = row(sale['day'], sale['pass_type'], sale['home_site'])
+        day_row.sold = sale['sold']
+        day_row.revenue = sale['revenue']
+        day_row.refunded = sale['refunded']
+        day_row.refunded_amount = sale['refunded_amount'] or 0
+
+    for field, passes, date_field in (('started', starting, 'start_date'), ('ended', ending, 'end_date')):
+        counts = (
+            passes.filter(refunded_at__isnull=True)
+            .values(date_field, 'pass_type', 'home_site')
+            .annotate(count=Count('pk'))
+            .order_by()
+        )
+        for count in counts:
+            setattr(row(count[date_field], count['pass_type'], count['home_site']), field, count['count'])
+    return list(rows.values())
+
+
+def refresh_pass_sales(days):
+    """Recalculate the rollups for ``days`` from the passes bought, starting or ending on them."""
+    days = set(days) - {None}
+    if not days:
+        return
+    purchased = Q()
+    for day in days:
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        # A range per day rather than __date, which would stop the index being used
+        purchased |= Q(purchase_date__gte=start, purchase_date__lt=start + timedelta(days=1))
+    rows = sales_rows(
+        Pass.objects.filter(purchased), Pass.objects.filter(start_date__in=days), Pass.objects.filter(end_date__in=days)
+    )
+    with transaction.atomic():
+        PassSalesDay.objects.filter(date__in=days).delete()
+        PassSalesDay.objects.bulk_create(rows)
+
+
+@job(priority=-5)
+def rebuild_pass_sales():
+    """Recalculate every day's rollups from the whole ``Pass`` table."""
+    passes = Pass.objects.all()
+    rows = sales_rows(passes, passes, passes)
+    with transaction.atomic():
+        PassSalesDay.objects.all().delete()
+        PassSalesDay.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def with_net_revenue(rows):
+    for row in rows:
+        row['net_revenue'] = row['revenue'] - row['refunded_amount']
+    return rows
+
+
+def sales_totals(start, end):
+    """
+    Sales from ``start`` to ``end`` inclusive per pass type and site, with
+    the number of passes ``active`` on ``end``.
+    """
+    in_period = Q(date__gte=start)
+    rows = (
+        PassSalesDay.objects.filter(date__lte=end)
+        .values('pass_type', 'site', 'site__name')
+        .annotate(
+            sold=Sum('sold', filter=in_period, default=0),
+            revenue=Sum('revenue', filter=in_period, default=0),
+            refunded=Sum('refunded', filter=in_period, default=0),
+            refunded_amount=Sum('refunded_amount', filter=in_period, default=0),
+            started=Sum('started'),
+            ended=Sum('ended', filter=Q(date__lt=end), default=0),
+        )
+        .order_by('pass_type', 'site__name')
+    )
+    totals = []
+    for row in with_net_revenue(list(rows)):
+        row['active'] = row.pop('started') - row.pop('ended')
+        if row['sold'] or row['active']:
+            totals.append(row)
+    return totals
+
+
+def active_passes(day):
+    """``{(pass type, site id): passes active on day}``."""
+    counts = (
+        PassSalesDay.objects.filter(date__lte=day)
+        .values('pass_type', 'site')
+        .annotate(started=Sum('started'), ended=Sum('ended', filter=Q(date__lt=day), default=0))
+        .order_by()
+    )
+    return {(row['pass_type'], row['site']): row['started'] - row['ended'] for row in counts}
+
+
+def monthly_sales(start, end):
+    """Sales from ``start`` to ``end`` inclusive per calendar month."""
+    return with_net_revenue(list(
+        PassSalesDay.objects.filter(date__range=(start, end))
+        .annotate(month=TruncMonth('date'))
+        .values('month')
+        .annotate(sold=Sum('sold'), revenue=Sum('revenue'), refunded=Sum('refunded'), refunded_amount=Sum('refunded_amount'))
+        .order_by('month')
+    ))
+
+
+def write_sales_csv(out, start, end):
+    """Write one line per day, pass type and site from ``start`` to ``end`` inclusive to ``out``."""
+    writer = csv.writer(out)
+    writer.writerow(SALES_COLUMNS)
+    rows = (
+        PassSalesDay.objects.filter(date__range=(start, end))
+        .values_list('date', 'pass_type', 'site__name', 'sold', 'revenue', 'refunded', 'refunded_amount')
+        .order_by('date', 'pass_type', 'site__name')
+    )
+    for date, pass_type, site, sold, revenue, refunded, refunded_amount in rows.iterator():
+        writer.writerow([date, pass_type, site or '', sold, revenue, refunded, refunded_amount, revenue - refunded_amount])
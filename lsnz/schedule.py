@@ -0,0 +1,128 @@
+"""
+Finding registrations whose events overlap in time.
+
+Events overlap when each starts before the other ends; one ending exactly
+as the next starts is not a clash. An event without an end time is taken
+to last ``EVENT_DEFAULT_MINUTES``.
+
+``clashing_registrations`` asks the database for a player's registrations
+that overlap a time window, reaching them through the (player, event)
+index. Checking several events at once, or a whole tournament, loads the
+candidates once and finds every overlapping pair with a single sort and
+sweep in ``overlaps``.
+"""
+import heapq
+from dataclasses import dataclass
+from datetime import timedelta
+from itertools import count
+
+from django.conf import settings
+from django.db.models import DateTimeField, ExpressionWrapper, F
+from django.db.models.functions import Coalesce
+
+from .models import Event, Registration
+
+
+@dataclass
+class Clash:
+    player: object
+    first: object
+    second: object
+
+
+def default_length():
+    return timedelta(minutes=settings.EVENT_DEFAULT_MINUTES)
+
+
+def event_end(event):
+    return event.end_time or event.start_time + default_length()
+
+
+def with_end(queryset, prefix=''):
+    """Annotate ``ends``: the event's end time, or its start plus the default length."""
+    return queryset.annotate(ends=Coalesce(
+        f'{prefix}end_time',
+        ExpressionWrapper(F(f'{prefix}start_time') + default_length(), output_field=DateTimeField()),
+    ))
+
+
+def overlaps(intervals):
+    """
+    Every overlapping pair among ``(start, end, item)`` intervals, as
+    ``(earlier item, later item)``, in the order the later ones start.
+    """
+    # Intervals that have started and not yet ended, soonest end first
+    active = []
+    tiebreak = count()
+    for start, end, item in sorted(intervals, key=lambda interval: (interval[0], interval[1])):
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        for _, _, other in sorted(active, key=lambda entry: entry[1]):
+            yield other, item
+        heapq.heappush(active, (end, next(tiebreak), item))
+
+
+def clashing_registrations(player, start, end, exclude_events=()):
+    """The player's registrations for events overlapping ``start`` to ``end``, earliest first."""
+    return list(
+        with_end(Registration.objects.filter(player=player), 'event__')
+        .filter(event__start_time__lt=end, ends__gt=start)
+        .exclude(event__in=list(exclude_events))
+        .select_related('event__tournament', 'event__format')
+        .order_by('event__start_time')
+    )
+
+
+def event_clashes(player, events):
+    """
+    ``[(new event, clashing event), ...]`` for ``events`` the player wants
+    to enter: clashes with their existing registrations and between the
+    new events themselves.
+    """
+    events = list(events)
+    if not events:
+        return []
+    registered = clashing_registrations(
+        player,
+        min(event.start_time for event in events),
+        max(event_end(event) for event in events),
+        exclude_events=[event.pk for event in events],
+    )
+    intervals = [(event.start_time, event_end(event), (True, event)) for event in events]
+    intervals += [(registration.event.start_time, registration.ends, (False, registration.event)) for registration in registered]
+
+    clashes = []
+    for (first_new, first), (second_new, second) in overlaps(intervals):
+        if first_new or second_new:
+            clashes.append((first, second) if first_new else (second, first))
+    return clashes
+
+
+def tournament_clashes(tournament):
+    """
+    Every pair of overlapping registrations held by a player entered in
+    ``tournament`` that involves at least one of its events, including
+    clashes with other tournaments.
+    """
+    events = list(with_end(Event.objects.filter(tournament=tournament)))
+    if not events:
+        return []
+    players = Registration.objects.filter(event__tournament=tournament).values('player')
+    registrations = (
+        with_end(Registration.objects.filter(player__in=players), 'event__')
+        .filter(event__start_time__lt=max(event.ends for event in events), ends__gt=min(event.start_time for event in events))
+        .select_related('player', 'event__tournament', 'event__format')
+    )
+
+    by_player = {}
+    for registration in registrations:
+        by_player.setdefault(registration.player_id, []).append(registration)
+
+    clashes = []
+    for player_registrations in by_player.values():
+        intervals = [(registration.event.start_time, registration.ends, registration) for registration in player_registrations]
+        for first, second in overlaps(intervals):
+            if tournament.pk in (first.event.tournament_id, second.event.tournament_id):
+                clashes.append(Clash(first.player, first, second))
+    clashes.sort(key=lambda clash: (clash.first.event.start_time, clash.player.alias))
+    return clashes
@@ -0,0 +1,174 @@
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .analytics import update_game_analytics
+from .backends import invalidate_cached_users
+from .geo import invalidate_site_index
+from .homepage import invalidate_homepage
+from .live import publish_tournament_change
+from .models import Event, Game, GameResult, Grade, MazeMap, Pass, Player, Post, Registration, Site, Tournament
+from .sales import pass_days, refresh_pass_sales
+from .stats import refresh_event_counts, refresh_player_stats
+from .tiles import build_maze_tiles, delete_tiles
+
+HOMEPAGE_PLAYER_FIELDS = ('alias', 'slug', 'grade_id', 'is_active')
+
+
+@receiver(post_save, sender=Player)
+@receiver(post_delete, sender=Player)
+def player_changed(sender, instance, **kwargs):
+    # Covers profile edits, password changes and last_login updates
+    invalidate_cached_users([instance.pk])
+
+
+@receiver(user_logged_out)
+def player_logged_out(sender, request, user, **kwargs):
+    if user is not None:
+        invalidate_cached_users([user.pk])
+
+
+@receiver(post_save, sender=Grade)
+@receiver(post_save, sender=Site)
+@receiver(pre_delete, sender=Grade)
+@receiver(pre_delete, sender=Site)
+def player_relation_changed(sender, instance, **kwargs):
+    # Cached players carry their grade and home site with them. Deletes are
+    # handled before the row goes, as by post_delete any SET_NULL would have
+    # already detached the players. QuerySet.update() sends no signals; see
+    # CachedUserMixin.
+    field = 'grade' if sender is Grade else 'home_site'
+    invalidate_cached_users(
+        Player.objects.filter(**{field: instance}).values_list('pk', flat=True)
+    )
+
+
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+def site_changed(sender, instance, **kwargs):
+    # Other processes rebuild their index once the change is visible to them
+    transaction.on_commit(invalidate_site_index)
+
+
+@receiver(post_save, sender=Tournament)
+@receiver(post_delete, sender=Tournament)
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Player)
+@receiver(post_save, sender=MazeMap)
+@receiver(post_delete, sender=MazeMap)
+def homepage_content_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_homepage(sender))
+
+
+@receiver(post_save, sender=Player)
+def player_saved_for_homepage(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Every login saves last_login, so only the fields the homepage shows count
+    if raw or created:
+        return
+    if update_fields is not None:
+        saved = {Player._meta.get_field(name).attname for name in update_fields}
+        if saved.isdisjoint(HOMEPAGE_PLAYER_FIELDS):
+            return
+    loaded = getattr(instance, '_loaded_values', {})
+    current = {field: getattr(instance, field) for field in HOMEPAGE_PLAYER_FIELDS}
+    if any(field not in loaded or loaded[field] != value for field, value in current.items()):
+        transaction.on_commit(lambda: invalidate_homepage(sender))
+    instance._loaded_values = {**loaded, **current}
+
+
+def refresh_stats_on_commit(*player_ids):
+    player_ids = {player_id for player_id in player_ids if player_id}
+    transaction.on_commit(lambda: refresh_player_stats(player_ids))
+
+
+@receiver(post_save, sender=Registration)
+@receiver(post_delete, sender=Registration)
+@receiver(post_save, sender=Pass)
+@receiver(post_delete, sender=Pass)
+def player_activity_changed(sender, instance, **kwargs):
+    refresh_stats_on_commit(instance.player_id)
+
+
+@receiver(post_save, sender=Pass)
+@receiver(post_delete, sender=Pass)
+def pass_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    current = {field: getattr(instance, field) for field in ('purchase_date', 'start_date', 'end_date')}
+    # Both the days the pass used to count on and the ones it counts on now
+    days = pass_days(loaded) | pass_days(current)
+    transaction.on_commit(lambda: refresh_pass_sales(days))
+    instance._loaded_values = {**loaded, **current}
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, **kwargs):
+    refresh_stats_on_commit(instance.author_id)
+
+
+def adjust_event_counts(event_id, registrations, paid):
+    if event_id and (registrations or paid):
+        Event.objects.filter(pk=event_id).update(
+            registration_count=F('registration_count') + registrations,
+            paid_count=F('paid_count') + paid,
+            updated_at=timezone.now(),
+        )
+
+
+@receiver(post_save, sender=Registration)
+def registration_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    if created:
+        adjust_event_counts(instance.event_id, 1, int(instance.paid))
+    elif 'event_id' not in loaded or 'paid' not in loaded:
+        # Saved without being loaded first, so there is nothing to diff against
+        refresh_event_counts({instance.event_id})
+    elif loaded['event_id'] != instance.event_id:
+        adjust_event_counts(loaded['event_id'], -1, -int(loaded['paid']))
+        adjust_event_counts(instance.event_id, 1, int(instance.paid))
+    else:
+        adjust_event_counts(instance.event_id, 0, int(instance.paid) - int(loaded['paid']))
+    instance._loaded_values = {**loaded, 'event_id': instance.event_id, 'paid': instance.paid}
+
+
+@receiver(post_delete, sender=Registration)
+def registration_deleted(sender, instance, **kwargs):
+    adjust_event_counts(instance.event_id, -1, -int(instance.paid))
+
+
+@receiver(post_save, sender=MazeMap)
+def maze_map_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and 'image' not in update_fields):
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    if created or loaded.get('image') != instance.image.name:
+        # Saved with the map, so workers only see it once the map is committed
+        build_maze_tiles.enqueue(instance.pk)
+    instance._loaded_values = {**loaded, 'image': instance.image.name}
+
+
+@receiver(post_delete, sender=MazeMap)
+def maze_map_deleted(sender, instance, **kwargs):
+    delete_tiles.enqueue(instance.pk)
+
+
+@receiver(post_save, sender=Game)
+@receiver(post_delete, sender=Game)
+@receiver(post_save, sender=GameResult)
+@receiver(post_delete, sender=GameResult)
+def result_changed(sender, instance, **kwargs):
+    update_game_analytics.enqueue_once(instance.pk if sender is Game else instance.game_id)
+    events = Event.objects.filter(pk=instance.event_id) if sender is Game else Event.objects.filter(games=instance.game_id)
+    for tournament_id in set(events.values_list('tournament_id', flat=True)):
+        # Live scoreboards rebuild once per change, not once per spectator
+        transaction.on_commit(lambda tournament_id=tournament_id: publish_tournament_change(tournament_id))
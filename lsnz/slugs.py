@@ -0,0 +1,60 @@
+from functools import reduce
+from operator import or_
+
+from autoslug.utils import crop_slug, get_prepopulated_value
+from django.db.models import Q
+
+# How many distinct stems are looked up in a single query
+STEMS_PER_QUERY = 100
+
+# Room left after the stem for "-<index>" when prefetching rivals, so that
+# stems cropped to fit an index still match (up to 9999 rivals per stem).
+MAX_INDEX_DIGITS = 4
+
+
+def slug_stem(field, instance):
+    """Return the slug ``field`` would use for ``instance`` before de-duplication."""
+    value = getattr(instance, field.attname) or get_prepopulated_value(field, instance)
+    slug = field.slugify(value) if value else ''
+    return field.slugify(crop_slug(field, slug or instance._meta.model_name))
+
+
+def allocate_slugs(instances, field_name='slug'):
+    """
+    Give each of ``instances`` a unique value for the ``AutoSlugField`` named
+    ``field_name``, in one query per ``STEMS_PER_QUERY`` distinct stems.
+
+    Unlike the field's own collision handling, which probes the database once
+    per candidate slug, every existing slug sharing a stem is fetched up front
+    and candidates are checked in memory. Slugs allocated earlier in the same
+    call count as taken, so the instances can safely be passed to
+    ``bulk_create`` afterwards.
+    """
+    instances = list(instances)
+    if not instances:
+        return instances
+
+    model = type(instances[0])
+    field = model._meta.get_field(field_name)
+    stems = [slug_stem(field, instance) for instance in instances]
+    prefixes = {stem[:field.max_length - len(field.index_sep) - MAX_INDEX_DIGITS] for stem in stems}
+    own_pks = [instance.pk for instance in instances if instance.pk]
+
+    taken = set()
+    prefixes = sorted(prefixes)
+    for start in range(0, len(prefixes), STEMS_PER_QUERY):
+        chunk = prefixes[start:start + STEMS_PER_QUERY]
+        query = reduce(or_, (Q(**{f'{field.name}__startswith': prefix}) for prefix in chunk))
+        rivals = model._default_manager.filter(query).exclude(pk__in=own_pks)
+        taken.update(rivals.values_list(field.name, flat=True))
+
+    for instance, stem in zip(instances, stems):
+        slug, index = stem, 1
+        while slug in taken:
+            index += 1
+            tail = f'{field.index_sep}{index}'
+            slug = stem[:field.max_length - len(tail)] + tail
+        taken.add(slug)
+        setattr(instance, field.attname, slug)
+        instance._allocated_slugs = {**getattr(instance, '_allocated_slugs', {}), field.name: slug}
+    return instances
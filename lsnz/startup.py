@@ -0,0 +1,112 @@
+"""
+Worker start-up: measuring what boot costs and doing the expensive parts
+before the first request rather than during it.
+"""
+import gc
+import os
+import re
+import subprocess
+import sys
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.template import engines
+from django.urls import get_resolver
+
+# Python snippets for each way the project boots, run in a fresh interpreter
+BOOT_TARGETS = {
+    'setup': 'import django; django.setup()',
+    'wsgi': 'from mysite.wsgi import application',
+    'first-request': (
+        'from mysite.wsgi import application\n'
+        'from django.test import Client\n'
+        'Client().get("/", SERVER_NAME="localhost")'
+    ),
+}
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def run_boot(target, importtime=False, env=None):
+    """Boot ``target`` in a new interpreter; return ``(seconds, stderr)``."""
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', BOOT_TARGETS[target]]
+    environment = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'mysite.settings')}
+    environment.update(env or {})
+    started = time.perf_counter()
+    result = subprocess.run(
+        command, cwd=settings.BASE_DIR, env=environment, capture_output=True, text=True, check=False,
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode:
+        raise RuntimeError(f'Booting {target} failed:\n{result.stderr[-2000:]}')
+    return elapsed, result.stderr
+
+
+def parse_importtime(output):
+    """``(module, self µs, cumulative µs, depth)`` for each line of ``-X importtime`` output."""
+    imports = []
+    for line in output.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            own, cumulative, indent, module = match.groups()
+            imports.append((module, int(own), int(cumulative), len(indent) // 2))
+    return imports
+
+
+def package_totals(imports):
+    """Total self time per top-level package, biggest first."""
+    totals = {}
+    for module, own, _, _ in imports:
+        package = module.split('.')[0]
+        totals[package] = totals.get(package, 0) + own
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+
+def project_template_names():
+    """Every template this project ships, as ``(engine alias, name)``."""
+    app_dir = apps.get_app_config('lsnz').path
+    for alias, directory in (('django', 'templates'), ('jinja2', 'jinja2')):
+        root = os.path.join(app_dir, directory)
+        for path, _, files in os.walk(root):
+            for filename in files:
+                if filename.endswith('.html'):
+                    yield alias, os.path.relpath(os.path.join(path, filename), root).replace(os.sep, '/')
+
+
+def warm_up():
+    """
+    Do the work a worker would otherwise do on its first requests: import
+    every view, build the URL resolver, compile the project's templates and
+    fill the content type cache.
+
+    Call it once in the WSGI module, ideally in a server master process
+    that forks its workers (gunicorn --preload), so workers share the result.
+    """
+    resolver = get_resolver()
+    resolver.reverse_dict  # noqa: B018 - populates the resolver and imports the views
+
+    # Imported by views on first use rather than at start-up
+    import markdown  # noqa: F401
+    from PIL import Image  # noqa: F401
+
+    for alias, name in project_template_names():
+        engines[alias].get_template(name)
+
+    from django.contrib.contenttypes.models import ContentType
+    try:
+        ContentType.objects.get_for_models(*apps.get_models())
+    except DatabaseError:
+        # Booting before migrate, or with the database down: the cache fills on first use
+        pass
+    # Forked workers must not share the master's database connections
+    connections.close_all()
+
+    # Keep what was loaded out of later collections, so forked workers
+    # don't copy the shared memory pages by touching them
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,92 @@
+// Uploads maze map images in 1 MB pieces as soon as a file is chosen, so a
+// dropped connection only loses the current piece. Progress is remembered in
+// localStorage: choosing the same file again (even after a page reload)
+// resumes where the last attempt stopped. Once every piece has arrived the
+// file input is cleared and the upload id is submitted with the form instead.
+(function () {
+    const CHUNK_SIZE = 1024 * 1024;
+    const RETRY_DELAY = 2000;
+
+    function sleep(ms) {
+        return new Promise(resolve => setTimeout(resolve, ms));
+    }
+
+    function csrfToken() {
+        return document.querySelector('[name=csrfmiddlewaretoken]').value;
+    }
+
+    function statusElement(input) {
+        let status = input.parentElement.querySelector('.chunked-upload-status');
+        if (!status) {
+            status = document.createElement('div');
+            status.className = 'chunked-upload-status help';
+            input.insertAdjacentElement('afterend', status);
+        }
+        return status;
+    }
+
+    async function uploadFile(input, hidden) {
+        const file = input.files[0];
+        const url = hidden.dataset.uploadUrl;
+        const status = statusElement(input);
+        const key = 'chunked-upload:' + [file.name, file.size, file.lastModified].join(':');
+        let uploadId = localStorage.getItem(key);
+        let offset = 0;
+
+        hidden.value = '';
+        if (uploadId) {
+            const response = await fetch(url + '?' + new URLSearchParams({upload_id: uploadId}));
+            if (response.ok) {
+                offset = (await response.json()).offset;
+            } else {
+                uploadId = null;
+            }
+        }
+
+        while (offset < file.size) {
+            const params = new URLSearchParams({offset: offset, size: file.size, filename: file.name});
+            if (uploadId) {
+                params.set('upload_id', uploadId);
+            }
+            let response;
+            try {
+                response = await fetch(url + '?' + params, {
+                    method: 'POST',
+                    headers: {'X-CSRFToken': csrfToken(), 'Content-Type': 'application/octet-stream'},
+                    body: file.slice(offset, offset + CHUNK_SIZE)
+                });
+            } catch (error) {
+                status.textContent = 'Connection lost, retrying…';
+                await sleep(RETRY_DELAY);
+                continue;
+            }
+            const data = await response.json();
+            if (!response.ok && response.status !== 409) {
+                localStorage.removeItem(key);
+                input.value = '';
+                status.textContent = data.error || 'Upload failed.';
+                return;
+            }
+            uploadId = data.upload_id;
+            offset = data.offset;
+            localStorage.setItem(key, uploadId);
+            status.textContent = 'Uploading… ' + Math.floor(offset * 100 / file.size) + '%';
+        }
+
+        localStorage.removeItem(key);
+        hidden.value = uploadId;
+        input.value = '';
+        status.textContent = file.name + ' uploaded. Save to add it.';
+    }
+
+    document.addEventListener('change', function (event) {
+        const input = event.target;
+        if (!input.matches('input[type=file]') || !input.files.length || !input.form) {
+            return;
+        }
+        const hidden = input.form.elements[input.name.replace(/image$/, 'chunked_upload')];
+        if (hidden && hidden !== input && hidden.dataset.uploadUrl) {
+            uploadFile(input, hidden);
+        }
+    });
+})();
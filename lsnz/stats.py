@@ -0,0 +1,142 @@
+from collections import defaultdict
+
+from django.db.models import Count, IntegerField, Max, Min, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .jobs import job
+from .models import ArchivedEntry, Event, Pass, Player, PlayerStats, Post, Registration
+
+STAT_FIELDS = [
+    'tournaments_entered',
+    'events_played',
+    'sites_visited',
+    'series_played',
+    'passes_bought',
+    'last_pass_end',
+    'post_count',
+    'first_played',
+    'last_played',
+    'updated_at',
+]
+
+
+def refresh_player_stats(player_ids):
+    """
+    Recalculate the ``PlayerStats`` rows for ``player_ids``.
+
+    A handful of grouped queries cover any number of players, and the rows
+    are written with a single upsert. Tournaments that have been archived
+    count through their ``ArchivedEntry`` rows. Players that no longer exist
+    are skipped.
+    """
+    player_ids = list(Player.objects.filter(pk__in=list(player_ids)).values_list('pk', flat=True))
+    if not player_ids:
+        return
+
+    stats = {
+        player_id: PlayerStats(player_id=player_id, updated_at=timezone.now())
+        for player_id in player_ids
+    }
+
+    registrations = (
+        Registration.objects.filter(player__in=player_ids)
+        .values('player')
+        .annotate(
+            tournaments=Count('event__tournament', distinct=True),
+            events=Count('event', distinct=True),
+            first=Min('event__tournament__start_date'),
+            last=Max('event__tournament__end_date'),
+        )
+    )
+    # A tournament is either live or archived, so the two sets of totals add up
+    archived = (
+        ArchivedEntry.objects.filter(player__in=player_ids)
+        .values('player')
+        .annotate(
+            tournaments=Count('archive'),
+            events=Sum('events_played'),
+            first=Min('archive__tournament__start_date'),
+            last=Max('archive__tournament__end_date'),
+        )
+    )
+    for rows in (registrations, archived):
+        for row in rows:
+            row_stats = stats[row['player']]
+            row_stats.tournaments_entered += row['tournaments']
+            row_stats.events_played += row['events']
+            row_stats.first_played = min(filter(None, [row_stats.first_played, row['first']]), default=None)
+            row_stats.last_played = max(filter(None, [row_stats.last_played, row['last']]), default=None)
+
+    # Sites and series can be shared between live and archived tournaments
+    places = (
+        Registration.objects.filter(player__in=player_ids)
+        .values_list('player', 'event__tournament__site', 'event__tournament__series')
+        .union(
+            ArchivedEntry.objects.filter(player__in=player_ids)
+            .values_list('player', 'archive__tournament__site', 'archive__tournament__series')
+        )
+    )
+    sites = defaultdict(set)
+    series = defaultdict(set)
+    for player_id, site_id, series_id in places:
+        sites[player_id].add(site_id)
+        if series_id is not None:
+            series[player_id].add(series_id)
+    for player_id, row_stats in stats.items():
+        row_stats.sites_visited = len(sites[player_id])
+        row_stats.series_played = len(series[player_id])
+
+    passes = (
+        Pass.objects.filter(player__in=player_ids, refunded_at__isnull=True)
+        .values('player')
+        .annotate(count=Count('id'), last_end=Max('end_date'))
+    )
+    for row in passes:
+        stats[row['player']].passes_bought = row['count']
+        stats[row['player']].last_pass_end = row['last_end']
+
+    posts = Post.objects.filter(author__in=player_ids).values('author').annotate(count=Count('id'))
+    for row in posts:
+        stats[row['author']].post_count = row['count']
+
+    PlayerStats.objects.bulk_create(
+        stats.values(),
+        update_conflicts=True,
+        unique_fields=['player'],
+        update_fields=STAT_FIELDS,
+    )
+
+
+def refresh_event_counts(event_ids):
+    """Recount registrations and paid registrations for ``event_ids`` in one query."""
+    counts = (
+        Registration.objects.filter(event=OuterRef('pk'))
+        .order_by()
+        .values('event')
+    )
+    Event.objects.filter(pk__in=list(event_ids)).update(
+        registration_count=Coalesce(
+            Subquery(counts.annotate(n=Count('pk')).values('n'), output_field=IntegerField()), 0
+        ),
+        paid_count=Coalesce(
+            Subquery(counts.annotate(n=Count('pk', filter=Q(paid=True))).values('n'), output_field=IntegerField()), 0
+        ),
+        updated_at=timezone.now(),
+    )
+
+
+@job(priority=-5)
+def rebuild_all_player_stats(batch_size=500):
+    """Recalculate every player's statistics, ``batch_size`` players at a time."""
+    player_ids = Player.objects.order_by('pk').values_list('pk', flat=True)
+    batch = []
+    total = 0
+    for player_id in player_ids.iterator(chunk_size=batch_size):
+        batch.append(player_id)
+        if len(batch) == batch_size:
+            refresh_player_stats(batch)
+            total += len(batch)
+            batch = []
+    refresh_player_stats(batch)
+    return total + len(batch)
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+BLOB_DIR = 'blobs'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Store each distinct upload once, named after the SHA-256 of its contents.
+
+    ``post_images/photo.jpg`` is saved as ``blobs/3f/3f9a...e1.jpg`` and a
+    second upload of the same bytes reuses that file. Since a name always
+    refers to the same content, blob URLs can be served with far-future
+    ``Cache-Control: immutable`` headers.
+
+    A blob may be shared by several rows, so ``delete()`` leaves blobs alone;
+    ``manage.py collect_media_garbage`` removes the ones nothing refers to.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The final name depends on the content, which isn't known yet
+        return name
+
+    def blob_name(self, digest, name):
+        extension = os.path.splitext(name)[1].lower()
+        return f'{BLOB_DIR}/{digest[:2]}/{digest}{extension}'
+
+    def _save(self, name, content):
+        directory = self.path(BLOB_DIR)
+        os.makedirs(directory, exist_ok=True)
+
+        # Hash while copying to a temporary file, so the upload is only read once
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+
+            name = self.blob_name(digest.hexdigest(), name)
+            full_path = self.path(name)
+            try:
+                # Reusing the blob counts as writing it, so the collector's grace period covers it
+                os.utime(full_path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.chmod(temp_path, self.file_permissions_mode or 0o644)
+                os.replace(temp_path, full_path)
+            else:
+                os.remove(temp_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+    def delete(self, name):
+        if not name.startswith(f'{BLOB_DIR}/'):
+            super().delete(name)
+
+    def purge(self, name):
+        """Really delete a blob. Only the garbage collector should call this."""
+        super().delete(name)
+
+
+# Maze map tiles need predictable paths for the viewer's URL template, so
+# they bypass content addressing.
+tile_storage = FileSystemStorage()
@@ -1,5 +1,115 @@
+import asyncio
+import gc
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import skipUnless
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.core.files.storage import default_storage
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+from .analytics import player_matchups, rebuild_season_analytics
+from .archive import archivable_tournaments, archive_tournament, restore_tournament
+from .export import EXPORTS, export_all
+from .forms import EventRegistrationForm, MazeMapAdminForm, TournamentRegistrationForm
+from .geo import SiteIndex, haversine_km
+from .grading import apply_grade_changes, suggest_grade_changes
+from .homepage import BLOCKS
+from .importers import PassImporter, PlayerImporter, RegistrationImporter
+from .jobs import claim_jobs, job, run_pending_jobs, schedule_periodic_jobs
+from .live import ScoreboardFeed, game_standings
+from .mail import announce_tournament, deliver_queued_email, send_queued_email
+from .metrics import registry
+from .profiling import flame_rows, load_profile, make_token, profile_names
+from .query_plans import plan_problems, query_plans, replay, replay_requests, seed
+from .models import (
+    ChunkedUpload,
+    Event,
+    Format,
+    Game,
+    GameResult,
+    Grade,
+    Job,
+    Matchup,
+    MazeMap,
+    Pass,
+    PassSalesDay,
+    Player,
+    PlayerStats,
+    Post,
+    QueuedEmail,
+    Registration,
+    Settings,
+    Site,
+    System,
+    Team,
+    Tournament,
+    TournamentArchive,
+)
+from .sales import active_passes, rebuild_pass_sales, sales_totals
+from .schedule import overlaps, tournament_clashes
+from .slugs import allocate_slugs
+from .startup import package_totals, parse_importtime, run_boot, warm_up
+from .storage import tile_storage
+from .tiles import build_tiles
+
+
+def make_tournament(name="Nationals", start=None, events=1):
+    """Create a tournament with ``events`` events and the rows they depend on."""
+    start = start or timezone.now() + timedelta(days=7)
+    system, _ = System.objects.get_or_create(name="Zone", defaults={"image": "", "description": ""})
+    site, _ = Site.objects.get_or_create(name="Arena", defaults={"country": "NZ", "address": "1 Main St", "system": system})
+    fmt, _ = Format.objects.get_or_create(name="Solos")
+    settings, _ = Settings.objects.get_or_create(name="Standard")
+    tournament = Tournament.objects.create(
+        name=name, site=site, system=system, start_date=start.date(), end_date=start.date()
+    )
+    for i in range(events):
+        Event.objects.create(
+            tournament=tournament, format=fmt, settings=settings,
+            start_time=start + timedelta(hours=i), end_time=start + timedelta(hours=i, minutes=45),
+        )
+    return tournament
+
+
+def make_image(size=(600, 300), name="map.png", format="PNG"):
+    buffer = BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(buffer, format=format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f"image/{format.lower()}")
+
+
+class MediaTestCase(TestCase):
+    """Test case that stores uploaded files in a throwaway MEDIA_ROOT."""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media_root, CHUNKED_UPLOAD_DIR=f"{media_root}/partial")
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
 
 
 class UsersManagersTests(TestCase):
@@ -42,3 +152,1241 @@ class UsersManagersTests(TestCase):
             User.objects.create_superuser(
                 email="super@user.com", password="foo", is_superuser=False
             )
+
+
+class CsvImportTests(TestCase):
+    def csv(self, text):
+        return SimpleUploadedFile("import.csv", text.encode("utf-8"), content_type="text/csv")
+
+    def test_dry_run_saves_nothing(self):
+        result = PlayerImporter(self.csv(
+            "email,alias,first_name,last_name\n"
+            "a@example.com,Ace,Amy,Smith\n"
+            "b@example.com,Blaze,Ben,Jones\n"
+        )).run(dry_run=True)
+        self.assertTrue(result.ok)
+        self.assertEqual(result.created, 2)
+        self.assertEqual(len(result.preview), 2)
+        self.assertFalse(Player.objects.exists())
+
+    def test_import_players_with_clashing_slugs(self):
+        Player.objects.create_user(email="old@example.com", password="foo", alias="ace!")
+        result = PlayerImporter(self.csv(
+            "email,alias\n"
+            "a@example.com,Ace?\n"
+            "b@example.com,ACE.\n"
+        )).run(dry_run=False)
+        self.assertTrue(result.ok, result.errors)
+        self.assertEqual(
+            sorted(Player.objects.values_list("slug", flat=True)),
+            ["ace", "ace-2", "ace-3"],
+        )
+        self.assertFalse(Player.objects.get(email="a@example.com").has_usable_password())
+
+    def test_any_error_rolls_back_whole_file(self):
+        Player.objects.create_user(email="a@example.com", password="foo", alias="Ace")
+        result = PassImporter(self.csv(
+            "email,pass_type,start_date,end_date,price_paid\n"
+            "A@example.com,monthly,2025-01-01,2025-01-31,20.00\n"
+            "nobody@example.com,monthly,2025-01-01,2025-01-31,20.00\n"
+            "a@example.com,weekly,2025-01-01,2025-01-31,20.00\n"
+        )).run(dry_run=False)
+        self.assertFalse(result.ok)
+        self.assertEqual([line for line, _ in result.errors], [3, 4])
+        self.assertEqual(result.created, 0)
+        self.assertFalse(Pass.objects.exists())
+
+    def test_unreadable_files_name_the_line(self):
+        upload = SimpleUploadedFile("import.csv", "email,alias\na@example.com,Ace\nb@example.com,Zoë\n".encode("latin-1"))
+        with self.assertRaisesMessage(ValidationError, "Line 3 is not valid UTF-8 text."):
+            PlayerImporter(upload).run()
+
+        with self.assertRaisesMessage(ValidationError, "Line 2 is not valid CSV"):
+            PlayerImporter(self.csv(f"email,alias\na@example.com,{'x' * 200_000}\n")).run()
+
+    def test_admin_import_page(self):
+        admin_user = Player.objects.create_superuser(email="admin@example.com", password="foo", alias="Admin")
+        self.client.force_login(admin_user)
+        url = reverse("admin:lsnz_player_import")
+        response = self.client.post(url, {
+            "csv_file": self.csv("email,alias\nc@example.com,Comet\n"),
+            "dry_run": "on",
+        })
+        self.assertContains(response, "1 would be created")
+        self.assertFalse(Player.objects.filter(alias="Comet").exists())
+
+        response = self.client.post(url, {"csv_file": self.csv("email,alias\nc@example.com,Comet\n")})
+        self.assertRedirects(response, reverse("admin:lsnz_player_changelist"))
+        self.assertTrue(Player.objects.filter(alias="Comet").exists())
+
+
+class SlugAllocationTests(TestCase):
+    def test_save_picks_next_free_slug(self):
+        Format.objects.create(name="Solos")
+        Format.objects.create(name="Solos")
+        with self.assertNumQueries(2):
+            fmt = Format.objects.create(name="Solos")
+        self.assertEqual(fmt.slug, "solos-3")
+
+    def test_resave_keeps_slug(self):
+        fmt = Format.objects.create(name="Solos")
+        fmt.name = "Teams"
+        with self.assertNumQueries(1):
+            fmt.save()
+        self.assertEqual(fmt.slug, "solos")
+
+    def test_allocate_batch_in_one_query(self):
+        Format.objects.create(name="Triples")
+        formats = [Format(name=name) for name in ["Triples", "Triples", "Doubles", "Triples!"]]
+        with self.assertNumQueries(1):
+            allocate_slugs(formats)
+        self.assertEqual(
+            [fmt.slug for fmt in formats],
+            ["triples-2", "triples-3", "doubles", "triples-4"],
+        )
+        with self.assertNumQueries(1):
+            Format.objects.bulk_create(formats)
+
+
+class CachedAuthTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.grade = Grade.objects.create(letter="A", points=5, description="Top")
+        self.player = Player.objects.create_user(
+            email="a@example.com", password="foo", alias="Ace", grade=self.grade
+        )
+        self.client.force_login(self.player)
+
+    def test_logged_in_page_view_does_no_queries(self):
+        self.client.get(reverse("lsnz:about"))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("lsnz:about"))
+        self.assertEqual(response.wsgi_request.user.grade.letter, "A")
+
+    def test_cached_player_is_refreshed_after_changes(self):
+        self.client.get(reverse("lsnz:about"))
+        self.player.alias = "Ace2"
+        self.player.save()
+        response = self.client.get(reverse("lsnz:about"))
+        self.assertEqual(response.wsgi_request.user.alias, "Ace2")
+
+        self.grade.letter = "A+"
+        self.grade.save()
+        response = self.client.get(reverse("lsnz:about"))
+        self.assertEqual(response.wsgi_request.user.grade.letter, "A+")
+
+    def test_password_change_logs_out_other_sessions(self):
+        self.client.get(reverse("lsnz:about"))
+        self.player.set_password("bar")
+        self.player.save()
+        response = self.client.get(reverse("lsnz:about"))
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+
+
+@override_settings(JINJA2_TEMPLATES=["lsnz/players.html", "lsnz/posts.html", "lsnz/tournaments.html"])
+class Jinja2TemplateTests(TestCase):
+    def setUp(self):
+        grade = Grade.objects.create(letter="B", points=3, description="Mid")
+        self.player = Player.objects.create_user(
+            email="a@example.com", password="foo", alias="Ace", grade=grade
+        )
+        Post.objects.create(title="Hello", summary="First post", body="Body", image="", author=self.player)
+
+    def test_players(self):
+        response = self.client.get(reverse("lsnz:players"))
+        self.assertContains(response, '<a href="/players/ace">Ace</a>')
+        self.assertContains(response, 'data-points="3"')
+
+    def test_posts(self):
+        self.client.force_login(self.player)
+        response = self.client.get(reverse("lsnz:blog"))
+        self.assertContains(response, "By Ace on")
+        self.assertContains(response, 'href="/blog/hello"')
+        self.assertContains(response, 'href="/players/ace">Profile</a>')
+
+    def test_tournaments(self):
+        response = self.client.get(reverse("lsnz:tournaments"))
+        self.assertContains(response, 'id="tournamentsTable"')
+
+
+class PlayerStatsTests(TestCase):
+    def setUp(self):
+        self.player = Player.objects.create_user(email="a@example.com", password="foo", alias="Ace")
+
+    def test_stats_follow_registrations(self):
+        tournament = make_tournament(events=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            for event in tournament.events.all():
+                Registration.objects.create(event=event, player=self.player)
+        stats = PlayerStats.objects.get(player=self.player)
+        self.assertEqual(stats.tournaments_entered, 1)
+        self.assertEqual(stats.events_played, 2)
+        self.assertEqual(stats.sites_visited, 1)
+        self.assertEqual(stats.first_played, tournament.start_date)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Registration.objects.filter(player=self.player).first().delete()
+        self.assertEqual(PlayerStats.objects.get(player=self.player).events_played, 1)
+
+    def test_import_refreshes_stats(self):
+        event = make_tournament().events.get()
+        csv_file = SimpleUploadedFile("r.csv", f"email,event\na@example.com,{event.pk}\n".encode())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(RegistrationImporter(csv_file).run(dry_run=False).ok)
+        self.assertEqual(PlayerStats.objects.get(player=self.player).events_played, 1)
+
+    def test_profile_paginates_posts(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(15):
+                Post.objects.create(title=f"Post {i}", summary="", body="", image="", author=self.player)
+        url = reverse("lsnz:player_detail", kwargs={"slug": self.player.slug})
+        # The first view queues the season's rivals and partners to be built
+        self.client.get(url)
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context["posts"]), 12)
+        response = self.client.get(url, {"page": 2})
+        self.assertEqual(len(response.context["posts"]), 3)
+
+    def test_profile_counts_posts_without_a_stats_row(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(15):
+                Post.objects.create(title=f"Post {i}", summary="", body="", image="", author=self.player)
+        PlayerStats.objects.filter(player=self.player).delete()
+        response = self.client.get(reverse("lsnz:player_detail", kwargs={"slug": self.player.slug}), {"page": 2})
+        self.assertEqual(response.context["page_obj"].paginator.count, 15)
+        self.assertEqual(len(response.context["posts"]), 3)
+
+
+class EventCountTests(TestCase):
+    def setUp(self):
+        self.tournament = make_tournament(events=3)
+        self.players = [
+            Player.objects.create_user(email=f"p{i}@example.com", password="foo", alias=f"P{i}")
+            for i in range(3)
+        ]
+
+    def test_counts_follow_registrations(self):
+        first, second, _ = self.tournament.events.order_by("start_time")
+        registration = Registration.objects.create(event=first, player=self.players[0])
+        Registration.objects.create(event=first, player=self.players[1], paid=True)
+        first.refresh_from_db()
+        self.assertEqual((first.registration_count, first.paid_count), (2, 1))
+
+        registration = Registration.objects.get(pk=registration.pk)
+        registration.paid = True
+        registration.event = second
+        registration.save()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.registration_count, first.paid_count), (1, 1))
+        self.assertEqual((second.registration_count, second.paid_count), (1, 1))
+
+        Registration.objects.all().delete()
+        first.refresh_from_db()
+        self.assertEqual((first.registration_count, first.paid_count), (0, 0))
+
+    def test_tournament_page_query_count(self):
+        for event in self.tournament.events.all():
+            for player in self.players:
+                Registration.objects.create(event=event, player=player)
+        url = reverse("lsnz:tournament_detail", kwargs={"slug": self.tournament.slug})
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertContains(response, "3 registered", count=3)
+
+
+class MazeTileTests(MediaTestCase):
+    def test_build_tiles(self):
+        site = make_tournament().site
+        maze_map = MazeMap.objects.create(site=site, image=make_image((600, 300)))
+        self.assertFalse(maze_map.tiles_ready)
+
+        build_tiles(maze_map)
+        maze_map.refresh_from_db()
+        self.assertEqual((maze_map.width, maze_map.height, maze_map.max_zoom), (600, 300, 2))
+        # 600x300 is 3x2 tiles at full size, 2x1 at half size and 1x1 at zoom 0
+        for zoom, columns, rows in [(2, 3, 2), (1, 2, 1), (0, 1, 1)]:
+            _, files = tile_storage.listdir(f"maze_tiles/{maze_map.pk}/{zoom}/0")
+            self.assertEqual(len(files), rows)
+            directories, _ = tile_storage.listdir(f"maze_tiles/{maze_map.pk}/{zoom}")
+            self.assertEqual(len(directories), columns)
+        with tile_storage.open(f"maze_tiles/{maze_map.pk}/2/2/1.jpg") as f, Image.open(f) as tile:
+            self.assertEqual(tile.size, (256, 256))
+        self.assertLessEqual(max(Image.open(maze_map.preview).size), 480)
+
+        response = self.client.get(reverse("lsnz:site_detail", kwargs={"slug": site.slug}))
+        self.assertContains(response, f'data-tiles="/media/maze_tiles/{maze_map.pk}/{{z}}/{{x}}/{{y}}.jpg"')
+        self.assertContains(response, 'data-zoom="2"')
+
+
+class ContentAddressedStorageTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.player = Player.objects.create_user(email="a@example.com", password="foo", alias="Ace")
+
+    def test_identical_uploads_share_a_blob(self):
+        first = Post.objects.create(title="One", summary="", body="", image=make_image(name="a.PNG"), author=self.player)
+        second = Post.objects.create(title="Two", summary="", body="", image=make_image(name="b.png"), author=self.player)
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r"^blobs/[0-9a-f]{2}/[0-9a-f]{64}\.png$")
+
+        # Deleting through the field leaves the shared blob in place
+        first.image.delete(save=False)
+        self.assertTrue(default_storage.exists(second.image.name))
+
+    def test_garbage_collection(self):
+        post = Post.objects.create(title="One", summary="", body="", image=make_image((10, 10)), author=self.player)
+        old_name = post.image.name
+        post.image = make_image((20, 20))
+        post.save()
+
+        call_command("collect_media_garbage", grace_hours=0, stdout=StringIO())
+        self.assertFalse(default_storage.exists(old_name))
+        self.assertTrue(default_storage.exists(post.image.name))
+
+    def test_reused_blob_is_within_the_grace_period(self):
+        name = default_storage.save("post_images/a.png", make_image())
+        path = default_storage.path(name)
+        week_ago = time.time() - 7 * 24 * 3600
+        os.utime(path, (week_ago, week_ago))
+
+        # An upload of the same bytes whose row is not saved yet
+        self.assertEqual(default_storage.save("post_images/b.png", make_image()), name)
+        call_command("collect_media_garbage", grace_hours=24, stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+
+
+class UploadValidationTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.player = Player.objects.create_user(email="a@example.com", password="foo", alias="Ace")
+        self.client.force_login(self.player)
+
+    def write_post(self, upload):
+        return self.client.post(reverse("lsnz:write_post"), {
+            "title": "Hello", "summary": "Hi", "body": "Body", "image": upload,
+        })
+
+    def test_non_image_is_refused(self):
+        response = self.write_post(SimpleUploadedFile("evil.png", b"MZ not really a png", content_type="image/png"))
+        self.assertFormError(response.context["form"], "image", "File must be a PNG, JPEG, GIF or WebP image.")
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(IMAGE_UPLOAD_LIMITS=[("image", 1024)])
+    def test_oversized_image_is_refused(self):
+        response = self.write_post(make_image((400, 400), format="BMP"))
+        self.assertFormError(response.context["form"], "image", "Image file size must be less than 1.0\xa0KB.")
+
+    def test_admin_forms_report_the_refusal(self):
+        self.client.force_login(Player.objects.create_superuser(email="admin@example.com", password="x", alias="Admin"))
+        response = self.client.post(reverse("admin:lsnz_system_add"), {
+            "name": "Zone", "description": "Laser tag",
+            "image": SimpleUploadedFile("evil.png", b"MZ not really a png", content_type="image/png"),
+        })
+        self.assertFormError(response.context["adminform"].form, "image", "File must be a PNG, JPEG, GIF or WebP image.")
+
+    def test_valid_image_is_accepted(self):
+        response = self.write_post(make_image())
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Post.objects.exists())
+
+
+class ChunkedUploadTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = Player.objects.create_superuser(email="admin@example.com", password="foo", alias="Admin")
+        self.client.force_login(self.admin)
+        self.url = reverse("admin:lsnz_site_chunked_upload")
+        buffer = BytesIO()
+        Image.new("RGB", (300, 300)).save(buffer, format="PNG")
+        self.data = buffer.getvalue()
+
+    def send(self, offset, chunk, **params):
+        query = {"offset": offset, "size": len(self.data), "filename": "maze.png", **params}
+        return self.client.post(
+            f"{self.url}?{'&'.join(f'{k}={v}' for k, v in query.items())}",
+            chunk, content_type="application/octet-stream",
+        )
+
+    def test_resumable_upload(self):
+        half = len(self.data) // 2
+        response = self.send(0, self.data[:half])
+        upload_id = response.json()["upload_id"]
+        self.assertEqual(response.json()["offset"], half)
+
+        # A repeated chunk is refused and the client told where to carry on
+        response = self.send(0, self.data[:half], upload_id=upload_id)
+        self.assertEqual(response.status_code, 409)
+        response = self.client.get(self.url, {"upload_id": upload_id})
+        self.assertEqual(response.json()["offset"], half)
+
+        self.send(half, self.data[half:], upload_id=upload_id)
+        site = make_tournament().site
+        form = MazeMapAdminForm({"chunked_upload": upload_id, "date": "2025-01-01"}, user=self.admin)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.instance.site = site
+        maze_map = form.save()
+        with maze_map.image.open("rb") as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+    def test_site_admin_renders_chunked_field(self):
+        response = self.client.get(reverse("admin:lsnz_site_add"))
+        self.assertContains(response, f'data-upload-url="{self.url}"')
+        self.assertContains(response, "lsnz/chunked_upload.js")
+
+    def test_non_image_is_refused(self):
+        response = self.send(0, b"not an image")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+
+@override_settings(
+    EMAIL_BACKEND="lsnz.mail.QueuedEmailBackend",
+    QUEUED_EMAIL_DELIVERY_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+)
+class QueuedEmailTests(TestCase):
+    def test_messages_are_queued_then_delivered(self):
+        message = mail.EmailMultiAlternatives("Hello", "Plain", "from@example.com", ["to@example.com"])
+        message.attach_alternative("<p>Hello</p>", "text/html")
+        message.send()
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(QueuedEmail.objects.get().status, QueuedEmail.QUEUED)
+
+        self.assertEqual(deliver_queued_email(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["to@example.com"])
+        self.assertEqual(mail.outbox[0].alternatives[0][0], "<p>Hello</p>")
+        self.assertEqual(QueuedEmail.objects.get().status, QueuedEmail.SENT)
+        self.assertEqual(deliver_queued_email(), 0)
+
+    def test_sending_reuses_the_waiting_delivery_job(self):
+        send_queued_email.enqueue(run_at=timezone.now() + timedelta(minutes=1))
+        mail.send_mail("One", "Body", "from@example.com", ["a@example.com"])
+        mail.send_mail("Two", "Body", "from@example.com", ["b@example.com"])
+        job = Job.objects.get(name="lsnz.mail.send_queued_email")
+        self.assertLessEqual(job.run_at, timezone.now())
+
+    def test_failed_delivery_is_retried_later(self):
+        mail.send_mail("Hello", "Body", "from@example.com", ["to@example.com"])
+        with override_settings(QUEUED_EMAIL_DELIVERY_BACKEND="lsnz.tests.FailingEmailBackend"):
+            self.assertEqual(deliver_queued_email(), 0)
+        email = QueuedEmail.objects.get()
+        self.assertEqual(email.attempts, 1)
+        self.assertIn("SMTP down", email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        # Not due yet
+        self.assertEqual(deliver_queued_email(), 0)
+
+        QueuedEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_queued_email(), 1)
+        self.assertEqual(QueuedEmail.objects.get().attempts, 2)
+
+    def test_failed_send_reconnects_once_for_the_rest_of_the_batch(self):
+        for subject in ["Fail", "One", "Two", "Three"]:
+            mail.send_mail(subject, "Body", "from@example.com", ["to@example.com"])
+        FlakyEmailBackend.connections_opened = 0
+        with override_settings(QUEUED_EMAIL_DELIVERY_BACKEND="lsnz.tests.FlakyEmailBackend"):
+            self.assertEqual(deliver_queued_email(), 3)
+        self.assertEqual(FlakyEmailBackend.connections_opened, 2)
+
+    def test_announce_tournament_queues_one_email_per_player(self):
+        tournament = make_tournament()
+        for i in range(3):
+            Player.objects.create_user(email=f"p{i}@example.com", alias=f"P{i}", password="x")
+        Player.objects.create_user(email="gone@example.com", alias="Gone", password="x", is_active=False)
+
+        self.assertEqual(announce_tournament(tournament, "https://example.com/t"), 3)
+        emails = QueuedEmail.objects.order_by("pk")
+        self.assertEqual([email.recipients for email in emails], [f"p{i}@example.com" for i in range(3)])
+        self.assertEqual(emails[0].subject, "Nationals at Arena")
+        self.assertIn("https://example.com/t", emails[0].message["body"])
+
+    def test_admin_announce_action_queues_a_job(self):
+        tournament = make_tournament()
+        self.client.force_login(Player.objects.create_superuser(email="admin@example.com", password="x", alias="Admin"))
+        response = self.client.post(reverse("admin:lsnz_tournament_changelist"), {
+            "action": "announce", "_selected_action": [tournament.pk],
+        })
+        self.assertRedirects(response, reverse("admin:lsnz_tournament_changelist"))
+        job = Job.objects.get(name="lsnz.mail.announce_tournaments")
+        self.assertEqual(job.args, [[[tournament.pk, f"http://testserver/tournaments/{tournament.slug}"]]])
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionError("SMTP down")
+
+
+class FlakyEmailBackend(BaseEmailBackend):
+    """Opens and closes around each send like the SMTP backend, and refuses subjects starting "Fail"."""
+    connections_opened = 0
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.connection = None
+
+    def open(self):
+        if self.connection:
+            return False
+        self.connection = True
+        FlakyEmailBackend.connections_opened += 1
+        return True
+
+    def close(self):
+        self.connection = None
+
+    def send_messages(self, email_messages):
+        new_connection = self.open()
+        try:
+            if any(message.subject.startswith("Fail") for message in email_messages):
+                raise ConnectionError("Connection dropped")
+            mail.outbox.extend(email_messages)
+            return len(email_messages)
+        finally:
+            if new_connection:
+                self.close()
+
+
+job_calls = []
+
+
+@job(max_attempts=2)
+def record_call(value, fail=False):
+    job_calls.append(value)
+    if fail:
+        raise ValueError("Failed on purpose")
+
+
+@job(every=timedelta(hours=1))
+def hourly_job():
+    job_calls.append("hourly")
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        job_calls.clear()
+
+    def test_jobs_run_by_priority_once_due(self):
+        record_call.enqueue("low")
+        record_call.enqueue("high", priority=5)
+        record_call.enqueue("later", run_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(run_pending_jobs(), 2)
+        self.assertEqual(job_calls, ["high", "low"])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 2)
+        self.assertIsNotNone(Job.objects.filter(status=Job.DONE).first().duration)
+
+    def test_claimed_jobs_are_not_claimed_again(self):
+        record_call.enqueue("once")
+        self.assertEqual(len(claim_jobs(5, "worker-1")), 1)
+        self.assertEqual(claim_jobs(5, "worker-2"), [])
+        # Until the lease runs out
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual([job.attempts for job in claim_jobs(5, "worker-2")], [2])
+
+    def test_failed_jobs_are_retried_then_given_up(self):
+        record_call.enqueue("boom", fail=True)
+        run_pending_jobs()
+        queued = Job.objects.get()
+        self.assertEqual(queued.status, Job.QUEUED)
+        self.assertIn("Failed on purpose", queued.last_error)
+        self.assertGreater(queued.run_at, timezone.now())
+
+        Job.objects.update(run_at=timezone.now())
+        run_pending_jobs()
+        self.assertEqual(Job.objects.get().status, Job.FAILED)
+        self.assertEqual(job_calls, ["boom", "boom"])
+
+    def test_periodic_jobs_reschedule_themselves(self):
+        schedule_periodic_jobs()
+        schedule_periodic_jobs()
+        self.assertEqual(Job.objects.filter(name=hourly_job.name).count(), 1)
+        call_command("run_jobs", processes=0, once=True)
+        self.assertEqual(job_calls, ["hourly"])
+        next_run = Job.objects.get(name=hourly_job.name, status=Job.QUEUED)
+        self.assertGreater(next_run.run_at, timezone.now() + timedelta(minutes=59))
+
+    def test_admin_shows_queue_depth(self):
+        record_call.enqueue("waiting")
+        admin = Player.objects.create_superuser(email="admin@example.com", password="x", alias="Admin")
+        self.client.force_login(admin)
+        response = self.client.get(reverse("admin:lsnz_job_changelist"))
+        self.assertContains(response, record_call.name)
+
+
+class LiveScoreboardTests(TestCase):
+    def setUp(self):
+        self.tournament = make_tournament(start=timezone.now())
+        self.game = Game.objects.create(event=self.tournament.events.get(), number=1)
+        self.player = Player.objects.create_user(email="ace@example.com", alias="Ace", password="x")
+        GameResult.objects.create(game=self.game, player=self.player, score=1200)
+
+    def test_stream_sends_snapshot_and_reconnect_delay_under_wsgi(self):
+        response = self.client.get(reverse("lsnz:tournament_scoreboard_stream", args=[self.tournament.slug]))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = response.content.decode()
+        self.assertIn("retry: 10000", body)
+        self.assertIn("event: scoreboard", body)
+        data = json.loads(body.split("data: ", 1)[1])
+        self.assertIn("Ace", data["html"])
+        self.assertIn("1200", data["html"])
+
+    def test_player_who_changed_teams_is_ranked_once(self):
+        event = self.game.event
+        red, blue = Team.objects.create(name="Red", event=event), Team.objects.create(name="Blue", event=event)
+        GameResult.objects.filter(game=self.game).update(team=red)
+        second = Game.objects.create(event=event, number=2, played_at=self.game.played_at + timedelta(minutes=20))
+        GameResult.objects.create(game=second, player=self.player, team=blue, score=800)
+
+        rows = game_standings(self.tournament.pk)[event.pk]
+        self.assertEqual([(row["player__alias"], row["team__name"], row["games"], row["total"]) for row in rows], [
+            ("Ace", "Blue", 2, 2000),
+        ])
+
+    def add_result(self, alias, score):
+        player = Player.objects.create_user(email=f"{alias}@example.com", alias=alias, password="x")
+        with self.captureOnCommitCallbacks(execute=True):
+            GameResult.objects.create(game=self.game, player=player, score=score)
+
+    async def test_one_feed_fans_out_each_change(self):
+        feed = ScoreboardFeed.get(self.tournament.pk)
+        first, second = feed.subscribe(), feed.subscribe()
+        self.assertIs(ScoreboardFeed.get(self.tournament.pk), feed)
+        snapshot = await asyncio.wait_for(first.get(), 5)
+        self.assertEqual(await asyncio.wait_for(second.get(), 5), snapshot)
+        self.assertIn("Ace", snapshot)
+
+        await sync_to_async(self.add_result)("Blaze", 900)
+        snapshot = await asyncio.wait_for(first.get(), 5)
+        self.assertIn("Blaze", snapshot)
+        self.assertEqual(await asyncio.wait_for(second.get(), 5), snapshot)
+
+        feed.unsubscribe(first)
+        feed.unsubscribe(second)
+        self.assertNotIn(self.tournament.pk, ScoreboardFeed.feeds)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.tournament = make_tournament(start=timezone.now() - timedelta(days=800), events=2)
+        self.event, self.other_event = self.tournament.events.order_by("start_time")
+        self.team = Team.objects.create(name="Reds", event=self.event)
+        self.ace = Player.objects.create_user(email="ace@example.com", alias="Ace", password="x")
+        self.blaze = Player.objects.create_user(email="blaze@example.com", alias="Blaze", password="x")
+        with self.captureOnCommitCallbacks(execute=True):
+            Registration.objects.create(event=self.event, player=self.ace, team=self.team, paid=True)
+            Registration.objects.create(event=self.other_event, player=self.ace)
+            Registration.objects.create(event=self.event, player=self.blaze)
+        game = Game.objects.create(event=self.event, number=1)
+        GameResult.objects.create(game=game, player=self.ace, team=self.team, score=900)
+        GameResult.objects.create(game=game, player=self.blaze, score=1200)
+        make_tournament(name="Regionals")
+
+    def test_archive_condenses_rows_and_keeps_stats(self):
+        stats = PlayerStats.objects.get(player=self.ace)
+        self.assertEqual(list(archivable_tournaments()), [self.tournament])
+
+        archive = archive_tournament(self.tournament)
+        self.assertEqual((archive.participant_count, archive.team_count, archive.game_count), (2, 1, 1))
+        self.assertFalse(Registration.objects.exists())
+        self.assertFalse(GameResult.objects.exists())
+        entry = archive.entries.get(player=self.ace)
+        self.assertEqual((entry.events_played, entry.teams, entry.best_placing), (2, "Reds", 2))
+        self.event.refresh_from_db()
+        self.assertEqual((self.event.registration_count, self.event.paid_count), (2, 1))
+        archived_stats = PlayerStats.objects.get(player=self.ace)
+        for field in ("tournaments_entered", "events_played", "sites_visited", "first_played", "last_played"):
+            self.assertEqual(getattr(archived_stats, field), getattr(stats, field))
+
+        response = self.client.get(reverse("lsnz:tournament_detail", args=[self.tournament.slug]))
+        self.assertContains(response, "Results")
+        self.assertContains(response, "1200")
+        self.assertNotContains(response, "Live scoreboard")
+
+    def test_restore_puts_rows_back(self):
+        registration_ids = set(Registration.objects.values_list("pk", flat=True))
+        archive_tournament(self.tournament)
+        restore_tournament(self.tournament)
+
+        self.assertFalse(TournamentArchive.objects.exists())
+        self.assertEqual(set(Registration.objects.values_list("pk", flat=True)), registration_ids)
+        self.assertEqual(Registration.objects.get(player=self.ace, event=self.event).team, self.team)
+        self.assertEqual(GameResult.objects.get(player=self.blaze).score, 1200)
+        self.assertEqual(PlayerStats.objects.get(player=self.ace).events_played, 2)
+
+
+@override_settings(GRADING_MIN_GAMES=3)
+class GradingTests(TestCase):
+    def setUp(self):
+        self.a = Grade.objects.create(letter="A", points=3, percentile=75, description="")
+        self.b = Grade.objects.create(letter="B", points=2, percentile=40, description="")
+        self.c = Grade.objects.create(letter="C", points=1, percentile=0, description="")
+        current = [self.c, None, self.a, self.b, self.a]
+        self.players = [
+            Player.objects.create_user(email=f"p{i}@example.com", alias=f"P{i}", password="x", grade=grade)
+            for i, grade in enumerate(current)
+        ]
+        event = make_tournament().events.get()
+        for number in range(3):
+            game = Game.objects.create(event=event, number=number)
+            GameResult.objects.bulk_create(
+                GameResult(game=game, player=player, score=1000 * i) for i, player in enumerate(self.players)
+            )
+
+    def test_suggestions_follow_percentile_thresholds(self):
+        changes = {change.player.alias: change for change in suggest_grade_changes()}
+        self.assertEqual(sorted(changes), ["P1", "P2", "P3"])
+        self.assertEqual((changes["P1"].direction, changes["P1"].suggested), ("assign", self.c))
+        self.assertEqual((changes["P2"].direction, changes["P2"].suggested), ("demote", self.b))
+        self.assertEqual((changes["P3"].direction, changes["P3"].suggested), ("promote", self.a))
+        self.assertIn("75th percentile over 3 games", changes["P3"].reason)
+
+        admin = Player.objects.create_superuser(email="admin@example.com", password="x", alias="Admin")
+        self.client.force_login(admin)
+        response = self.client.get(reverse("admin:lsnz_player_grading"))
+        self.assertContains(response, f'value="{changes["P3"].player.pk}:{self.a.pk}"')
+
+    def test_inactive_players_count_as_opponents(self):
+        Player.objects.filter(alias="P0").update(is_active=False)
+        # P0 is left out of the ranking, so P1 to P4 spread from 0 to 100
+        changes = {change.player.alias: change for change in suggest_grade_changes()}
+        self.assertEqual(sorted(changes), ["P1", "P2"])
+        self.assertEqual((changes["P1"].percentile, changes["P1"].games), (0, 3))
+        self.assertEqual(changes["P2"].suggested, self.c)
+        self.assertAlmostEqual(changes["P2"].percentile, 100 / 3)
+
+        Player.objects.filter(alias="P0").update(grade=self.a)
+        self.assertNotIn("P0", [change.player.alias for change in suggest_grade_changes()])
+
+    def test_apply_skips_players_changed_since_review(self):
+        changes = suggest_grade_changes()
+        Player.objects.filter(alias="P3").update(grade=self.c)
+        self.assertEqual(apply_grade_changes(changes), 2)
+        grades = dict(Player.objects.values_list("alias", "grade__letter"))
+        self.assertEqual(grades, {"P0": "C", "P1": "C", "P2": "B", "P3": "C", "P4": "A"})
+
+
+class MatchupAnalyticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.event = make_tournament().events.get()
+        self.red = Team.objects.create(name="Red", event=self.event)
+        self.blue = Team.objects.create(name="Blue", event=self.event)
+        self.ace, self.blaze, self.comet = (
+            Player.objects.create_user(email=f"{alias}@example.com", alias=alias, password="x")
+            for alias in ["Ace", "Blaze", "Comet"]
+        )
+
+    def play(self, number, *results):
+        game = Game.objects.create(event=self.event, number=number)
+        for player, team, score in results:
+            GameResult.objects.create(game=game, player=player, team=team, score=score)
+        return game
+
+    def test_rows_are_built_then_updated_per_game(self):
+        self.play(1, (self.ace, self.red, 500), (self.blaze, self.red, 300), (self.comet, self.blue, 600))
+        self.assertIsNone(player_matchups(self.ace.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            run_pending_jobs()
+
+        matchups = player_matchups(self.ace.pk)
+        self.assertEqual(
+            [(row["player"].alias, row["wins"], row["losses"], row["ties"]) for row in matchups["rivals"]],
+            [("Comet", 0, 1, 0)],
+        )
+        self.assertEqual(
+            [(row["player"].alias, row["games"], row["wins"]) for row in matchups["partners"]],
+            [("Blaze", 1, 1)],
+        )
+
+        # The matrices live in the database, so nothing depends on the cache keeping them
+        cache.clear()
+        game = self.play(2, (self.ace, None, 900), (self.comet, None, 100))
+        run_pending_jobs()
+        self.assertEqual(player_matchups(self.ace.pk)["rivals"][0]["wins"], 1)
+
+        game.results.filter(player=self.ace).update(score=50)
+        GameResult.objects.get(game=game, player=self.comet).save()
+        run_pending_jobs()
+        rival = player_matchups(self.ace.pk)["rivals"][0]
+        self.assertEqual((rival["wins"], rival["losses"]), (0, 2))
+
+        game.delete()
+        run_pending_jobs()
+        rival = player_matchups(self.ace.pk)["rivals"][0]
+        self.assertEqual((rival["wins"], rival["losses"]), (0, 1))
+
+        season = timezone.localtime().year
+        incremental = sorted(Matchup.objects.values_list("player", "kind", "other", "games", "wins", "losses", "ties"))
+        rebuild_season_analytics(season)
+        self.assertEqual(
+            sorted(Matchup.objects.values_list("player", "kind", "other", "games", "wins", "losses", "ties")), incremental,
+        )
+
+    def test_profile_shows_rivals_and_partners(self):
+        self.play(1, (self.ace, self.red, 500), (self.blaze, self.red, 300), (self.comet, self.blue, 600))
+        self.client.get(reverse("lsnz:player_detail", args=[self.ace.slug]))
+        with self.captureOnCommitCallbacks(execute=True):
+            run_pending_jobs()
+        response = self.client.get(reverse("lsnz:player_detail", args=[self.ace.slug]))
+        self.assertContains(response, "Rivals and partners")
+        self.assertContains(response, "Comet")
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        for i in range(3):
+            make_tournament(name=f"Open {i}", events=2)
+
+    def test_list_with_cursor_fields_and_include(self):
+        url = reverse("lsnz:api_list", args=["events"])
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {"fields": "id,tournament", "include": "tournament,format", "limit": 4})
+        body = response.json()
+        self.assertEqual(len(body["data"]), 4)
+        self.assertEqual(set(body["data"][0]), {"id", "tournament"})
+        self.assertEqual(len(body["included"]["tournaments"]), 2)
+        self.assertEqual(len(body["included"]["formats"]), 1)
+
+        rest = self.client.get(body["links"]["next"]).json()
+        self.assertEqual(len(rest["data"]), 2)
+        self.assertIsNone(rest["links"]["next"])
+        self.assertEqual(set(rest["data"][0]), {"id", "tournament"})
+
+    def test_detail_etag_and_errors(self):
+        tournament = Tournament.objects.first()
+        url = reverse("lsnz:api_detail", args=["tournaments", tournament.slug])
+        response = self.client.get(url, {"include": "site", "fields[sites]": "name"})
+        self.assertEqual(response.json()["included"]["sites"], [{"name": "Arena"}])
+        self.assertIn("private", response["Cache-Control"])
+        cached = self.client.get(url, {"include": "site", "fields[sites]": "name"}, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(cached.status_code, 304)
+
+        self.assertEqual(self.client.get(url, {"fields": "email"}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("lsnz:api_list", args=["events"]), {"tournament": "x"}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("lsnz:api_detail", args=["players", "nobody"])).status_code, 404)
+
+
+class MetricsTests(TestCase):
+    def metric_value(self, text, prefix):
+        return sum(float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(prefix))
+
+    def test_metrics_need_token_or_staff(self):
+        self.assertEqual(self.client.get(reverse("lsnz:metrics")).status_code, 403)
+        with override_settings(METRICS_TOKEN="s3cret"):
+            self.assertEqual(self.client.get(reverse("lsnz:metrics")).status_code, 403)
+            response = self.client.get(reverse("lsnz:metrics"), headers={"authorization": "Bearer s3cret"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_requests_queries_templates_and_cache_are_counted(self):
+        make_tournament()
+        Job.objects.create(name="lsnz.jobs.prune_jobs")
+        cache.get("metrics-test-miss")
+        self.client.get(reverse("lsnz:tournaments"))
+        self.client.get(reverse("lsnz:tournaments"))
+        staff = Player.objects.create_user(email="staff@example.com", alias="Staff", password="x", is_staff=True)
+        self.client.force_login(staff)
+        text = self.client.get(reverse("lsnz:metrics")).content.decode()
+
+        self.assertGreaterEqual(
+            self.metric_value(text, 'lsnz_http_requests_total{view="lsnz:tournaments",method="GET",status="200"}'), 2
+        )
+        self.assertIn('lsnz_http_request_duration_seconds_bucket{view="lsnz:tournaments",le="+Inf"}', text)
+        self.assertGreaterEqual(self.metric_value(text, 'lsnz_db_queries_total{view="lsnz:tournaments"}'), 2)
+        self.assertIn('lsnz_template_render_duration_seconds_count{view="lsnz:tournaments"}', text)
+        self.assertGreaterEqual(self.metric_value(text, "lsnz_cache_requests_total{"), 1)
+        self.assertIn('lsnz_jobs{name="lsnz.jobs.prune_jobs",status="due"} 1', text)
+
+    def test_totals_include_other_processes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        with open(f"{directory}/999999.json", "w") as f:
+            json.dump({"lsnz_http_requests_total": {json.dumps(["other", "GET", "200"]): 5}}, f)
+        with override_settings(METRICS_DIR=directory):
+            registry.flush(force=True)
+            text = "\n".join(registry.collect())
+        self.assertTrue(any(name.endswith(".json") and name != "999999.json" for name in os.listdir(directory)))
+        self.assertIn('lsnz_http_requests_total{view="other",method="GET",status="200"} 5', text)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        profile_settings = override_settings(PROFILE_DIR=directory, PROFILE_MAX_FILES=2)
+        profile_settings.enable()
+        self.addCleanup(profile_settings.disable)
+        self.staff = Player.objects.create_user(email="staff@example.com", alias="Staff", password="x", is_staff=True)
+
+    def test_staff_flag_and_signed_header_are_profiled(self):
+        url = reverse("lsnz:tournaments")
+        self.client.get(url, {"_profile": "1"})
+        self.client.get(url, headers={"x-profile-token": "forged"})
+        self.assertEqual(profile_names(), [])
+
+        self.client.get(url, headers={"x-profile-token": make_token()})
+        self.client.force_login(self.staff)
+        self.client.get(url, {"_profile": "1"})
+        self.assertEqual(len(profile_names()), 2)
+
+        response = self.client.get(reverse("lsnz:profile_list"))
+        self.assertContains(response, "GET /tournaments")
+        name = response.context["profiles"][0]["name"]
+        response = self.client.get(reverse("lsnz:profile_detail", args=[name]))
+        self.assertContains(response, "SQL timeline")
+        self.assertContains(response, "lsnz_tournament")
+
+    def test_oldest_profiles_beyond_the_cap_are_removed(self):
+        with override_settings(PROFILE_SAMPLE_RATE=1):
+            for _ in range(3):
+                self.client.get(reverse("lsnz:tournaments"))
+        self.assertEqual(len(profile_names()), 2)
+
+    async def test_async_requests_are_profiled(self):
+        url = reverse("lsnz:tournaments")
+        with override_settings(PROFILE_SAMPLE_RATE=1):
+            await self.async_client.get(url)
+        await self.async_client.aforce_login(self.staff)
+        await self.async_client.get(url, {"_profile": "1"})
+
+        names = profile_names()
+        self.assertEqual(len(names), 2)
+        profile = load_profile(names[0][0])
+        self.assertEqual((profile["view"], profile["status"]), ("lsnz:tournaments", 200))
+        self.assertTrue(any("lsnz_tournament" in query for _, _, query in profile["sql"]))
+
+    def test_flame_rows(self):
+        rows = flame_rows([[["main", "view", "query"], 3], [["main", "render"], 1]])
+        self.assertEqual([[cell["label"] for cell in row] for row in rows], [["main"], ["view", "render"], ["query"]])
+        self.assertEqual((rows[1][1]["offset"], rows[1][1]["width"]), (75, 25))
+
+
+class StartupTests(TestCase):
+    def test_parse_importtime(self):
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |   markdown.util\n'
+            'import time:       300 |        420 | markdown\n'
+            'import time:        50 |         50 | json\n'
+        )
+        imports = parse_importtime(output)
+        self.assertEqual(imports[0], ('markdown.util', 120, 120, 1))
+        self.assertEqual(package_totals(imports), [('markdown', 420), ('json', 50)])
+
+    def test_warm_up(self):
+        self.addCleanup(gc.unfreeze)
+        warm_up()
+        self.assertGreater(gc.get_freeze_count(), 0)
+
+    def test_wsgi_boot_defers_optional_imports(self):
+        _, output = run_boot('wsgi', importtime=True)
+        modules = {module for module, _, _, _ in parse_importtime(output)}
+        self.assertIn('lsnz.signals', modules)
+        self.assertNotIn('markdown', modules)
+        self.assertNotIn('PIL.Image', modules)
+
+
+class SitesNearTests(TestCase):
+    def setUp(self):
+        system = System.objects.create(name="Zone", image="", description="")
+        positions = {"Auckland": (-36.85, 174.76), "Wellington": (-41.29, 174.78), "Sydney": (-33.87, 151.21)}
+        with self.captureOnCommitCallbacks(execute=True):
+            for name, (latitude, longitude) in positions.items():
+                Site.objects.create(
+                    name=name, country="NZ", address="1 Main St", system=system, latitude=latitude, longitude=longitude,
+                )
+            Site.objects.create(name="Nowhere", country="NZ", address="?", system=system)
+
+    def test_index_matches_brute_force(self):
+        points = [(i, (i * 37) % 180 - 90, (i * 91) % 360 - 180) for i in range(500)]
+        index = SiteIndex(points)
+        brute = sorted((haversine_km(10, 20, latitude, longitude), i) for i, latitude, longitude in points)
+        # Some points coincide, so compare distances rather than ids
+        nearest = [round(distance, 6) for distance, _ in index.nearest(10, 20, count=5)]
+        self.assertEqual(nearest, [round(distance, 6) for distance, _ in brute[:5]])
+        within = {i for _, i in index.nearest(10, 20, radius_km=2000)}
+        self.assertEqual(within, {i for distance, i in brute if distance <= 2000})
+
+    def test_nearest_endpoint_and_distance_sorted_list(self):
+        url = reverse("lsnz:api_nearest_sites")
+        body = self.client.get(url, {"lat": -37.8, "lng": 175.3, "limit": 2, "fields": "name"}).json()
+        self.assertEqual([site["name"] for site in body["data"]], ["Auckland", "Wellington"])
+        self.assertAlmostEqual(body["data"][0]["distance_km"], 113, delta=5)
+        body = self.client.get(url, {"lat": -37.8, "lng": 175.3, "radius": 200}).json()
+        self.assertEqual(len(body["data"]), 1)
+        self.assertEqual(self.client.get(url, {"lat": 95, "lng": 0}).status_code, 400)
+
+        response = self.client.get(reverse("lsnz:sites"), {"lat": -34, "lng": 151})
+        self.assertEqual([site.name for site in response.context["sites"]], ["Sydney", "Auckland", "Wellington", "Nowhere"])
+
+    def test_index_rebuilds_when_sites_change(self):
+        url = reverse("lsnz:api_nearest_sites")
+        self.client.get(url, {"lat": 0, "lng": 0})
+        with self.captureOnCommitCallbacks(execute=True):
+            Site.objects.filter(name="Nowhere").get().delete()
+            Site.objects.filter(name="Sydney").update(latitude=0.1, longitude=0.1)
+            Site.objects.get(name="Sydney").save()
+        body = self.client.get(url, {"lat": 0, "lng": 0, "limit": 1}).json()
+        self.assertEqual(body["data"][0]["name"], "Sydney")
+
+
+class IndexAdvisorTests(TestCase):
+    def test_plan_problems(self):
+        plan = [
+            "SEARCH lsnz_event USING INDEX lsnz_event_tournament_start (tournament_id=?)",
+            "SCAN lsnz_site",
+            "SCAN lsnz_post USING COVERING INDEX lsnz_post_title_lower",
+            "USE TEMP B-TREE FOR ORDER BY",
+        ]
+        self.assertEqual(
+            plan_problems(plan),
+            ["full scan of lsnz_site", "full index scan of lsnz_post", "temp b-tree for order by"],
+        )
+
+    def test_replay_finds_no_scans_for_case_insensitive_checks(self):
+        seed(players=20)
+        results = replay(replay_requests(), repeat=1)
+        self.assertEqual(len(results["sites"][1]), 1)
+        plans = {plan.sql: plan for plan in query_plans(results) if "LOWER(" in plan.sql}
+        self.assertEqual(len(plans), 2)
+        for plan in plans.values():
+            self.assertEqual(plan.problems, [])
+
+
+class PassSalesTests(TestCase):
+    def setUp(self):
+        system = System.objects.create(name="Zone", image="", description="")
+        self.arena = Site.objects.create(name="Arena", country="NZ", address="1 Main St", system=system)
+        self.other = Site.objects.create(name="Other", country="NZ", address="2 Main St", system=system)
+        self.player = Player.objects.create_user(email="a@example.com", password="x", alias="Ace", home_site=self.arena)
+        self.today = timezone.localdate()
+
+    def sell(self, price, days=30, pass_type="monthly"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Pass.objects.create(
+                player=self.player, pass_type=pass_type, start_date=self.today,
+                end_date=self.today + timedelta(days=days), price_paid=price,
+            )
+
+    def rollups(self):
+        return sorted(PassSalesDay.objects.values_list(
+            "date", "pass_type", "site", "sold", "revenue", "refunded", "refunded_amount", "started", "ended",
+        ))
+
+    def test_rollups_follow_pass_changes(self):
+        first = self.sell("20.00")
+        self.sell("150.00", days=180, pass_type="season")
+        today = PassSalesDay.objects.get(date=self.today, pass_type="monthly")
+        self.assertEqual((today.site, today.sold, today.revenue, today.started), (self.arena, 1, 20, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.player.home_site = self.other
+            self.player.save()
+            first.refunded_at = timezone.now()
+            first.save()
+        today = PassSalesDay.objects.get(date=self.today, pass_type="monthly")
+        self.assertEqual((today.site, today.refunded, today.refunded_amount, today.started), (self.arena, 1, 20, 0))
+        self.assertFalse(PassSalesDay.objects.filter(date=self.today + timedelta(days=30)).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.end_date += timedelta(days=1)
+            first.refunded_at = None
+            first.save()
+        incremental = self.rollups()
+        self.assertEqual(rebuild_pass_sales(), 4)
+        self.assertEqual(self.rollups(), incremental)
+
+        totals = sales_totals(self.today.replace(month=1, day=1), self.today)
+        self.assertEqual([(row["pass_type"], row["sold"], row["net_revenue"], row["active"]) for row in totals], [
+            ("monthly", 1, 20, 1), ("season", 1, 150, 1),
+        ])
+        self.assertEqual(active_passes(self.today + timedelta(days=32)), {("monthly", self.arena.pk): 0, ("season", self.arena.pk): 1})
+
+    def test_admin_refund_updates_rollups_and_player_stats(self):
+        refunded = self.sell("20.00")
+        self.sell("150.00", days=180, pass_type="season")
+        self.client.force_login(Player.objects.create_superuser(email="admin@example.com", password="x", alias="Admin"))
+        self.client.post(reverse("admin:lsnz_pass_changelist"), {"action": "refund", "_selected_action": [refunded.pk]})
+
+        self.assertEqual(PassSalesDay.objects.get(date=self.today, pass_type="monthly").refunded, 1)
+        stats = PlayerStats.objects.get(player=self.player)
+        self.assertEqual((stats.passes_bought, stats.last_pass_end), (1, self.today + timedelta(days=180)))
+
+    def test_dashboard_and_csv_read_only_rollups(self):
+        self.sell("20.00")
+        self.client.force_login(Player.objects.create_superuser(email="admin@example.com", password="x", alias="Admin"))
+        url = reverse("admin:lsnz_pass_sales")
+        params = {"start": self.today.replace(month=1, day=1), "end": self.today}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+            export = self.client.get(url, {**params, "format": "csv"})
+        self.assertContains(response, "Arena")
+        self.assertFalse([query for query in queries if 'FROM "lsnz_pass"' in query["sql"]])
+        self.assertEqual(export.content.decode().splitlines(), [
+            "date,pass_type,site,sold,revenue,refunded,refunded_amount,net_revenue",
+            f"{self.today},monthly,Arena,1,20.00,0,0.00,20.00",
+        ])
+        self.assertContains(self.client.get(url, {"start": self.today, "end": self.today - timedelta(days=1)}), "before the start")
+
+
+class ScheduleClashTests(TestCase):
+    def setUp(self):
+        start = timezone.now().replace(microsecond=0) + timedelta(days=7)
+        self.nationals = make_tournament(start=start, events=2)
+        self.open = make_tournament(name="Open", start=start + timedelta(minutes=30))
+        self.player = Player.objects.create_user(email="a@example.com", password="x", alias="Ace")
+        self.first, self.second = self.nationals.events.order_by("start_time")
+        Registration.objects.create(event=self.first, player=self.player)
+
+    def test_sweep_matches_brute_force(self):
+        intervals = [((i * 37) % 100, (i * 37) % 100 + (i * 11) % 20, i) for i in range(200)]
+        found = {frozenset(pair) for pair in overlaps(intervals)}
+        expected = {
+            frozenset((a[2], b[2])) for a in intervals for b in intervals
+            if a[2] < b[2] and a[0] < b[1] and b[0] < a[1]
+        }
+        self.assertEqual(found, expected)
+
+    def test_forms_reject_clashing_events(self):
+        form = TournamentRegistrationForm({f"event_{self.second.pk}": "on"}, tournament=self.nationals, user=self.player)
+        self.assertTrue(form.is_valid(), form.errors)
+
+        clashing = self.open.events.get()
+        form = TournamentRegistrationForm({f"event_{clashing.pk}": "on"}, tournament=self.open, user=self.player)
+        self.assertFalse(form.is_valid())
+        self.assertIn("overlaps Solos at Nationals", str(form.non_field_errors()))
+
+        form = EventRegistrationForm({"event": clashing.pk}, tournament=self.open, user=self.player)
+        self.assertFalse(form.is_valid())
+        self.assertIn("event", form.errors)
+
+    def test_admin_report_lists_clashes_across_tournaments(self):
+        Registration.objects.create(event=self.open.events.get(), player=self.player)
+        clashes = tournament_clashes(self.nationals)
+        self.assertEqual([(clash.first.event, clash.second.event.tournament) for clash in clashes], [(self.first, self.open)])
+
+        self.client.force_login(Player.objects.create_superuser(email="admin@example.com", password="x", alias="Admin"))
+        response = self.client.get(reverse("admin:lsnz_tournament_clashes", args=[self.open.pk]))
+        self.assertContains(response, "Ace")
+        self.assertContains(self.client.get(reverse("admin:lsnz_tournament_change", args=[self.open.pk])), "Schedule clashes")
+
+
+class HistoryExportTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.tournament = make_tournament()
+        self.player = Player.objects.create_user(email="a@example.com", password="x", alias="Ace")
+        self.registration = Registration.objects.create(event=self.tournament.events.get(), player=self.player)
+        self.settle()
+
+    def settle(self):
+        # Rows changed within the last minute wait for the next run
+        past = timezone.now() - timedelta(minutes=5)
+        for model in (Tournament, Event, Registration, Pass, Game, GameResult):
+            model.objects.filter(updated_at__gt=past).update(updated_at=past)
+        TournamentArchive.objects.update(archived_at=past)
+
+    def export(self, **kwargs):
+        return dict(export_all(self.directory, format="jsonl", **kwargs))
+
+    def rows(self, table):
+        rows = []
+        for name in sorted(os.listdir(os.path.join(self.directory, table))):
+            with open(os.path.join(self.directory, table, name)) as f:
+                rows.append([json.loads(line) for line in f])
+        return rows
+
+    def test_incremental_export(self):
+        counts = self.export()
+        self.assertEqual((counts["tournaments"], counts["events"], counts["registrations"]), (1, 1, 1))
+        self.assertEqual(self.export()["registrations"], 0)
+
+        Registration.objects.filter(pk=self.registration.pk).update(paid=True, updated_at=timezone.now() - timedelta(minutes=2))
+        other = Player.objects.create_user(email="b@example.com", password="x", alias="Blaze")
+        Registration.objects.create(event=self.tournament.events.get(), player=other)
+        self.assertEqual(self.export(row_group_size=1)["registrations"], 1)
+        first, second = self.rows("registrations")
+        self.assertEqual((first[0]["paid"], second[0]["paid"]), (False, True))
+
+        Registration.objects.filter(player=other).update(updated_at=timezone.now() - timedelta(seconds=90))
+        self.assertEqual(self.export()["registrations"], 1)
+        self.assertEqual(self.export(full=True, names=["registrations"]), {"registrations": 2})
+        self.assertEqual([len(rows) for rows in self.rows("registrations")], [2])
+
+    @override_settings(EXPORT_SETTLE_SECONDS=600)
+    def test_settle_window_is_configurable(self):
+        # Changed five minutes ago, so still inside a ten minute window
+        self.assertEqual(self.export()["registrations"], 0)
+
+    @skipUnless(pq, "pyarrow is not installed")
+    def test_parquet_export_of_every_table(self):
+        old = make_tournament(name="Old", start=timezone.now() - timedelta(days=800))
+        Registration.objects.create(event=old.events.get(), player=self.player, paid=True)
+        game = Game.objects.create(event=old.events.get(), number=1)
+        GameResult.objects.create(game=game, player=self.player, score=900)
+        archive_tournament(old)
+        game = Game.objects.create(event=self.tournament.events.get(), number=1)
+        GameResult.objects.create(game=game, player=self.player, score=1200)
+        Pass.objects.create(
+            player=self.player, pass_type="monthly", start_date=timezone.localdate(),
+            end_date=timezone.localdate() + timedelta(days=30), price_paid="20.00",
+        )
+        self.settle()
+
+        counts = dict(export_all(self.directory, format="parquet", row_group_size=1))
+        self.assertEqual(set(counts), {export.name for export in EXPORTS})
+        self.assertTrue(all(counts.values()), counts)
+        entries = pq.read_table(os.path.join(self.directory, "archived_entries", os.listdir(
+            os.path.join(self.directory, "archived_entries"))[0]))
+        self.assertEqual(entries.column("archive_id").to_pylist(), [old.pk])
+        tournaments = pq.ParquetFile(os.path.join(self.directory, "tournaments", os.listdir(
+            os.path.join(self.directory, "tournaments"))[0]))
+        self.assertEqual(tournaments.metadata.num_row_groups, 2)
+
+    def test_command_requires_pyarrow_for_parquet(self):
+        if pq is None:
+            with self.assertRaises(CommandError):
+                call_command("export_history", self.directory, "--format", "parquet", stdout=StringIO())
+        call_command("export_history", self.directory, "--format", "jsonl", "--table", "events", stdout=StringIO())
+        self.assertEqual(os.listdir(os.path.join(self.directory, "events"))[0][-6:], ".jsonl")
+
+
+class HomepageTests(TransactionTestCase):
+    # Missing blocks are rendered in other threads, which only see committed rows
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.tournament = make_tournament()
+        self.author = get_user_model().objects.create_user(email="author@example.com", password="x", alias="Author")
+
+    def test_blocks_are_cached_and_invalidated(self):
+        response = self.client.get(reverse("lsnz:index"))
+        self.assertContains(response, "Nationals")
+        self.assertEqual(set(cache.get_many([block.key for block in BLOCKS])), {block.key for block in BLOCKS})
+
+        with self.assertNumQueries(0):
+            self.client.get(reverse("lsnz:index"))
+
+        Post.objects.create(title="Season opener", summary="Summary", body="Body", image="", author=self.author)
+        self.assertIsNone(cache.get("homepage:latest_posts"))
+        self.assertIsNotNone(cache.get("homepage:upcoming_tournaments"))
+        self.assertContains(self.client.get(reverse("lsnz:index")), "Season opener")
+
+    def test_only_shown_player_fields_invalidate(self):
+        self.client.get(reverse("lsnz:index"))
+        self.assertTrue(self.client.login(email="author@example.com", password="x"))
+        self.assertIsNotNone(cache.get("homepage:latest_posts"))
+
+        author = Player.objects.get(pk=self.author.pk)
+        author.bio = "Plays on weekends"
+        author.save()
+        self.assertIsNotNone(cache.get("homepage:active_players"))
+
+        author.alias = "Writer"
+        author.save()
+        self.assertIsNone(cache.get("homepage:latest_posts"))
+        self.assertIsNone(cache.get("homepage:active_players"))
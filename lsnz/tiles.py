@@ -0,0 +1,93 @@
+import math
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+
+from .jobs import job
+from .models import MazeMap
+from .storage import tile_storage
+
+TILE_SIZE = 256
+TILE_QUALITY = 80
+PREVIEW_SIZE = (480, 480)
+TILE_BACKGROUND = (255, 255, 255)
+
+
+def tile_path(maze_map, zoom, x, y):
+    return f'maze_tiles/{maze_map.pk}/{zoom}/{x}/{y}.jpg'
+
+
+def max_zoom_for(width, height):
+    """Zoom level at which the image is shown at full resolution (level 0 fits one tile)."""
+    return max(0, math.ceil(math.log2(max(width, height) / TILE_SIZE)))
+
+
+def save_jpeg(image, **kwargs):
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=TILE_QUALITY, optimize=True, **kwargs)
+    return ContentFile(buffer.getvalue())
+
+
+@job
+def delete_tiles(maze_map_id, path=None):
+    """Remove every tile stored for the maze map with id ``maze_map_id``."""
+    path = path or f'maze_tiles/{maze_map_id}'
+    if not tile_storage.exists(path):
+        return
+    directories, files = tile_storage.listdir(path)
+    for name in files:
+        tile_storage.delete(f'{path}/{name}')
+    for name in directories:
+        delete_tiles(maze_map_id, f'{path}/{name}')
+
+
+def build_tiles(maze_map):
+    """
+    Cut ``maze_map.image`` into a pyramid of 256px JPEG tiles plus a preview.
+
+    Zoom level ``max_zoom`` holds the image at full resolution and each level
+    below halves it, down to level 0 where the whole map fits a single tile.
+    Tiles on the right and bottom edges are padded so every tile is square.
+    """
+    # Signal handlers import this module at start-up, Pillow only loads when tiles are built
+    from PIL import Image
+
+    with maze_map.image.open('rb') as f, Image.open(f) as source:
+        image = source.convert('RGB')
+
+    width, height = image.size
+    max_zoom = max_zoom_for(width, height)
+    delete_tiles(maze_map.pk)
+
+    level = image
+    for zoom in range(max_zoom, -1, -1):
+        if zoom != max_zoom:
+            level = level.resize(
+                (max(1, math.ceil(level.width / 2)), max(1, math.ceil(level.height / 2))),
+                Image.Resampling.LANCZOS,
+            )
+        for x in range(math.ceil(level.width / TILE_SIZE)):
+            for y in range(math.ceil(level.height / TILE_SIZE)):
+                box = (x * TILE_SIZE, y * TILE_SIZE, (x + 1) * TILE_SIZE, (y + 1) * TILE_SIZE)
+                tile = Image.new('RGB', (TILE_SIZE, TILE_SIZE), TILE_BACKGROUND)
+                tile.paste(level.crop((box[0], box[1], min(box[2], level.width), min(box[3], level.height))))
+                tile_storage.save(tile_path(maze_map, zoom, x, y), save_jpeg(tile))
+
+    preview = image.copy()
+    preview.thumbnail(PREVIEW_SIZE)
+    if maze_map.preview:
+        maze_map.preview.delete(save=False)
+    maze_map.preview.save(f'{maze_map.pk}.jpg', save_jpeg(preview, progressive=True), save=False)
+
+    maze_map.width = width
+    maze_map.height = height
+    maze_map.max_zoom = max_zoom
+    maze_map.save(update_fields=['preview', 'width', 'height', 'max_zoom'])
+
+
+@job(priority=5)
+def build_maze_tiles(maze_map_id):
+    """Build tiles for a newly uploaded maze map."""
+    maze_map = MazeMap.objects.filter(pk=maze_map_id).first()
+    if maze_map is not None:
+        build_tiles(maze_map)
@@ -0,0 +1,83 @@
+from fnmatch import fnmatch
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.template.defaultfilters import filesizeformat
+
+# Leading bytes of the image formats we accept
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+
+def sniff_image_type(header):
+    """Return the image MIME type ``header`` starts with, or None if it isn't an image."""
+    for signature, content_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return content_type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def image_upload_limit(field_name):
+    """The size limit for uploads to ``field_name``, or None if it isn't an image field."""
+    for pattern, limit in settings.IMAGE_UPLOAD_LIMITS:
+        if fnmatch(field_name, pattern):
+            return limit
+    return None
+
+
+class RejectedUpload(UploadedFile):
+    """Stands in for an upload that was refused while it streamed in."""
+
+    def __init__(self, name, content_type, error):
+        super().__init__(None, name, content_type, 0)
+        self.error = error
+
+
+class ImageUploadHandler(FileUploadHandler):
+    """
+    Check image uploads while they stream in, before they reach disk.
+
+    Files for fields listed in ``settings.IMAGE_UPLOAD_LIMITS`` are refused
+    as soon as they go over their size limit, or straight away if the first
+    chunk doesn't start with a known image header. The rest of a refused
+    file is dropped rather than passed on to the handlers that write it out,
+    and a ``RejectedUpload`` carrying the reason takes its place in
+    ``request.FILES``. ``UploadValidationMixin`` turns that into a form error.
+
+    Must come before Django's own handlers in ``FILE_UPLOAD_HANDLERS``.
+    """
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.limit = image_upload_limit(field_name)
+        self.error = None
+        if self.limit and self.content_length and self.content_length > self.limit:
+            self.reject_size()
+
+    def reject_size(self):
+        self.error = f'Image file size must be less than {filesizeformat(self.limit)}.'
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.limit is None:
+            return raw_data
+        if self.error:
+            return None
+        if start + len(raw_data) > self.limit:
+            self.reject_size()
+            return None
+        if start == 0 and sniff_image_type(raw_data) is None:
+            self.error = 'File must be a PNG, JPEG, GIF or WebP image.'
+            return None
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.limit is not None and self.error:
+            return RejectedUpload(self.file_name, self.content_type, self.error)
+        return None
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 from .views import (
     PlayerDetailView,
     PlayerListView,
@@ -16,6 +16,7 @@ from .views import (
     TournamentDetailView,
     TournamentListView,
     TournamentRegistrationView,
+    TournamentScoreboardView,
 )
 
 app_name = "lsnz"
@@ -24,6 +25,8 @@ urlpatterns = [
     path("", views.index, name="index"),
     path("tournaments", TournamentListView.as_view(), name="tournaments"),
     path("tournaments/<slug:slug>", TournamentDetailView.as_view(), name="tournament_detail"),
+    path("tournaments/<slug:slug>/live", TournamentScoreboardView.as_view(), name="tournament_scoreboard"),
+    path("tournaments/<slug:slug>/live/stream", views.tournament_scoreboard_stream, name="tournament_scoreboard_stream"),
     path("tournaments/<slug:slug>/register", TournamentRegistrationView.as_view(), name="tournament_register"),
     path("systems", SystemListView.as_view(), name="systems"),
     path("systems/<slug:slug>", SystemDetailView.as_view(), name="system_detail"),
@@ -38,6 +41,13 @@ urlpatterns = [
     path("blog/<slug:slug>", PostDetailView.as_view(), name="post_detail"),
     path("write", PostCreateView.as_view(), name="write_post"),
     path("edit/<slug:slug>", PostUpdateView.as_view(), name="edit_blog_post"),
+    path("api/v1/", api.index, name="api_index"),
+    path("api/v1/nearest-sites", api.nearest_site_list, name="api_nearest_sites"),
+    path("api/v1/<str:resource>", api.resource_list, name="api_list"),
+    path("api/v1/<str:resource>/<str:key>", api.resource_detail, name="api_detail"),
+    path("metrics", views.metrics, name="metrics"),
+    path("admin/profiles/", views.profile_list, name="profile_list"),
+    path("admin/profiles/<str:name>", views.profile_detail, name="profile_detail"),
     path("about", views.about, name="about"),
     path("privacy", views.privacy, name="privacy"),
     path("terms", views.terms, name="terms"),
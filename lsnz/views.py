@@ -1,23 +1,36 @@
+import json
 import os
 
-import markdown
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.contrib import messages
+from django.contrib import admin, messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.asgi import ASGIRequest
+from django.core.paginator import Paginator
 from django.db.models import Count
-from django.shortcuts import get_object_or_404, render
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, render
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import CreateView, FormView, UpdateView
 from django.views.generic.list import ListView
 
+from .analytics import player_matchups
 from .forms import PlayerProfileForm, PostForm, TournamentRegistrationForm
+from .geo import nearest_sites, parse_location
+from .homepage import homepage_blocks
+from .live import archived_standings, render_scoreboard, scoreboard_stream, sse_message
+from .metrics import render_metrics
+from .profiling import flame_rows, load_profile, self_time, slowest_profiles
 from .models import (
     Event,
     Format,
-    Grade,
     MazeMap,
     Player,
+    PlayerStats,
     Post,
     Registration,
     Site,
@@ -28,6 +41,9 @@ from .models import (
 
 def load_markdown_content(filename):
     """Load and convert markdown file to HTML"""
+    # Only the static text pages need markdown, so it isn't imported at start-up
+    import markdown
+
     content_path = os.path.join(settings.BASE_DIR, 'lsnz', 'content', filename)
 
     try:
@@ -37,11 +53,20 @@ def load_markdown_content(filename):
     except FileNotFoundError:
         return '<p>Content not found.</p>'
 
-def index(request):
-    context = {}
-    return render(request, "lsnz/base.html", context)
+class TemplateEngineMixin:
+    """Render with the Jinja2 engine when the template is listed in settings.JINJA2_TEMPLATES"""
+
+    @property
+    def template_engine(self):
+        if self.template_name in settings.JINJA2_TEMPLATES:
+            return 'jinja2'
+        return None
+
+async def index(request):
+    blocks = await homepage_blocks()
+    return await sync_to_async(render)(request, 'lsnz/home.html', {'blocks': blocks})
 
-class TournamentListView(ListView):
+class TournamentListView(TemplateEngineMixin, ListView):
     model = Tournament
     template_name = 'lsnz/tournaments.html'
     context_object_name = 'tournaments'
@@ -52,10 +77,22 @@ class TournamentDetailView(DetailView):
     model = Tournament
     template_name = 'lsnz/tournament_detail.html'
     context_object_name = 'tournament'
+    queryset = Tournament.objects.select_related('site', 'system', 'archive')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        tournament = self.get_object()
+        tournament = self.object
+
+        # Registration counts are stored on each event, so one query covers the table
+        context['events'] = tournament.events.select_related('format').order_by('start_time')
+
+        # Archived tournaments have no games left, their results come from the archive
+        context['archive'] = getattr(tournament, 'archive', None)
+        if context['archive']:
+            standings = archived_standings(context['archive'])
+            context['events'] = list(context['events'])
+            for event in context['events']:
+                event.standings = standings[event.pk]
 
         # Check if tournament is in the future
         context['is_future_tournament'] = tournament.start_date > timezone.now().date()
@@ -72,11 +109,54 @@ class TournamentDetailView(DetailView):
 
         return context
 
+class TournamentScoreboardView(DetailView):
+    model = Tournament
+    template_name = 'lsnz/tournament_scoreboard.html'
+    context_object_name = 'tournament'
+
+async def tournament_scoreboard_stream(request, slug):
+    tournament = await aget_object_or_404(Tournament, slug=slug)
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(scoreboard_stream(tournament.pk), content_type='text/event-stream')
+    else:
+        # WSGI workers can't hold connections open, so send the current
+        # scoreboard and let the browser reconnect for the next one
+        html = await sync_to_async(render_scoreboard)(tournament.pk)
+        response = HttpResponse(
+            sse_message(json.dumps({'html': html}), event='scoreboard', retry=10000),
+            content_type='text/event-stream',
+        )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 class SiteListView(ListView):
+    """All sites by name, or nearest first when ``lat`` and ``lng`` are given."""
     model = Site
     template_name = 'lsnz/sites.html'
     context_object_name = 'sites'
     ordering = ['name']
+    queryset = Site.objects.select_related('system')
+
+    def get_location(self):
+        try:
+            return parse_location(self.request.GET['lat'], self.request.GET['lng'])
+        except (KeyError, ValueError):
+            return None
+
+    def get_queryset(self):
+        location = self.get_location()
+        if location is None:
+            return super().get_queryset()
+        sites = nearest_sites(*location, queryset=self.queryset)
+        # Sites without a position go last, by name
+        located = {site.pk for site in sites}
+        return sites + [site for site in super().get_queryset() if site.pk not in located]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['location'] = self.get_location()
+        return context
 
 class SiteDetailView(DetailView):
     model = Site
@@ -85,8 +165,8 @@ class SiteDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        site = self.get_object()
-        
+        site = self.object
+
         # Fetch all maze maps for this site, ordered by date (newest first)
         maze_maps = MazeMap.objects.filter(site=site).order_by('-date')
         context['maze_maps'] = maze_maps
@@ -116,7 +196,7 @@ class SystemDetailView(DetailView):
         context['tournaments'] = Tournament.objects.filter(system=system).select_related('site').order_by('-start_date')
         return context
 
-class PlayerListView(ListView):
+class PlayerListView(TemplateEngineMixin, ListView):
     model = Player
     template_name = 'lsnz/players.html'
     context_object_name = 'players'
@@ -156,14 +236,30 @@ class PlayerDetailView(DetailView):
     model = Player
     template_name = 'lsnz/player_detail.html'
     context_object_name = 'player'
+    queryset = Player.objects.select_related('grade', 'home_site', 'stats')
+    posts_per_page = 12
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        player = self.get_object()
-        posts = Post.objects.filter(author=player).order_by('-created_at')
-        grades = Grade.objects.all().order_by('points')
-        context['posts'] = posts
-        context['grades'] = grades
+        player = self.object
+        stats = getattr(player, 'stats', None)
+
+        paginator = Paginator(
+            Post.objects.filter(author=player).select_related('author').order_by('-created_at'),
+            self.posts_per_page,
+        )
+        if stats is None:
+            # Players who have not had a stats row written yet still get a real COUNT
+            stats = PlayerStats(player=player)
+        else:
+            # The post count comes from the stats row instead of a COUNT query
+            paginator.count = stats.post_count
+        page_obj = paginator.get_page(self.request.GET.get('page'))
+
+        context['stats'] = stats
+        context['matchups'] = player_matchups(player.pk)
+        context['posts'] = page_obj.object_list
+        context['page_obj'] = page_obj
         return context
 
 class PlayerUpdateView(LoginRequiredMixin, UpdateView):
@@ -216,7 +312,7 @@ class TournamentRegistrationView(LoginRequiredMixin, FormView):
     def get_success_url(self):
         return f"/tournaments/{self.kwargs['slug']}"
 
-class PostListView(ListView):
+class PostListView(TemplateEngineMixin, ListView):
     model = Post
     template_name = 'lsnz/posts.html'
     context_object_name = 'posts'
@@ -274,6 +370,36 @@ class PostUpdateView(LoginRequiredMixin, UpdateView):
 
 
 
+def metrics(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            raise PermissionDenied
+    elif not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@staff_member_required
+def profile_list(request):
+    return render(request, 'admin/lsnz/profiles.html', {
+        **admin.site.each_context(request),
+        'title': 'Slowest profiled requests',
+        'profiles': slowest_profiles(),
+    })
+
+@staff_member_required
+def profile_detail(request, name):
+    profile = load_profile(name)
+    if profile is None:
+        raise Http404('No such profile.')
+    return render(request, 'admin/lsnz/profile_detail.html', {
+        **admin.site.each_context(request),
+        'title': f'{profile["method"]} {profile["path"]}',
+        'profile': profile,
+        'flame_rows': flame_rows(profile['samples']),
+        'self_time': self_time(profile['samples']),
+    })
+
 def about(request):
     """View for about page"""
     context = {
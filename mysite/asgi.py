@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_asgi_application()
+
+# Set WSGI_PRELOAD=1 to import views and compile templates before the first
+# request, as in wsgi.py.
+if os.getenv('WSGI_PRELOAD'):
+    from lsnz.startup import warm_up
+
+    warm_up()
@@ -52,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'lsnz.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,6 +61,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
+    'lsnz.profiling.ProfilingMiddleware',
 ]
 
 # # Provider specific settings
@@ -99,14 +101,39 @@ TEMPLATES = [
             ],
         },
     },
+    {
+        # Jinja2 ports of the heaviest list templates live in lsnz/jinja2/.
+        # Views only render them for names listed in JINJA2_TEMPLATES.
+        'BACKEND': 'django.template.backends.jinja2.Jinja2',
+        'NAME': 'jinja2',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'environment': 'lsnz.jinja2_env.environment',
+            'extensions': ['django_bootstrap5.jinja2.BootstrapTags'],
+            'context_processors': [
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+
+# Templates to render with the Jinja2 engine instead of the Django one.
+# Compare the two with `manage.py benchmark_templates` before adding to this.
+JINJA2_TEMPLATES = [
+    name for name in os.getenv('JINJA2_TEMPLATES', '').split(',') if name
 ]
 
 AUTHENTICATION_BACKENDS = [
     # Needed to login by username in Django admin, regardless of `allauth`
-    'django.contrib.auth.backends.ModelBackend',
+    # (cached variant of django.contrib.auth.backends.ModelBackend)
+    'lsnz.backends.CachedModelBackend',
 
     # `allauth` specific authentication methods, such as login by email
-    'allauth.account.auth_backends.AuthenticationBackend',
+    # (cached variant of allauth.account.auth_backends.AuthenticationBackend)
+    'lsnz.backends.CachedAuthenticationBackend',
 ]
 
 WSGI_APPLICATION = 'mysite.wsgi.application'
@@ -123,6 +150,46 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Use a shared backend (e.g. Redis or Memcached) when running more than one
+# worker process so that sessions and cached players are shared.
+
+CACHES = {
+    'default': {
+        # Counts hits and misses for /metrics, then hands over to INSTRUMENTED_BACKEND
+        'BACKEND': 'lsnz.metrics.InstrumentedCache',
+        'INSTRUMENTED_BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Sessions are read from the cache and written through to the database
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Live scoreboards. LocalBroker only sees changes made in the same process;
+# use lsnz.live.CacheBroker with a shared cache when running several.
+LIVE_BROKER = os.getenv('LIVE_BROKER', 'lsnz.live.LocalBroker')
+LIVE_POLL_INTERVAL = 2
+
+# /metrics requires "Authorization: Bearer <METRICS_TOKEN>", or a staff login
+# when no token is set. Multi-process servers need a shared METRICS_DIR.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 5
+
+# Sampling profiler, see lsnz.profiling. Staff can view profiles at /admin/profiles/
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.getenv('PROFILE_DIR', BASE_DIR / 'profiles')
+PROFILE_MAX_FILES = 200
+PROFILE_INTERVAL = 0.005
+
+# Grade suggestions, see lsnz.grading
+GRADING_WINDOW_DAYS = 365
+GRADING_MIN_GAMES = 10
+GRADING_DEMOTION_MARGIN = 5
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
@@ -181,13 +248,64 @@ STATIC_URL = "static/"
 if DEBUG:
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 else:
-    EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    # Messages are stored and sent by `manage.py send_queued_email`
+    EMAIL_BACKEND = 'lsnz.mail.QueuedEmailBackend'
     EMAIL_HOST = os.getenv('EMAIL_HOST', 'localhost')
     EMAIL_PORT = int(os.getenv('EMAIL_PORT', 587))
     EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'True') == 'True'
     EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
     EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
+QUEUED_EMAIL_DELIVERY_BACKEND = os.getenv(
+    'QUEUED_EMAIL_DELIVERY_BACKEND', 'django.core.mail.backends.smtp.EmailBackend'
+)
 
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Image uploads are checked for size and a real image header while they
+# stream in. The first pattern matching the form field name sets the limit.
+FILE_UPLOAD_HANDLERS = [
+    'lsnz.uploads.ImageUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+IMAGE_UPLOAD_LIMITS = [
+    ('mazemap_set-*-image', 20 * 1024 * 1024),
+    ('image', 5 * 1024 * 1024),
+    ('profile_picture', 5 * 1024 * 1024),
+]
+
+# Partially uploaded maze maps, kept out of MEDIA_ROOT until complete
+CHUNKED_UPLOAD_DIR = BASE_DIR / 'uploads_in_progress'
+
+# Uploads are stored once per distinct content under media/blobs/, so files
+# there never change and can be served with "Cache-Control: public,
+# max-age=31536000, immutable". Run `manage.py collect_media_garbage`
+# periodically to remove blobs that are no longer used.
+STORAGES = {
+    'default': {
+        'BACKEND': 'lsnz.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Tournaments that ended this long ago have their teams, registrations and
+# games moved into summary records, see lsnz.archive
+ARCHIVE_AFTER_DAYS = 730
+
+# How long an event without an end time is assumed to last when checking
+# registrations for schedule clashes, see lsnz.schedule
+EVENT_DEFAULT_MINUTES = 60
+
+# Incremental history exports leave rows changed this recently for the next
+# run. Keep it above the longest transaction writing tournament data, such
+# as a large CSV import; see lsnz.export
+EXPORT_SETTLE_SECONDS = 60
+
+# Read-only JSON API, see lsnz.api
+API_DEFAULT_LIMIT = 50
+API_MAX_LIMIT = 200
+API_MAX_AGE = 60
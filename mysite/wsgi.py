@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_wsgi_application()
+
+# Set WSGI_PRELOAD=1 to import views and compile templates before the first
+# request; with gunicorn --preload it runs once, before workers are forked.
+if os.getenv('WSGI_PRELOAD'):
+    from lsnz.startup import warm_up
+
+    warm_up()